@@ -2,12 +2,25 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import os
-import base64
 from datetime import datetime
 import json
+import logging
 import plotly.express as px
+import time
 from supabase import create_client, Client
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import hashlib
+import html
+import threading
+import contextlib
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+from itertools import chain
+from imagens_estoque import CacheImagens, salva_imagem_estoque, imagem_para_card, caminhos_imagem, pasta_imagens, formato_imagem
+from diario_vendas import DiarioVendas, SincronizadorVendas
+from importacao import le_planilha, valida_importacao_estoque, modelo_planilha_estoque, sugere_mapeamento_vendas, valida_importacao_vendas, CAMPOS_VENDAS
+
+logger = logging.getLogger(__name__)
 
 # --- Configuração da Página ---
 st.set_page_config(page_title="Bambuar V3", layout="wide")
@@ -15,6 +28,10 @@ st.set_page_config(page_title="Bambuar V3", layout="wide")
 # --- Conexão com Supabase ---
 @st.cache_resource
 def init_supabase_client():
+    # BAMBUAR_BACKEND=local troca o Supabase pelo stand-in em memória (benchmarks, uso offline)
+    if os.environ.get("BAMBUAR_BACKEND") == "local":
+        from supabase_local import LocalSupabase
+        return LocalSupabase()
     try:
         url = st.secrets["supabase"]["url"]
         key = st.secrets["supabase"]["key"]
@@ -35,33 +52,194 @@ def get_empresa_info(user_id):
         return perfil.get('empresa_id'), perfil['empresas'].get('nome_empresa')
     except Exception: return None, None
 
-# No seu código, encontre e substitua esta função inteira:
+# --- Versões de Cache por (empresa, tabela) ---
+# Cada escrita incrementa a versão só das tabelas tocadas pela empresa que escreveu.
+# A versão entra na chave do cache de load_data, então as outras empresas e tabelas
+# continuam servidas do cache em vez de um st.cache_data.clear() global.
+TODAS_EMPRESAS = '*'
+
+class VersoesCache:
+    """Contadores de versão por (empresa_id, tabela), compartilhados entre sessões."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._versoes = {}
+
+    def versao(self, empresa_id, tabela):
+        with self._lock:
+            if empresa_id is None:
+                # Leitura sem empresa (ex.: tabela inteira) muda a cada escrita na tabela
+                return self._versoes.get((TODAS_EMPRESAS, tabela), 0)
+            # Escritas sem empresa conhecida (empresa_id None) invalidam a tabela para todos
+            return (self._versoes.get((empresa_id, tabela), 0), self._versoes.get((None, tabela), 0))
+
+    def invalidar(self, empresa_id, *tabelas):
+        with self._lock:
+            for tabela in tabelas:
+                for chave in ((empresa_id, tabela), (TODAS_EMPRESAS, tabela)):
+                    self._versoes[chave] = self._versoes.get(chave, 0) + 1
+
+@st.cache_resource
+def get_versoes_cache():
+    return VersoesCache()
+
+def invalida_tabelas(empresa_id, *tabelas):
+    """Invalida o cache de load_data apenas para as tabelas informadas desta empresa."""
+    get_versoes_cache().invalidar(empresa_id, *tabelas)
+
+# --- Paginação do load_data ---
+# O PostgREST corta cada resposta em max-rows (1000 no Supabase), então as tabelas
+# grandes são lidas em páginas de range() buscadas em paralelo.
+LOAD_PAGE_SIZE = int(os.environ.get("BAMBUAR_LOAD_PAGE_SIZE", 1000))
+LOAD_MAX_CONCURRENCY = int(os.environ.get("BAMBUAR_LOAD_MAX_CONCURRENCY", 4))
+
+# --- Projeções por consumidor ---
+# Colunas que cada aba realmente usa, para não baixar select("*") em toda rerun.
+PROJECOES = {
+    'saldo': {
+        'estoque': 'produto_base_id, atributos, quantidade, valor_custo',
+        'vendas': 'atributos, quantidade_vendida',
+    },
+    'dashboard': {
+        'estoque': 'produto_base_id, atributos, quantidade, valor_custo',
+    },
+    'resumo_diario': {
+        'vendas': 'data_venda, produto_base_id, evento, forma_pagamento, atributos, quantidade_vendida, preco_venda, desconto, taxa_pagamento, custo_evento',
+    },
+    'dre': {
+        'estoque': 'produto_base_id, valor_custo',
+        'vendas': 'produto_base_id, data_venda, preco_venda, quantidade_vendida, desconto, taxa_pagamento, evento, custo_evento',
+    },
+    'resumo': {
+        'estoque': 'produto_base_id, valor_custo',
+        'vendas': 'produto_base_id, atributos, quantidade_vendida, preco_venda, desconto, evento, custo_evento, forma_pagamento, taxa_pagamento',
+    },
+    'custo_medio': {
+        'estoque': 'valor_custo',
+    },
+    'uso_atributos': {
+        'estoque': 'atributos',
+        'vendas': 'atributos',
+    },
+    'uso_taxas': {
+        'vendas': 'forma_pagamento',
+    },
+}
+
+LIMITE_HISTORICO_VENDAS = 100
+
+def aplica_ordem(query, ordem):
+    """Aplica uma ordem no formato do PostgREST ('data_venda.desc,id.desc', com .nullsfirst/.nullslast opcionais)."""
+    colunas = []
+    for item in (ordem.split(',') if ordem else []):
+        coluna, *modificadores = item.strip().split('.')
+        nullsfirst = True if 'nullsfirst' in modificadores else False if 'nullslast' in modificadores else None
+        query = query.order(coluna, desc='desc' in modificadores, nullsfirst=nullsfirst)
+        colunas.append(coluna)
+    # Ordem estável é obrigatória para que as páginas não se sobreponham
+    if 'id' not in colunas:
+        query = query.order('id')
+    return query
+
+def monta_query(table_name: str, query_params: dict, count=None):
+    """Monta a consulta filtrada. Retorna None quando um filtro de lista vazia garante resultado vazio.
+
+    Além de "filters" (eq/in/is), aceita "gt"/"gte"/"lte" ({coluna: valor}), "order" e "limit".
+    """
+    query = supabase.table(table_name).select(query_params.get("select", "*"), count=count)
+    filters = query_params.get("filters", {})
+    
+    for key, value in filters.items():
+        if isinstance(value, list):
+            if not value: return None
+            query = query.in_(key, value)
+        # MUDANÇA AQUI: Reconhece e aplica filtros especiais do Supabase/PostgREST
+        elif isinstance(value, str) and value.startswith('is.'):
+            # Extrai o valor do filtro, ex: 'null', 'true', 'false'
+            filter_value = value.split('.')[1]
+            query = query.is_(key, filter_value)
+        else:
+            query = query.eq(key, value)
+    for key, value in query_params.get("gt", {}).items():
+        query = query.gt(key, value)
+    for key, value in query_params.get("gte", {}).items():
+        query = query.gte(key, value)
+    for key, value in query_params.get("lte", {}).items():
+        query = query.lte(key, value)
+    return aplica_ordem(query, query_params.get("order"))
+
+def busca_paginada(table_name: str, query_params: dict, contexto=None):
+    """Executa a consulta em páginas de range() e monta um único DataFrame. Erros sobem.
+
+    Nunca pede count exato (no PostgREST é um COUNT(*) sob RLS a cada carga). Com concorrência,
+    as páginas previstas vêm em paralelo: até o "limit", ou, sem ele, até a estimativa do
+    planner (count=planned) trazida pela primeira página. Depois segue página a página até uma
+    vir incompleta, então uma estimativa baixa não perde linhas. Com "limit" até page_size é
+    uma chamada só, sem count.
+    """
+    page_size = query_params.get("page_size", LOAD_PAGE_SIZE)
+    max_concurrency = query_params.get("max_concurrency", LOAD_MAX_CONCURRENCY)
+    limite = query_params.get("limit")
+    if limite is not None:
+        page_size = max(1, min(page_size, limite))
+    paralelo = max_concurrency > 1
+
+    query = monta_query(table_name, query_params, count="planned" if paralelo and limite is None else None)
+    if query is None: return pd.DataFrame()
+    primeira = query.range(0, page_size - 1).execute()
+    chamadas = 1
+    estimativa = limite if limite is not None else (primeira.count or 0)
+
+    # Página curta com a estimativa prevendo mais: é o max-rows do servidor, menor que page_size
+    if 0 < len(primeira.data) < page_size and estimativa > len(primeira.data):
+        page_size = len(primeira.data)
+
+    def busca_pagina(inicio):
+        fim = inicio + page_size - 1 if limite is None else min(inicio + page_size, limite) - 1
+        return monta_query(table_name, query_params).range(inicio, fim).execute().data
+
+    paginas = [primeira.data]
+    proximo = len(primeira.data)
+    completa = len(primeira.data) == page_size
+    inicios = range(proximo, estimativa, page_size) if completa and paralelo else range(0)
+    if inicios:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_concurrency, len(inicios)))) as executor:
+            paginas.extend(executor.map(busca_pagina, inicios))
+        chamadas += len(inicios)
+        proximo = inicios[-1] + len(paginas[-1])
+        completa = len(paginas[-1]) == page_size
+    # Depois do que a estimativa previa (ou sem ela), página a página até uma vir incompleta
+    while completa and (limite is None or proximo < limite):
+        pagina = busca_pagina(proximo)
+        chamadas += 1
+        paginas.append(pagina)
+        proximo += len(pagina)
+        completa = len(pagina) == page_size
+    if contexto is not None:
+        contexto.registra_chamadas_backend(chamadas)
+
+    # Junta as listas de registros e monta o DataFrame uma única vez (sem concat por página)
+    return pd.DataFrame(list(chain.from_iterable(paginas)))
+
 @st.cache_data(ttl=30)
-def load_data(table_name: str, query_params: dict):
-    """Carrega dados com base em filtros dinâmicos, incluindo filtros especiais como 'is.null'."""
+def load_data_versionado(table_name: str, query_params: dict, versao, _contexto=None):
+    """Carrega dados com base em filtros dinâmicos, incluindo filtros especiais como 'is.null'.
+
+    _contexto (fora da chave do cache) só é avisado quando a consulta vai de fato ao backend.
+    """
     try:
-        query = supabase.table(table_name).select(query_params.get("select", "*"))
-        filters = query_params.get("filters", {})
-        
-        for key, value in filters.items():
-            if isinstance(value, list):
-                if not value: return pd.DataFrame()
-                query = query.in_(key, value)
-            # MUDANÇA AQUI: Reconhece e aplica filtros especiais do Supabase/PostgREST
-            elif isinstance(value, str) and value.startswith('is.'):
-                # Extrai o valor do filtro, ex: 'null', 'true', 'false'
-                filter_value = value.split('.')[1]
-                query = query.is_(key, filter_value)
-            else:
-                query = query.eq(key, value)
-                
-        response = query.execute()
-        return pd.DataFrame(response.data)
+        return busca_paginada(table_name, query_params, _contexto)
     except Exception as e:
         # A st.error aqui pode poluir a interface, um retorno vazio é mais limpo.
         # print(f"Erro ao carregar dados de '{table_name}': {e}") 
         return pd.DataFrame()
 
+def load_data(table_name: str, query_params: dict, empresa_id: int = None, contexto=None):
+    """Carrega dados pelo cache versionado. A empresa vem do filtro 'empresa_id' quando não informada."""
+    if empresa_id is None:
+        empresa_id = query_params.get("filters", {}).get("empresa_id")
+    return load_data_versionado(table_name, query_params, get_versoes_cache().versao(empresa_id, table_name), _contexto=contexto)
+
 def add_data(table_name: str, data_dict: dict, empresa_id: int = None):
     """Adiciona uma nova linha de dados, injetando o empresa_id se fornecido."""
     
@@ -70,15 +248,186 @@ def add_data(table_name: str, data_dict: dict, empresa_id: int = None):
         data_dict['empresa_id'] = empresa_id
     
     try:
+        if empresa_id and table_name in TABELAS_LIVRO_SALDOS:
+            # estoque/vendas também atualizam o livro de saldos pelo delta da linha
+            return insere_com_livro_saldos(table_name, data_dict, empresa_id)
         response = supabase.table(table_name).insert(data_dict).execute()
-        # Limpa o cache para que os dados sejam recarregados na próxima vez
-        st.cache_data.clear()
+        # Invalida só esta tabela desta empresa para que seja recarregada na próxima vez
+        invalida_tabelas(empresa_id, table_name)
         return response
     except Exception as e:
         # Mostra o erro claramente na tela se algo der errado
         st.error(f"Erro ao adicionar dados em '{table_name}': {e}")
         return None
 
+# --- Espelho de Tabelas por Empresa ---
+# estoque e vendas crescem sem parar: em vez de rebaixar o histórico inteiro a cada 30 s,
+# cada empresa tem no processo uma cópia (com as colunas de todas as PROJECOES) que, depois
+# da carga completa, só busca as linhas novas. Marcas d'água: created_at (com folga para
+# transações que gravam fora de ordem) quando a tabela o tem, senão id. Exclusões e buracos
+# feitos por fora aparecem num count das linhas até a maior id do espelho, feito uma vez no
+# meio de cada janela de reconciliação (é um scan da tabela, não cabe a cada conferência);
+# alterações in loco só entram na reconciliação periódica (carga completa) ou quando pedida.
+TABELAS_ESPELHADAS = ('estoque', 'vendas')
+ESPELHO_TTL = int(os.environ.get("BAMBUAR_ESPELHO_TTL", 30))
+ESPELHO_RECONCILIACAO = int(os.environ.get("BAMBUAR_ESPELHO_RECONCILIACAO", 600))
+ESPELHO_FOLGA_CREATED_AT = pd.Timedelta(seconds=int(os.environ.get("BAMBUAR_ESPELHO_FOLGA", 120)))
+
+def colunas_projecao(projecao):
+    return [coluna.strip() for coluna in projecao.split(',')]
+
+class EspelhoTabela:
+    """Cópia local de uma tabela de uma empresa, atualizada por delta."""
+
+    def __init__(self, empresa_id, tabela):
+        self.empresa_id = empresa_id
+        self.tabela = tabela
+        colunas = chain.from_iterable(colunas_projecao(p[tabela]) for p in PROJECOES.values() if tabela in p)
+        self.colunas = list(dict.fromkeys(['id', 'created_at', *colunas]))
+        self.lock = threading.Lock()
+        self.df = None
+        self.versao = None
+        self.carregado_em = self.conferido_em = self.contado_em = 0.0
+        self.reconciliar = False
+        self.contadores = {'cargas_completas': 0, 'deltas': 0, 'linhas_baixadas': 0}
+
+    def _params(self, **extra):
+        return {"select": ', '.join(self.colunas), "filters": {"empresa_id": self.empresa_id}, **extra}
+
+    def _carga_completa(self, contexto):
+        df = busca_paginada(self.tabela, self._params(), contexto)
+        self.df = df
+        self.carregado_em = self.conferido_em = self.contado_em = time.time()
+        self.reconciliar = False
+        self.contadores['cargas_completas'] += 1
+        self.contadores['linhas_baixadas'] += len(df)
+
+    def _delta(self, contexto):
+        """Busca as linhas novas e as junta por id. Retorna False se o count mostrar que algo sumiu/faltou.
+
+        O count só roda uma vez por janela de reconciliação, na metade dela.
+        """
+        criados = pd.to_datetime(self.df['created_at'], utc=True, format='ISO8601') if 'created_at' in self.df else None
+        if criados is not None and criados.notna().any():
+            filtro = {"gte": {"created_at": (criados.max() - ESPELHO_FOLGA_CREATED_AT).isoformat()}}
+        else:
+            filtro = {"gt": {"id": int(self.df['id'].max())}}
+        novas = busca_paginada(self.tabela, self._params(**filtro), contexto)
+        self.contadores['deltas'] += 1
+        self.contadores['linhas_baixadas'] += len(novas)
+        if not novas.empty:
+            df = pd.concat([self.df[~self.df['id'].isin(novas['id'])], novas], ignore_index=True)
+            if not df['id'].is_monotonic_increasing:
+                df = df.sort_values('id', ignore_index=True)
+            self.df = df
+        self.conferido_em = time.time()
+        if self.conferido_em - self.contado_em < ESPELHO_RECONCILIACAO / 2:
+            return True
+        self.contado_em = self.conferido_em
+        # Tudo que o espelho tem está abaixo de marca: o servidor tem de ter o mesmo número de linhas até ela
+        marca = int(self.df['id'].max())
+        conferencia = monta_query(self.tabela, {"select": "id", "filters": {"empresa_id": self.empresa_id}, "lte": {"id": marca}}, count="exact")
+        total = conferencia.limit(1).execute().count
+        if contexto is not None:
+            contexto.registra_chamadas_backend(1)
+        return total == len(self.df)
+
+    def ler(self, versao, colunas, contexto=None):
+        """As colunas pedidas, em dia com `versao` (cache de versões) e com o TTL do espelho.
+
+        Se o backend falhar, segue com a cópia que já tem; sem cópia, devolve vazio como o load_data.
+        """
+        with self.lock:
+            agora = time.time()
+            try:
+                if self.df is None or self.df.empty or self.reconciliar or agora - self.carregado_em > ESPELHO_RECONCILIACAO:
+                    self._carga_completa(contexto)
+                elif (versao != self.versao or agora - self.conferido_em > ESPELHO_TTL) and not self._delta(contexto):
+                    self._carga_completa(contexto)
+                self.versao = versao
+            except Exception:
+                if self.df is None:
+                    return pd.DataFrame()
+                self.conferido_em = agora  # só tenta de novo depois do TTL
+            df = self.df
+        if df.empty:
+            return pd.DataFrame()
+        return df[[coluna for coluna in colunas if coluna in df.columns]]
+
+@st.cache_resource
+def get_espelhos():
+    """Espelhos por (empresa, tabela), compartilhados entre sessões como os livros de saldo."""
+    return {}, threading.Lock()
+
+def espelho_tabela(empresa_id, tabela):
+    espelhos, lock = get_espelhos()
+    with lock:
+        return espelhos.setdefault((empresa_id, tabela), EspelhoTabela(empresa_id, tabela))
+
+def reconcilia_espelhos(empresa_id, *tabelas):
+    """Força carga completa na próxima leitura (alterações/exclusões ou dados trocados por fora do app)."""
+    for tabela in tabelas:
+        if tabela in TABELAS_ESPELHADAS:
+            espelho_tabela(empresa_id, tabela).reconciliar = True
+
+# --- Contexto de Dados por Rerun ---
+class ContextoDados:
+    """Dados de uma empresa durante um único rerun do script.
+
+    Cada consulta (tabela + parâmetros + versão do cache) é carregada no máximo uma vez
+    e o mesmo DataFrame é entregue a todos que pedirem. Como a versão faz parte da chave,
+    uma escrita via invalida_tabelas no meio do rerun faz a próxima leitura recarregar.
+    """
+
+    def __init__(self, empresa_id):
+        self.empresa_id = empresa_id
+        self._frames = {}
+        self._lock = threading.Lock()
+        # pedidos: chamadas a carregar(); carregadas: idas ao load_data (cache do Streamlit ou
+        # backend); reaproveitadas: servidas por este contexto; chamadas_backend: consultas executadas
+        self.contadores = {'pedidos': 0, 'carregadas': 0, 'reaproveitadas': 0, 'chamadas_backend': 0}
+
+    def registra_chamadas_backend(self, quantidade):
+        with self._lock:
+            self.contadores['chamadas_backend'] += quantidade
+
+    def carregar(self, table_name: str, query_params: dict = None):
+        """Igual a load_data, mas devolve o DataFrame já carregado neste rerun quando houver."""
+        query_params = query_params if query_params is not None else {"filters": {"empresa_id": self.empresa_id}}
+        versao = get_versoes_cache().versao(self.empresa_id, table_name)
+        chave = (table_name, json.dumps(query_params, sort_keys=True, default=str), versao)
+        with self._lock:
+            self.contadores['pedidos'] += 1
+            if chave in self._frames:
+                self.contadores['reaproveitadas'] += 1
+                return self._frames[chave]
+        df = load_data(table_name, query_params, self.empresa_id, contexto=self)
+        with self._lock:
+            self.contadores['carregadas'] += 1
+            return self._frames.setdefault(chave, df)
+
+    def tabela(self, table_name: str, projecao: str = None):
+        """Tabela inteira da empresa; com projecao, só as colunas de PROJECOES[projecao].
+
+        estoque/vendas com projeção saem do espelho da empresa (delta em vez de carga completa).
+        """
+        if projecao is not None and table_name in TABELAS_ESPELHADAS:
+            versao = get_versoes_cache().versao(self.empresa_id, table_name)
+            chave = (table_name, f"espelho:{projecao}", versao)
+            with self._lock:
+                self.contadores['pedidos'] += 1
+                if chave in self._frames:
+                    self.contadores['reaproveitadas'] += 1
+                    return self._frames[chave]
+            df = espelho_tabela(self.empresa_id, table_name).ler(versao, colunas_projecao(PROJECOES[projecao][table_name]), contexto=self)
+            with self._lock:
+                self.contadores['carregadas'] += 1
+                return self._frames.setdefault(chave, df)
+        query_params = {"filters": {"empresa_id": self.empresa_id}}
+        if projecao is not None:
+            query_params = {"select": PROJECOES[projecao][table_name], **query_params}
+        return self.carregar(table_name, query_params)
+
 # --- Funções de Autenticação ---
 def signup_page():
     st.header("Criar Nova Conta")
@@ -106,7 +455,168 @@ def login_page():
                 st.session_state['user_session'] = session.model_dump()
                 st.rerun()
             except Exception: st.error("Erro no login: Credenciais inválidas.")
-            
+
+# --- Unidade de Trabalho ---
+# Junta as escritas de uma ação e grava tudo no commit: inserts/upserts seguidos na mesma
+# tabela viram uma chamada só (upsert nativo, atômico) e cada tabela tocada é invalidada
+# uma única vez no fim.
+class UnidadeDeTrabalho:
+    """Escritas de uma empresa acumuladas até commit(); com `with`, grava ao sair do bloco sem erro."""
+
+    def __init__(self, empresa_id, latencias=None):
+        self.empresa_id = empresa_id
+        # Uma entrada por chamada ao backend (operacao, tabela, linhas, ms); pode ser uma lista da sessão
+        self.latencias = latencias if latencias is not None else []
+        self._operacoes = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo_excecao, *_):
+        if tipo_excecao is None:
+            self.commit()
+        return False
+
+    def inserir(self, tabela, linhas):
+        self._operacoes.append(('insert', tabela, None, self._com_empresa(linhas)))
+
+    def upsert(self, tabela, linhas, on_conflict):
+        """Insere ou atualiza pela restrição única de on_conflict (ex.: 'empresa_id,forma_pagamento')."""
+        self._operacoes.append(('upsert', tabela, on_conflict, self._com_empresa(linhas)))
+
+    def atualizar(self, tabela, dados, filtros):
+        self._operacoes.append(('update', tabela, filtros, dados))
+
+    def excluir(self, tabela, filtros):
+        self._operacoes.append(('delete', tabela, filtros, None))
+
+    def _com_empresa(self, linhas):
+        linhas = [linhas] if isinstance(linhas, dict) else linhas
+        return [{**linha, 'empresa_id': self.empresa_id} for linha in linhas]
+
+    @staticmethod
+    def _agrupa(operacoes):
+        """Funde inserts/upserts seguidos na mesma tabela; no upsert, a última linha de cada chave vence."""
+        agrupadas = []
+        for tipo, tabela, parametro, carga in operacoes:
+            if tipo in ('insert', 'upsert') and agrupadas and agrupadas[-1][:3] == (tipo, tabela, parametro):
+                agrupadas[-1][3].extend(carga)
+            else:
+                agrupadas.append((tipo, tabela, parametro, list(carga) if tipo in ('insert', 'upsert') else carga))
+        for tipo, tabela, parametro, carga in agrupadas:
+            if tipo == 'upsert':
+                # O Postgres recusa um upsert que toca a mesma linha duas vezes
+                chaves = [coluna.strip() for coluna in parametro.split(',')]
+                carga[:] = {tuple(linha.get(coluna) for coluna in chaves): linha for linha in carga}.values()
+        return agrupadas
+
+    def commit(self):
+        """Grava na ordem pedida. Inserts em estoque/vendas passam por insere_em_lotes (livro de saldos)."""
+        operacoes, self._operacoes = self._operacoes, []
+        tocadas = []
+        try:
+            for tipo, tabela, parametro, carga in self._agrupa(operacoes):
+                inicio = time.perf_counter()
+                if tipo == 'insert' and tabela in TABELAS_LIVRO_SALDOS:
+                    linhas = insere_em_lotes(tabela, carga, self.empresa_id)  # já invalida e aplica o delta
+                else:
+                    consulta = supabase.table(tabela)
+                    if tipo == 'insert':
+                        consulta = consulta.insert(carga)
+                    elif tipo == 'upsert':
+                        consulta = consulta.upsert(carga, on_conflict=parametro)
+                    elif tipo == 'update':
+                        consulta = consulta.update(carga).match(parametro)
+                    else:
+                        consulta = consulta.delete().match(parametro)
+                    if tipo in ('update', 'delete', 'upsert'):
+                        reconcilia_espelhos(self.empresa_id, tabela)  # o delta por marca d'água não vê alterações
+                    tocadas.append(tabela)
+                    linhas = len(consulta.execute().data or [])
+                self.latencias.append({
+                    'operacao': tipo, 'tabela': tabela, 'linhas': linhas, 'ms': (time.perf_counter() - inicio) * 1000
+                })
+        finally:
+            # Mesmo se uma operação falhar, o que já foi gravado precisa ser relido
+            if tocadas:
+                invalida_tabelas(self.empresa_id, *dict.fromkeys(tocadas))
+
+# --- Codec de Atributos ---
+# A coluna 'atributos' (JSON) se repete muito: milhares de linhas, poucas variantes distintas.
+# As funções abaixo fatoram a coluna e só fazem o trabalho de JSON uma vez por string distinta.
+@lru_cache(maxsize=8192)
+def _interpreta_atributos(texto):
+    """(chave canônica, dict) de uma string de atributos; (None, None) se não for um objeto JSON."""
+    try: attrs = json.loads(texto)
+    except json.JSONDecodeError: return None, None
+    if not isinstance(attrs, dict): return None, None
+    return json.dumps(attrs, sort_keys=True), attrs
+
+def _interpreta_valor_atributos(valor):
+    """(chave canônica, dict) de um único valor de 'atributos', em string ou já como dict."""
+    if isinstance(valor, dict): return json.dumps(valor, sort_keys=True), valor
+    if isinstance(valor, str) and valor: return _interpreta_atributos(valor)
+    return None, None
+
+def _fatora_atributos(serie_atributos):
+    """Retorna (código da string distinta por linha, lista de (chave, dict) por string distinta)."""
+    try:
+        codigos, distintos = pd.factorize(serie_atributos)
+    except TypeError:
+        # Alguns backends devolvem o jsonb já como dict, que não é hashable
+        codigos, distintos = pd.factorize(serie_atributos.map(lambda x: json.dumps(x) if isinstance(x, dict) else x))
+    interpretados = [_interpreta_atributos(v) if isinstance(v, str) and v else (None, None) for v in distintos]
+    return codigos, interpretados
+
+def chave_atributos(serie_atributos):
+    """Chave canônica (json com sort_keys) de cada linha como Categorical; NaN quando inválida.
+
+    As categorias ficam em ordem alfabética, então agrupar pelos códigos dá a mesma ordem
+    que agrupar pelas strings.
+    """
+    codigos, interpretados = _fatora_atributos(serie_atributos)
+    chaves_distintas = [chave for chave, _ in interpretados]
+    categorias = sorted({chave for chave in chaves_distintas if chave is not None})
+    posicao = {chave: i for i, chave in enumerate(categorias)}
+    # A última posição atende os nulos (código -1 do factorize)
+    mapa = np.array([posicao.get(chave, -1) for chave in chaves_distintas] + [-1], dtype=np.int64)
+    return pd.Series(pd.Categorical.from_codes(mapa[codigos], categories=categorias), index=serie_atributos.index)
+
+def expande_atributos(serie_atributos):
+    """Uma coluna por atributo (json_normalize), no mesmo índice da série."""
+    codigos, interpretados = _fatora_atributos(serie_atributos)
+    planos = pd.json_normalize([attrs if attrs is not None else {} for _, attrs in interpretados])
+    if (codigos == -1).any():
+        # Linha toda NaN no fim: take(-1) cai nela
+        planos = planos.reindex(range(len(interpretados) + 1))
+    return planos.take(codigos).set_axis(serie_atributos.index)
+
+def formata_atributos(serie_atributos, separador=' | ', padrao="Produto Removido"):
+    """Texto com os valores dos atributos de cada linha, montado uma vez por variante distinta."""
+    codigos, interpretados = _fatora_atributos(serie_atributos)
+    textos = np.array([separador.join(f"{v}" for v in attrs.values()) if attrs is not None else padrao for _, attrs in interpretados] + [padrao], dtype=object)
+    return pd.Series(textos[codigos], index=serie_atributos.index)
+
+def pares_atributos(serie_atributos):
+    """Conjunto dos pares (atributo, valor) presentes na série, lidos uma vez por string distinta."""
+    _, interpretados = _fatora_atributos(serie_atributos)
+    return {(str(nome), str(valor)) for _, attrs in interpretados if attrs for nome, valor in attrs.items()}
+
+@st.cache_data(ttl=ESPELHO_TTL, max_entries=64)
+def carrega_uso_atributos(empresa_id, versao, _contexto):
+    """(pares (atributo, valor), nomes de atributo) já usados em estoque ou vendas.
+
+    Montado uma vez por versão de estoque/vendas e refeito junto com o espelho (ESPELHO_TTL),
+    já que a versão local não vê escritas de outras sessões/processos; as travas de edição/exclusão dos Passos 2 e 3
+    consultam os conjuntos em O(1), com igualdade exata ("Azul" não casa com "Azul Claro").
+    """
+    pares = set()
+    for tabela in ('estoque', 'vendas'):
+        df = _contexto.tabela(tabela, 'uso_atributos')
+        if not df.empty and 'atributos' in df.columns:
+            pares |= pares_atributos(df['atributos'])
+    return frozenset(pares), frozenset(nome for nome, _ in pares)
+
 # ADICIONE ESTA FUNÇÃO NOVA AO SEU CÓDIGO
 # SUBSTITUA ESTA FUNÇÃO NO SEU CÓDIGO
 def calcula_estoque_final(df_estoque, df_vendas):
@@ -114,94 +624,465 @@ def calcula_estoque_final(df_estoque, df_vendas):
     if df_estoque.empty:
         return pd.DataFrame()
 
-    def criar_chave(attrs):
-        if attrs and isinstance(attrs, str):
-            try: attrs = json.loads(attrs)
-            except json.JSONDecodeError: return None
-        return json.dumps(attrs, sort_keys=True) if isinstance(attrs, dict) else None
-
-    df_estoque['chave_atributos'] = df_estoque['atributos'].apply(criar_chave)
-    if not df_vendas.empty:
-        df_vendas['chave_atributos'] = df_vendas['atributos'].apply(criar_chave)
+    # Estoque e vendas são codificados juntos para compartilhar as mesmas categorias
+    series_atributos = [df_estoque['atributos']] + ([df_vendas['atributos']] if not df_vendas.empty else [])
+    codigos = chave_atributos(pd.concat(series_atributos, ignore_index=True)).cat.codes.to_numpy()
+    codigos_estoque, codigos_vendas = codigos[:len(df_estoque)], codigos[len(df_estoque):]
 
     # CORREÇÃO: Mantém o produto_base_id durante o agrupamento
-    estoque_agrupado = df_estoque.groupby('chave_atributos').agg(
+    estoque_valido = df_estoque.assign(chave_atributos=codigos_estoque)[codigos_estoque >= 0]
+    estoque_agrupado = estoque_valido.groupby('chave_atributos').agg(
         quantidade=('quantidade', 'sum'),
         atributos=('atributos', 'first'),
         produto_base_id=('produto_base_id', 'first') # Garante que o ID do produto seja mantido
     ).reset_index()
     
     if not df_vendas.empty:
-        vendas_agrupadas = df_vendas.groupby('chave_atributos')['quantidade_vendida'].sum().reset_index()
-        df_saldo = pd.merge(estoque_agrupado, vendas_agrupadas, on='chave_atributos', how='left').fillna(0)
+        vendas_validas = codigos_vendas >= 0
+        vendas_agrupadas = df_vendas['quantidade_vendida'][vendas_validas].groupby(codigos_vendas[vendas_validas]).sum()
+        df_saldo = estoque_agrupado.copy()
+        df_saldo['quantidade_vendida'] = df_saldo['chave_atributos'].map(vendas_agrupadas)
+        df_saldo = df_saldo.fillna(0)
     else:
         df_saldo = estoque_agrupado.copy(); df_saldo['quantidade_vendida'] = 0
 
     df_saldo['saldo'] = df_saldo['quantidade'] - df_saldo['quantidade_vendida']
     
     if not df_saldo.empty:
-        df_saldo['atributos'] = df_saldo['atributos'].apply(lambda x: json.loads(x) if isinstance(x, str) else x)
-        df_atributos_flat = pd.json_normalize(df_saldo['atributos'])
+        df_atributos_flat = expande_atributos(df_saldo['atributos'])
         
         # CORREÇÃO: Adiciona o produto_base_id de volta ao dataframe final
         df_final = pd.concat([df_saldo[['produto_base_id']].reset_index(drop=True), df_atributos_flat.reset_index(drop=True), df_saldo[['quantidade', 'quantidade_vendida', 'saldo']].reset_index(drop=True)], axis=1)
         return df_final
         
     return pd.DataFrame()
-    
-    
-    
-# ADICIONE ESTA FUNÇÃO NOVA AO SEU CÓDIGO
-# ADICIONE ESTA FUNÇÃO NOVA AO SEU CÓDIGO
-def calcula_lucro_v3(df_vendas, df_estoque, df_eventos, df_comissao):
-    """Calcula o lucro por venda para a arquitetura V3 com variantes."""
-    if df_vendas.empty:
-        return pd.Series(dtype='float64')
 
-    df_vendas_lucro = df_vendas.copy()
-    COMISSAO_PERCENTUAL = df_comissao['percentual_comissao'].iloc[0] if not df_comissao.empty else 0.10
+# --- Livro de Saldos ---
+# Saldo por variante materializado em memória, por empresa. É reconstruído do histórico
+# (estoque + vendas) só quando fica desatualizado; entre uma reconstrução e outra o add_data
+# aplica o delta de cada linha inserida. calcula_estoque_final segue como referência.
+TABELAS_LIVRO_SALDOS = ('estoque', 'vendas')
+# Reconstrói de tempos em tempos para pegar escritas feitas fora deste processo
+LIVRO_SALDOS_TTL = int(os.environ.get("BAMBUAR_LIVRO_SALDOS_TTL", 300))
+
+class LivroSaldos:
+    """Entradas, vendido, saldo e custo médio por variante (chave canônica dos atributos)."""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.versao = None  # versões de estoque/vendas refletidas no livro; None = desatualizado
+        self.reconstruido_em = 0.0
+        self._entradas = {}  # chave -> produto_base_id, atributos, quantidade, soma_custo, n_custos
+        self._vendido = {}   # chave -> quantidade vendida (também de variantes ainda sem entrada)
+        self._tabela = None
+
+    def desatualizado(self, versao):
+        return self.versao != versao or time.time() - self.reconstruido_em > LIVRO_SALDOS_TTL
+
+    def reconstruir(self, df_estoque, df_vendas, versao):
+        """Refaz o livro a partir do histórico completo, agrupando pelos códigos das chaves."""
+        entradas, vendido = {}, {}
+        n_estoque = len(df_estoque) if not df_estoque.empty else 0
+        series_atributos = [df['atributos'] for df in (df_estoque, df_vendas) if not df.empty]
+        if series_atributos:
+            chaves = chave_atributos(pd.concat(series_atributos, ignore_index=True))
+            categorias = chaves.cat.categories
+            codigos = chaves.cat.codes.to_numpy()
+            codigos_estoque, codigos_vendas = codigos[:n_estoque], codigos[n_estoque:]
+            if n_estoque:
+                validos = codigos_estoque >= 0
+                grupos = df_estoque[validos].assign(chave=codigos_estoque[validos]).groupby('chave').agg(
+                    produto_base_id=('produto_base_id', 'first'),
+                    atributos=('atributos', 'first'),
+                    quantidade=('quantidade', 'sum'),
+                    soma_custo=('valor_custo', 'sum'),
+                    n_custos=('valor_custo', 'count')
+                )
+                entradas = {categorias[codigo]: linha for codigo, linha in zip(grupos.index, grupos.to_dict('records'))}
+            if len(codigos_vendas):
+                validos = codigos_vendas >= 0
+                somas = df_vendas['quantidade_vendida'][validos].groupby(codigos_vendas[validos]).sum()
+                vendido = {categorias[codigo]: quantidade for codigo, quantidade in somas.items()}
+        with self.lock:
+            self._entradas, self._vendido, self._tabela = entradas, vendido, None
+            self.versao, self.reconstruido_em = versao, time.time()
+
+    def aplica_delta(self, tabela, linhas, versao_antes, versao_depois):
+        """Soma as linhas inseridas em estoque/vendas ao livro.
+
+        Só vale se o livro estava em dia e se a única mudança de versão foi esta escrita;
+        do contrário o livro fica marcado como desatualizado e é reconstruído na próxima leitura.
+        """
+        esperado = dict(versao_antes)
+        versao_empresa, versao_todas = versao_antes[tabela]
+        esperado[tabela] = (versao_empresa + 1, versao_todas)
+        with self.lock:
+            if self.versao != versao_antes or versao_depois != esperado:
+                self.versao = None
+                return False
+            for linha in linhas:
+                chave, _ = _interpreta_valor_atributos(linha.get('atributos'))
+                if chave is None:
+                    continue
+                if tabela == 'vendas':
+                    self._vendido[chave] = self._vendido.get(chave, 0) + (linha.get('quantidade_vendida') or 0)
+                    continue
+                entrada = self._entradas.setdefault(chave, {
+                    'produto_base_id': linha.get('produto_base_id'), 'atributos': linha.get('atributos'),
+                    'quantidade': 0, 'soma_custo': 0.0, 'n_custos': 0
+                })
+                if pd.isna(entrada['produto_base_id']):
+                    entrada['produto_base_id'] = linha.get('produto_base_id')
+                entrada['quantidade'] += linha.get('quantidade') or 0
+                if linha.get('valor_custo') is not None:
+                    entrada['soma_custo'] += linha['valor_custo']
+                    entrada['n_custos'] += 1
+            self._tabela = None
+            self.versao = versao_depois
+            return True
+
+    def tabela(self, com_custo=False, vendido_pendente=None):
+        """Saldo no formato de calcula_estoque_final (com custo_medio se pedido). Custa O(variantes).
+
+        `vendido_pendente` ({chave: quantidade}) soma vendas ainda fora do banco, sem mexer no livro.
+        """
+        with self.lock:
+            if vendido_pendente:
+                df_saldo = self._materializar(vendido_pendente)
+            else:
+                if self._tabela is None:
+                    self._tabela = self._materializar()
+                df_saldo = self._tabela
+        if df_saldo.empty or com_custo:
+            return df_saldo.copy()
+        return df_saldo.drop(columns='custo_medio')
+
+    def saldos_por_chave(self, vendido_pendente=None):
+        """{chave canônica dos atributos: saldo} de todas as variantes com entrada."""
+        vendido_pendente = vendido_pendente or {}
+        with self.lock:
+            return {
+                chave: entrada['quantidade'] - self._vendido.get(chave, 0) - vendido_pendente.get(chave, 0)
+                for chave, entrada in self._entradas.items()
+            }
 
-    # 1. Calcula o Custo do Produto Vendido (CPV/CMV)
-    if not df_estoque.empty:
-        # Cria um "mapa" de custo médio para cada variante
-        custos_medios = df_estoque.groupby('variante_id')['valor_custo'].mean()
-        df_vendas_lucro['custo_unitario'] = df_vendas_lucro['variante_id'].map(custos_medios).fillna(0)
-        df_vendas_lucro['custo_estoque'] = df_vendas_lucro['custo_unitario'] * df_vendas_lucro['quantidade_vendida']
-    else:
-        df_vendas_lucro['custo_estoque'] = 0
+    def _materializar(self, vendido_pendente=None):
+        if not self._entradas:
+            return pd.DataFrame()
+        chaves = sorted(self._entradas)  # mesma ordem do groupby por chave em calcula_estoque_final
+        entradas = [self._entradas[chave] for chave in chaves]
+        quantidade = pd.Series([entrada['quantidade'] for entrada in entradas])
+        vendido_pendente = vendido_pendente or {}
+        quantidade_vendida = pd.Series([self._vendido.get(chave, 0) + vendido_pendente.get(chave, 0) for chave in chaves])
+        soma_custo = pd.Series([entrada['soma_custo'] for entrada in entradas], dtype='float64')
+        n_custos = pd.Series([entrada['n_custos'] for entrada in entradas])
+        df_atributos_flat = expande_atributos(pd.Series([entrada['atributos'] for entrada in entradas], dtype=object))
+        return pd.concat([
+            pd.DataFrame({'produto_base_id': [entrada['produto_base_id'] for entrada in entradas]}),
+            df_atributos_flat.reset_index(drop=True),
+            pd.DataFrame({
+                'quantidade': quantidade,
+                'quantidade_vendida': quantidade_vendida,
+                'saldo': quantidade - quantidade_vendida,
+                'custo_medio': soma_custo / n_custos.where(n_custos > 0),
+            })
+        ], axis=1)
 
-    # 2. Calcula Custos de Evento Rateado
-    df_vendas_lucro['custo_evento_rateado'] = 0
-    if not df_eventos.empty and 'evento' in df_vendas_lucro.columns:
-        custos_eventos = df_eventos.set_index('nome_evento')[['aluguel', 'estacionamento', 'alimentacao', 'outros_custos']].sum(axis=1)
-        vendas_por_evento = df_vendas_lucro.groupby('evento')['quantidade_vendida'].sum()
-        
-        df_vendas_lucro['custo_total_evento'] = df_vendas_lucro['evento'].map(custos_eventos).fillna(0)
-        df_vendas_lucro['total_vendido_evento'] = df_vendas_lucro['evento'].map(vendas_por_evento).fillna(1)
-        
-        df_vendas_lucro['custo_evento_rateado'] = (df_vendas_lucro['custo_total_evento'] / df_vendas_lucro['total_vendido_evento']) * df_vendas_lucro['quantidade_vendida']
-
-    # 3. Calcula Outros Custos e Receitas
-    df_vendas_lucro['receita_bruta'] = df_vendas_lucro['preco_venda'] * df_vendas_lucro['quantidade_vendida']
-    df_vendas_lucro['receita_liquida'] = df_vendas_lucro['receita_bruta'] - df_vendas_lucro['desconto'].fillna(0)
-    df_vendas_lucro['comissao'] = df_vendas_lucro['receita_bruta'] * COMISSAO_PERCENTUAL
-    df_vendas_lucro['taxas_pagamento'] = df_vendas_lucro['taxa_pagamento'].fillna(0)
-
-    # 4. Calcula o Lucro Final
-    df_vendas_lucro['lucro'] = (
-        df_vendas_lucro['receita_liquida'] - 
-        df_vendas_lucro['custo_estoque'] - 
-        df_vendas_lucro['custo_evento_rateado'] - 
-        df_vendas_lucro['comissao'] - 
-        df_vendas_lucro['taxas_pagamento']
-    )
+@st.cache_resource
+def get_livros_saldos():
+    """Livros de saldo por empresa, compartilhados entre sessões como o cache de versões."""
+    return {}, threading.Lock()
+
+def livro_saldos(empresa_id):
+    livros, lock = get_livros_saldos()
+    with lock:
+        return livros.setdefault(empresa_id, LivroSaldos())
+
+def versao_livro_saldos(empresa_id):
+    versoes = get_versoes_cache()
+    return {tabela: versoes.versao(empresa_id, tabela) for tabela in TABELAS_LIVRO_SALDOS}
+
+# --- Resumo Diário de Vendas ---
+# Somas de vendas por (dia, produto_base_id, evento, forma_pagamento, chave da variante),
+# mantidas como o livro de saldos: reconstruídas do histórico quando desatualizadas e
+# acrescidas pelo delta de cada venda inserida. O Dashboard lê daqui em vez das vendas.
+CHAVES_RESUMO_DIARIO = ['dia', 'produto_base_id', 'evento', 'forma_pagamento', 'chave_variante']
+SOMAS_RESUMO_DIARIO = ['n_vendas', 'quantidade_vendida', 'receita_bruta', 'descontos', 'taxas', 'soma_preco_venda', 'custo_evento']
+
+def _dia_venda(serie_data_venda):
+    return pd.to_datetime(serie_data_venda, errors='coerce', format='ISO8601').dt.strftime('%Y-%m-%d')
+
+def _somas_vendas(df_vendas):
+    """Colunas de SOMAS_RESUMO_DIARIO por venda (antes de agrupar)."""
+    quantidade = df_vendas['quantidade_vendida'].fillna(0)
+    preco = df_vendas['preco_venda'].fillna(0)
+    return pd.DataFrame({
+        'n_vendas': 1,
+        'quantidade_vendida': quantidade,
+        'receita_bruta': preco * quantidade,
+        'descontos': df_vendas['desconto'].fillna(0),
+        'taxas': df_vendas['taxa_pagamento'].fillna(0),
+        'soma_preco_venda': preco,
+        'custo_evento': df_vendas['custo_evento'].fillna(0),
+    }, index=df_vendas.index)
+
+class ResumoDiarioVendas:
+    """Resumo diário das vendas de uma empresa; usa o lock do livro de saldos da empresa."""
+
+    def __init__(self, lock):
+        self.lock = lock  # o mesmo das inserções em estoque/vendas (ver insere_com_livro_saldos)
+        self.versao = None  # versão de vendas refletida; None = desatualizado
+        self.reconstruido_em = 0.0
+        self._tabela = self._agrupa(pd.DataFrame())
+        self._posicao = {}  # chave (CHAVES_RESUMO_DIARIO, nulos como None) -> linha em _tabela
+
+    def desatualizado(self, versao):
+        return self.versao != versao or time.time() - self.reconstruido_em > LIVRO_SALDOS_TTL
+
+    @staticmethod
+    def _agrupa(df_vendas):
+        """Uma linha por grupo: CHAVES_RESUMO_DIARIO, atributos (de uma das vendas) e SOMAS_RESUMO_DIARIO."""
+        if df_vendas.empty:
+            return pd.DataFrame(columns=CHAVES_RESUMO_DIARIO + ['atributos'] + SOMAS_RESUMO_DIARIO)
+        df = pd.concat([
+            pd.DataFrame({
+                'dia': _dia_venda(df_vendas['data_venda']),
+                'produto_base_id': df_vendas['produto_base_id'],
+                'evento': df_vendas['evento'],
+                'forma_pagamento': df_vendas['forma_pagamento'],
+                'chave_variante': chave_atributos(df_vendas['atributos']).astype(object),
+                'atributos': df_vendas['atributos'],
+            }, index=df_vendas.index),
+            _somas_vendas(df_vendas),
+        ], axis=1)
+        return df.groupby(CHAVES_RESUMO_DIARIO, dropna=False, sort=False).agg(
+            atributos=('atributos', 'first'), **{coluna: (coluna, 'sum') for coluna in SOMAS_RESUMO_DIARIO}
+        ).reset_index()
+
+    @staticmethod
+    def _chaves(tabela):
+        chaves = tabela[CHAVES_RESUMO_DIARIO].astype(object)
+        return list(chaves.where(chaves.notna(), None).itertuples(index=False, name=None))
+
+    def reconstruir(self, df_vendas, versao):
+        tabela = self._agrupa(df_vendas)
+        posicao = {chave: i for i, chave in enumerate(self._chaves(tabela))}
+        with self.lock:
+            self._tabela, self._posicao = tabela, posicao
+            self.versao, self.reconstruido_em = versao, time.time()
+
+    def aplica_delta(self, linhas, versao_antes, versao_depois):
+        """Soma as vendas inseridas; mesma regra de versão do LivroSaldos.aplica_delta.
+
+        Grupos existentes recebem as somas no lugar e os novos entram no fim, sem refazer a tabela.
+        """
+        with self.lock:
+            if self.versao != versao_antes or versao_depois != (versao_antes[0] + 1, versao_antes[1]):
+                self.versao = None
+                return False
+            if linhas:
+                novas = self._agrupa(pd.DataFrame(linhas).reindex(columns=colunas_projecao(PROJECOES['resumo_diario']['vendas'])))
+                chaves = self._chaves(novas)
+                existentes = [(self._posicao[chave], i) for i, chave in enumerate(chaves) if chave in self._posicao]
+                # Cópia rasa: quem já leu a tabela anterior continua com ela intacta
+                tabela = self._tabela.copy(deep=False)
+                if existentes:
+                    posicoes, origens = map(list, zip(*existentes))
+                    for coluna in SOMAS_RESUMO_DIARIO:
+                        valores = novas[coluna].to_numpy()[origens]
+                        somas = tabela[coluna].to_numpy().astype(np.result_type(tabela[coluna].dtype, valores.dtype))
+                        np.add.at(somas, posicoes, valores)
+                        tabela[coluna] = somas
+                acrescentar = [i for i, chave in enumerate(chaves) if chave not in self._posicao]
+                if acrescentar:
+                    self._posicao.update({chaves[i]: len(tabela) + j for j, i in enumerate(acrescentar)})
+                    novas = novas.iloc[acrescentar]
+                    tabela = novas.reset_index(drop=True) if tabela.empty else pd.concat([tabela, novas], ignore_index=True)
+                self._tabela = tabela
+            self.versao = versao_depois
+            return True
+
+    def tabela(self):
+        """O resumo (ver _agrupa). Não modificar: a mesma tabela é entregue a todas as sessões."""
+        with self.lock:
+            return self._tabela
+
+@st.cache_resource
+def get_resumos_diarios():
+    return {}, threading.Lock()
+
+def resumo_diario(empresa_id):
+    resumos, lock = get_resumos_diarios()
+    livro = livro_saldos(empresa_id)
+    with lock:
+        return resumos.setdefault(empresa_id, ResumoDiarioVendas(livro.lock))
+
+def resumo_diario_em_dia(contexto, reconstruir=False):
+    """Resumo diário da empresa (DataFrame); só relê as vendas se estiver desatualizado."""
+    resumo = resumo_diario(contexto.empresa_id)
+    with resumo.lock:
+        versao = get_versoes_cache().versao(contexto.empresa_id, 'vendas')
+        if reconstruir or resumo.desatualizado(versao):
+            resumo.reconstruir(contexto.tabela('vendas', 'resumo_diario'), versao)
+        return resumo.tabela()
+
+def aplica_delta_insercao(empresa_id, table_name, linhas, versao_antes):
+    """Leva as linhas inseridas ao livro de saldos e, se forem vendas, ao resumo diário."""
+    versao_depois = versao_livro_saldos(empresa_id)
+    livro_saldos(empresa_id).aplica_delta(table_name, linhas, versao_antes, versao_depois)
+    if table_name == 'vendas':
+        resumo_diario(empresa_id).aplica_delta(linhas, versao_antes['vendas'], versao_depois['vendas'])
+
+def insere_com_livro_saldos(table_name, data_dict, empresa_id):
+    """Insere em estoque/vendas, invalida o cache e aplica o delta no livro de saldos.
+
+    Tudo sob o lock do livro, para que uma reconstrução concorrente não leia a linha nova
+    ainda com a versão antiga (o delta a contaria de novo).
+    """
+    livro = livro_saldos(empresa_id)
+    with livro.lock:
+        versao_antes = versao_livro_saldos(empresa_id)
+        response = supabase.table(table_name).insert(data_dict).execute()
+        invalida_tabelas(empresa_id, table_name)
+        linhas = [{**linha, **data_dict} for linha in (response.data or [{}])]
+        aplica_delta_insercao(empresa_id, table_name, linhas, versao_antes)
+    return response
+
+TAMANHO_LOTE_INSERCAO = 500
+
+def insere_em_lotes(table_name, linhas, empresa_id, tamanho_lote=TAMANHO_LOTE_INSERCAO):
+    """Insere muitas linhas em inserts de até tamanho_lote linhas, com uma única invalidação no fim.
+
+    Em estoque/vendas o livro de saldos recebe todas as linhas num só delta. Se um lote falhar,
+    os anteriores já estão gravados: eles são invalidados/contados e a exceção sobe em seguida.
+    Retorna o número de linhas inseridas.
+    """
+    linhas = [{**linha, 'empresa_id': empresa_id} for linha in linhas]
+    livro = livro_saldos(empresa_id) if table_name in TABELAS_LIVRO_SALDOS else None
+    with livro.lock if livro is not None else contextlib.nullcontext():
+        versao_antes = versao_livro_saldos(empresa_id) if livro is not None else None
+        inseridas = []
+        try:
+            for inicio in range(0, len(linhas), tamanho_lote):
+                lote = linhas[inicio:inicio + tamanho_lote]
+                response = supabase.table(table_name).insert(lote).execute()
+                inseridas.extend({**gravada, **enviada} for gravada, enviada in zip(response.data or lote, lote))
+        finally:
+            if inseridas:
+                invalida_tabelas(empresa_id, table_name)
+                if livro is not None:
+                    aplica_delta_insercao(empresa_id, table_name, inseridas, versao_antes)
+    return len(inseridas)
+
+# --- Diário de Vendas Offline ---
+# A venda do formulário vai primeiro para um diário SQLite local e volta na hora; um worker
+# a envia para `vendas` em lotes, com chave de idempotência. Enquanto não sobe, o saldo
+# mostrado já desconta as pendentes (vendido_pendente), então a feira segue sem conexão.
+DIARIO_VENDAS_CAMINHO = os.environ.get("BAMBUAR_DIARIO_VENDAS", os.path.join("dados", "diario_vendas.sqlite3"))
+
+@st.cache_resource
+def get_diario_vendas():
+    return DiarioVendas(DIARIO_VENDAS_CAMINHO)
+
+def envia_vendas_diario(diario, empresa_id, registros):
+    """Sobe um lote do diário e, sob o lock do livro, marca como sincronizado e aplica o delta.
+
+    O upsert ignora chaves que já estão no banco (lote reenviado depois de uma resposta
+    perdida). Nesse caso, ou se o livro/resumo diário foi relido durante o envio, os dois são
+    marcados como desatualizados em vez de receber o delta, para a venda não ser contada duas
+    vezes nem nenhuma.
+    """
+    livro, resumo = livro_saldos(empresa_id), resumo_diario(empresa_id)
+    versao_antes, reconstruido_em = versao_livro_saldos(empresa_id), (livro.reconstruido_em, resumo.reconstruido_em)
+    linhas = [{**dados, 'empresa_id': empresa_id, 'chave_idempotencia': chave} for chave, _, dados in registros]
+    # Fora do lock: sem conexão o envio pode demorar e o saldo segue legível pelo diário
+    response = supabase.table('vendas').upsert(linhas, on_conflict='chave_idempotencia', ignore_duplicates=True).execute()
+    gravadas = response.data or []
+    with livro.lock:
+        diario.marcar_sincronizadas([chave for chave, _, _ in registros])
+        invalida_tabelas(empresa_id, 'vendas')
+        if len(gravadas) < len(linhas) or (livro.reconstruido_em, resumo.reconstruido_em) != reconstruido_em:
+            livro.versao = resumo.versao = None
+        else:
+            aplica_delta_insercao(empresa_id, 'vendas', gravadas, versao_antes)
+
+@st.cache_resource
+def get_sincronizador_vendas():
+    diario = get_diario_vendas()
+    return SincronizadorVendas(diario, lambda empresa_id, registros: envia_vendas_diario(diario, empresa_id, registros)).iniciar()
+
+def registra_venda(empresa_id, dados):
+    """Grava a venda no diário local (durável já no retorno) e acorda o sincronizador."""
+    # Tipos nativos antes do JSON: com default=str um np.float64 voltaria como texto no envio
+    dados = {campo: (valor.item() if isinstance(valor, np.generic) else valor) for campo, valor in dados.items()}
+    chave = get_diario_vendas().registrar(empresa_id, dados)
+    get_sincronizador_vendas().acordar()
+    return chave
+
+def vendido_pendente(empresa_id):
+    """{chave canônica dos atributos: quantidade} das vendas do diário ainda não sincronizadas."""
+    vendido = {}
+    for _, _, dados in get_diario_vendas().pendentes(empresa_id):
+        chave, _ = _interpreta_valor_atributos(dados.get('atributos'))
+        if chave is not None:
+            vendido[chave] = vendido.get(chave, 0) + (dados.get('quantidade_vendida') or 0)
+    return vendido
+
+def _livro_em_dia(contexto, reconstruir=False):
+    """Livro da empresa; só relê o histórico se ele estiver desatualizado (ou se pedido)."""
+    livro = livro_saldos(contexto.empresa_id)
+    with livro.lock:
+        versao = versao_livro_saldos(contexto.empresa_id)
+        if reconstruir or livro.desatualizado(versao):
+            livro.reconstruir(contexto.tabela('estoque', 'saldo'), contexto.tabela('vendas', 'saldo'), versao)
+    return livro
+
+def saldo_estoque(contexto, com_custo=False, reconstruir=False, com_pendentes=True):
+    """Saldo por variante pelo livro da empresa, no formato de calcula_estoque_final.
+
+    Com `com_pendentes`, desconta as vendas do diário que ainda não chegaram ao banco.
+    """
+    livro = _livro_em_dia(contexto, reconstruir)
+    with livro.lock:  # diário e livro lidos juntos: a sincronização troca um pelo outro sob este lock
+        return livro.tabela(com_custo, vendido_pendente(contexto.empresa_id) if com_pendentes else None)
+
+def saldo_por_chave(contexto):
+    """Saldo por chave canônica de atributos, direto do livro (para conferir vendas em lote)."""
+    livro = _livro_em_dia(contexto)
+    with livro.lock:
+        return livro.saldos_por_chave(vendido_pendente(contexto.empresa_id))
+
+def conta_divergencias_saldo(df_a, df_b):
+    """Número de linhas diferentes entre duas tabelas de saldo (todas, se o formato não bater)."""
+    if list(df_a.columns) != list(df_b.columns) or len(df_a) != len(df_b):
+        return max(len(df_a), len(df_b))
+    df_a, df_b = df_a.reset_index(drop=True), df_b.reset_index(drop=True)
+    iguais = (df_a == df_b) | (df_a.isna() & df_b.isna())
+    return int((~iguais.all(axis=1)).sum())
+
+def confere_livro_saldos(contexto):
+    """Compara o livro atual com calcula_estoque_final sobre o histórico e depois o reconstrói.
+
+    Retorna o número de variantes em que o livro divergia.
+    """
+    livro_atual = saldo_estoque(contexto, com_pendentes=False)
+    df_estoque, df_vendas = contexto.tabela('estoque', 'saldo'), contexto.tabela('vendas', 'saldo')
+    divergencias = conta_divergencias_saldo(livro_atual, calcula_estoque_final(df_estoque, df_vendas))
+    saldo_estoque(contexto, reconstruir=True)
+    return divergencias
+    
     
-    return df_vendas_lucro['lucro']
     
 # ADICIONE ESTA NOVA FUNÇÃO AO SEU CÓDIGO
 # SUBSTITUA a função gerar_visualizacao_hierarquia por esta:
 def gerar_tabela_pivotada(df_valores, df_tipos, df_produtos_base):
-    """Cria um DataFrame pivotado para exibir a hierarquia de forma horizontal, como no Excel."""
+    """Cria um DataFrame pivotado para exibir a hierarquia de forma horizontal, como no Excel.
+
+    Cada caminho (folha -> raiz) é resolvido uma vez por nó: os pais são achados por um
+    índice id -> linha e o caminho de cada ancestral fica memorizado, então prefixos
+    comuns (Modelo -> Cor) não são percorridos de novo para cada Tamanho.
+    Levanta ValueError se parent_valor_id formar um ciclo.
+    """
     if df_valores.empty or df_tipos.empty or df_produtos_base.empty:
         return pd.DataFrame()
 
@@ -209,28 +1090,60 @@ def gerar_tabela_pivotada(df_valores, df_tipos, df_produtos_base):
     df = pd.merge(df_valores, df_tipos, left_on='atributo_tipo_id', right_on='id', suffixes=('_valor', '_tipo'))
     df = pd.merge(df, df_produtos_base, left_on='produto_base_id', right_on='id', suffixes=('', '_produto'))
 
-    # Identifica os "nós folhas" (os últimos itens da hierarquia, que não são pais de ninguém)
-    folhas = df[~df['id_valor'].isin(df['parent_valor_id'].dropna())]
-    
-    caminhos_formatados = []
-    # Para cada "folha", sobe na hierarquia para montar o caminho completo
-    for _, folha in folhas.iterrows():
-        caminho_atual = {}
-        item_atual = folha
-        while True:
-            caminho_atual[item_atual['nome_atributo']] = item_atual['valor']
-            if pd.isna(item_atual['parent_valor_id']):
-                caminho_atual['Produto Base'] = item_atual['nome_produto']
-                caminho_atual['produto_base_id'] = item_atual['produto_base_id']
+    ids = df['id_valor'].tolist()
+    pais = df['parent_valor_id'].tolist()
+    nomes_atributo = df['nome_atributo'].tolist()
+    valores = df['valor'].tolist()
+    nomes_produto = df['nome_produto'].tolist()
+    produtos_base_ids = df['produto_base_id'].tolist()
+
+    # Índice id -> primeira linha com esse id (o mesmo que df[df['id_valor'] == id].iloc[0])
+    linha_por_id = {}
+    for posicao, id_valor in enumerate(ids):
+        linha_por_id.setdefault(id_valor, posicao)
+
+    # caminhos[linha] = (pares (atributo, valor) da linha até o topo, raiz ou None se o pai não existe)
+    caminhos = {}
+
+    def resolve(linha):
+        pendentes, em_andamento = [], set()
+        while linha not in caminhos:
+            if linha in em_andamento:
+                ciclo = [ids[p] for p in pendentes[pendentes.index(linha):]]
+                raise ValueError(f"Ciclo em parent_valor_id: {' -> '.join(map(str, ciclo + [ids[linha]]))}")
+            em_andamento.add(linha)
+            pendentes.append(linha)
+            pai = pais[linha]
+            if pd.isna(pai):
+                caminhos[linha] = (((nomes_atributo[linha], valores[linha]),), (nomes_produto[linha], produtos_base_ids[linha]))
+                pendentes.pop()
                 break
-            # Encontra o pai na tabela já unida
-            pai = df[df['id_valor'] == item_atual['parent_valor_id']]
-            if pai.empty:
+            if pai not in linha_por_id:
+                caminhos[linha] = (((nomes_atributo[linha], valores[linha]),), None)
+                pendentes.pop()
                 break
-            item_atual = pai.iloc[0]
-        caminhos_formatados.append(caminho_atual)
-        
-    return pd.DataFrame(caminhos_formatados)
+            linha = linha_por_id[pai]
+        # Desce preenchendo os caminhos a partir do ancestral já resolvido
+        for pendente in reversed(pendentes):
+            pares_pai, raiz = caminhos[linha_por_id[pais[pendente]]]
+            caminhos[pendente] = (((nomes_atributo[pendente], valores[pendente]),) + pares_pai, raiz)
+        return caminhos[pendentes[0] if pendentes else linha]
+
+    # Identifica os "nós folhas" (os últimos itens da hierarquia, que não são pais de ninguém)
+    folhas = df.index[~df['id_valor'].isin(df['parent_valor_id'].dropna())]
+
+    # Monta a saída por coluna; a ordem das colunas é a da primeira aparição, como num DataFrame de dicts
+    colunas = {}
+    for i, linha in enumerate(folhas):
+        pares, raiz = resolve(linha)
+        # Nome repetido no caminho: fica a posição da folha e o valor do ancestral, como antes
+        caminho = dict(pares)
+        if raiz is not None:
+            caminho['Produto Base'], caminho['produto_base_id'] = raiz
+        for nome, valor in caminho.items():
+            colunas.setdefault(nome, [np.nan] * len(folhas))[i] = valor
+
+    return pd.DataFrame(colunas)
     
 # ADICIONE ESTA NOVA FUNÇÃO AO SEU CÓDIGO
 # ADICIONE ESTA NOVA FUNÇÃO AO SEU CÓDIGO
@@ -261,60 +1174,540 @@ def gerar_visualizacao_hierarquia(df_valores, df_tipos, df_produtos_base):
     
     return df_final[colunas_existentes].fillna('-')
     
-# ADICIONE ESTA FUNÇÃO NOVA AO SEU CÓDIGO
-# SUBSTITUA a função calcula_lucro_v3 antiga por esta versão correta:
-def calcula_lucro_v3(df_vendas, df_estoque, df_eventos, comissao_percentual):
-    """Calcula o lucro por venda para a arquitetura V3 com atributos dinâmicos, SEM o conceito de variante_id."""
+# --- Motor de Lucro ---
+# Um único cálculo de lucro por venda para Dashboard, DRE e Resumo de Vendas,
+# só com operações por coluna (groupby/map), sem laço por linha.
+COLUNAS_LUCRO = ['receita_bruta', 'receita_liquida', 'custo_estoque', 'comissao', 'taxas', 'custo_evento_rateado', 'lucro']
+
+def custo_medio_por_venda(df_vendas, df_estoque, base_custo='produto'):
+    """Custo unitário médio do estoque para cada venda (0 quando não há entrada).
+
+    base_custo='produto' usa a média do produto_base; 'variante' usa a média da
+    combinação de atributos (mesma chave canônica do saldo).
+    """
+    if df_estoque.empty:
+        return pd.Series(0.0, index=df_vendas.index)
+    if base_custo == 'produto':
+        custos_medios = df_estoque.groupby('produto_base_id')['valor_custo'].mean()
+        return df_vendas['produto_base_id'].map(custos_medios).fillna(0)
+
+    # Vendas e estoque codificados juntos para que os códigos coincidam
+    codigos = chave_atributos(pd.concat([df_vendas['atributos'], df_estoque['atributos']], ignore_index=True)).cat.codes.to_numpy()
+    codigos_vendas, codigos_estoque = codigos[:len(df_vendas)], codigos[len(df_vendas):]
+    estoque_valido = codigos_estoque >= 0
+    custos_medios = df_estoque['valor_custo'][estoque_valido].groupby(codigos_estoque[estoque_valido]).mean()
+    return pd.Series(codigos_vendas, index=df_vendas.index).map(custos_medios).fillna(0)
+
+def rateia_custo_evento(df_vendas, df_eventos=None):
+    """Custo de evento de cada venda, rateado pela quantidade vendida no evento.
+
+    Sem df_eventos, cada venda rateia o próprio custo_evento (regra da DRE e da RPC
+    dre_por_evento); com df_eventos, o custo total do evento vem da tabela de eventos.
+    Vendas sem evento usam divisor 1; evento com total vendido <= 0 não rateia nada.
+    """
+    if 'evento' not in df_vendas.columns:
+        return pd.Series(0.0, index=df_vendas.index)
+    quantidade = df_vendas['quantidade_vendida']
+    evento = df_vendas['evento']
+    if isinstance(evento.dtype, pd.CategoricalDtype):
+        evento = evento.astype(object)  # map/fillna num categórico ficariam presos às categorias
+    total_vendido = evento.map(quantidade.groupby(evento).sum()).fillna(1)
+    if df_eventos is None:
+        custo_evento = df_vendas['custo_evento'].fillna(0) if 'custo_evento' in df_vendas.columns else 0.0
+    elif not df_eventos.empty:
+        custos_eventos = df_eventos.groupby('nome_evento')[['aluguel', 'estacionamento', 'alimentacao', 'outros_custos']].sum().sum(axis=1)
+        custo_evento = evento.map(custos_eventos).fillna(0)
+    else:
+        return pd.Series(0.0, index=df_vendas.index)
+    rateado = custo_evento / total_vendido.where(total_vendido > 0) * quantidade
+    return rateado.fillna(0).astype('float64')
+
+def calcula_lucro_vendas(df_vendas, df_estoque, comissao_percentual, base_custo='produto', df_eventos=None):
+    """Receitas, custos e lucro de cada venda (COLUNAS_LUCRO), no mesmo índice de df_vendas.
+
+    DRE e Resumo usam o padrão (custo por produto_base, custo_evento da própria venda);
+    o Dashboard usa base_custo='variante' e o custo da tabela de eventos.
+    """
     if df_vendas.empty:
-        return pd.Series(dtype='float64')
-
-    df_vendas_lucro = df_vendas.copy()
-
-    # Cria a "impressão digital" para cada combinação de atributos
-    def criar_chave(attrs):
-        if attrs and isinstance(attrs, str):
-            try: attrs = json.loads(attrs)
-            except json.JSONDecodeError: return None
-        return json.dumps(attrs, sort_keys=True) if isinstance(attrs, dict) else None
-
-    # Prepara um mapa de custos médios a partir do estoque
-    custos_medios = pd.Series()
-    if not df_estoque.empty:
-        df_estoque_custo = df_estoque.copy()
-        df_estoque_custo['chave_atributos'] = df_estoque_custo['atributos'].apply(criar_chave)
-        custos_medios = df_estoque_custo.groupby('chave_atributos')['valor_custo'].mean()
+        return pd.DataFrame(columns=COLUNAS_LUCRO, dtype='float64')
+
+    quantidade = df_vendas['quantidade_vendida']
+    receita_bruta = df_vendas['preco_venda'] * quantidade
+    receita_liquida = receita_bruta - df_vendas['desconto'].fillna(0)
+    custo_estoque = custo_medio_por_venda(df_vendas, df_estoque, base_custo) * quantidade
+    comissao = receita_bruta * comissao_percentual
+    taxas = df_vendas['taxa_pagamento'].fillna(0)
+    custo_evento_rateado = rateia_custo_evento(df_vendas, df_eventos)
+
+    return pd.DataFrame({
+        'receita_bruta': receita_bruta,
+        'receita_liquida': receita_liquida,
+        'custo_estoque': custo_estoque,
+        'comissao': comissao,
+        'taxas': taxas,
+        'custo_evento_rateado': custo_evento_rateado,
+        'lucro': receita_liquida - custo_estoque - custo_evento_rateado - comissao - taxas,
+    }, index=df_vendas.index)
     
-    # Aplica o mapa de custos às vendas
-    df_vendas_lucro['chave_atributos'] = df_vendas_lucro['atributos'].apply(criar_chave)
-    df_vendas_lucro['custo_unitario'] = df_vendas_lucro['chave_atributos'].map(custos_medios).fillna(0)
-    df_vendas_lucro['custo_estoque'] = df_vendas_lucro['custo_unitario'] * df_vendas_lucro['quantidade_vendida']
-
-    # Calcula os outros custos e receitas
-    df_vendas_lucro['receita_bruta'] = df_vendas_lucro['preco_venda'] * df_vendas_lucro['quantidade_vendida']
-    df_vendas_lucro['receita_liquida'] = df_vendas_lucro['receita_bruta'] - df_vendas_lucro['desconto'].fillna(0)
-    df_vendas_lucro['comissao'] = df_vendas_lucro['receita_bruta'] * comissao_percentual
-    df_vendas_lucro['taxas_pagamento'] = df_vendas_lucro['taxa_pagamento'].fillna(0)
-
-    # Rateio de Custo de Evento
-    df_vendas_lucro['custo_evento_rateado'] = 0 # Inicia com zero
-    if not df_eventos.empty and 'evento' in df_vendas_lucro.columns:
-        custos_eventos = df_eventos.set_index('nome_evento')[['aluguel', 'estacionamento', 'alimentacao', 'outros_custos']].sum(axis=1)
-        vendas_por_evento = df_vendas_lucro.groupby('evento')['quantidade_vendida'].sum()
-        df_vendas_lucro['custo_total_evento'] = df_vendas_lucro['evento'].map(custos_eventos).fillna(0)
-        df_vendas_lucro['total_vendido_evento'] = df_vendas_lucro['evento'].map(vendas_por_evento).fillna(1)
-        df_vendas_lucro['custo_evento_rateado'] = (df_vendas_lucro['custo_total_evento'] / df_vendas_lucro['total_vendido_evento']) * df_vendas_lucro['quantidade_vendida']
-
-    # Cálculo Final do Lucro
-    df_vendas_lucro['lucro'] = (
-        df_vendas_lucro['receita_liquida'] - 
-        df_vendas_lucro['custo_estoque'] - 
-        df_vendas_lucro['custo_evento_rateado'] - 
-        df_vendas_lucro['comissao'] - 
-        df_vendas_lucro['taxas_pagamento']
+def filtra_periodo_dre(df_vendas_dre, periodo_inicio, periodo_fim):
+    """Filtra as vendas (com data_venda já convertida) pelo período informado, inclusive."""
+    return df_vendas_dre[
+        (df_vendas_dre['data_venda'].dt.date >= periodo_inicio) & 
+        (df_vendas_dre['data_venda'].dt.date <= periodo_fim)
+    ]
+
+def ordena_vendas_dre(df_vendas):
+    """Vendas com data válida num DatetimeIndex ordenado e evento categórico, para fatiar sem reconverter."""
+    if df_vendas.empty:
+        return df_vendas
+    datas = pd.to_datetime(df_vendas['data_venda'], errors='coerce', format='ISO8601')
+    if datas.dt.tz is not None:
+        datas = datas.dt.tz_localize(None)  # mesma data "de parede" que o .dt.date usaria
+    df = df_vendas.assign(data_venda=datas, evento=df_vendas['evento'].astype('category'))
+    df.index = pd.DatetimeIndex(datas, name='dia')
+    return df[df.index.notna()].sort_index(kind='stable')
+
+@st.cache_resource(ttl=30, max_entries=16)
+def carrega_vendas_dre_ordenadas(empresa_id, versao, _contexto):
+    """ordena_vendas_dre do espelho de vendas, uma vez por versão. Compartilhado: não modificar."""
+    return ordena_vendas_dre(_contexto.tabela('vendas', 'dre'))
+
+def fatia_periodo_dre(df_ordenado, periodo_inicio, periodo_fim):
+    """Mesmo resultado de filtra_periodo_dre sobre ordena_vendas_dre, por busca binária no índice."""
+    indice = df_ordenado.index
+    inicio = indice.searchsorted(pd.Timestamp(periodo_inicio), side='left')
+    fim = indice.searchsorted(pd.Timestamp(periodo_fim) + pd.Timedelta(days=1), side='left')
+    return df_ordenado.iloc[inicio:fim]
+
+def eventos_dre(df_ordenado):
+    """Eventos presentes nas vendas (pelos códigos do categórico), na ordem das categorias."""
+    codigos = np.unique(df_ordenado['evento'].cat.codes.to_numpy())
+    return df_ordenado['evento'].cat.categories[codigos[codigos >= 0]].tolist()
+
+def filtra_evento_dre(df_ordenado, evento):
+    categorias = df_ordenado['evento'].cat.categories
+    if evento not in categorias:
+        return df_ordenado.iloc[:0]
+    return df_ordenado[df_ordenado['evento'].cat.codes.to_numpy() == categorias.get_loc(evento)]
+
+def calcula_dre(df_filtered, df_estoque, df_custos_fixos, comissao_percentual):
+    """Monta a tabela da DRE (Descrição / Valor) para as vendas já filtradas."""
+    totais = calcula_lucro_vendas(df_filtered, df_estoque, comissao_percentual).sum()
+
+    # Soma dos custos fixos totais da empresa (não filtrado por período, por padrão)
+    custos_fixos_total = df_custos_fixos['valor'].sum() if not df_custos_fixos.empty else 0
+
+    return monta_tabela_dre(
+        receita_bruta_total=totais['receita_bruta'],
+        descontos_total=df_filtered['desconto'].sum() if not df_filtered.empty else 0,
+        custo_estoque_total=totais['custo_estoque'],
+        comissao_total=totais['comissao'],
+        taxas_total=totais['taxas'],
+        custo_evento_total=totais['custo_evento_rateado'],
+        custos_fixos_total=custos_fixos_total
     )
-    
-    return df_vendas_lucro['lucro']
-    
+
+DESCRICOES_DRE = [
+    '(+) Receita Bruta de Vendas', 
+    '(-) Descontos Concedidos', 
+    '(=) Receita Líquida', 
+    '(-) Custo dos Produtos Vendidos (CPV/CMV)', 
+    '(=) Lucro Bruto',
+    '(-) Despesas Variáveis',
+    '    (-) Comissões', 
+    '    (-) Taxas de Pagamento', 
+    '    (-) Custos de Evento (Rateado)',
+    '(-) Despesas Fixas',
+    '(=) Lucro Líquido (Resultado do Exercício)'
+]
+
+def valores_dre(receita_bruta_total, descontos_total, custo_estoque_total, comissao_total,
+                taxas_total, custo_evento_total, custos_fixos_total, vazio=''):
+    """Valores das linhas de DESCRICOES_DRE; aceita números ou Series (um valor por período)."""
+    lucro_bruto = receita_bruta_total - descontos_total - custo_estoque_total
+    resultado_antes_impostos = lucro_bruto - comissao_total - taxas_total - custo_evento_total - custos_fixos_total
+    return [
+        receita_bruta_total, 
+        -descontos_total, 
+        receita_bruta_total - descontos_total,
+        -custo_estoque_total,
+        lucro_bruto,
+        vazio,
+        -comissao_total,
+        -taxas_total,
+        -custo_evento_total,
+        -custos_fixos_total,
+        resultado_antes_impostos
+    ]
+
+def monta_tabela_dre(receita_bruta_total, descontos_total, custo_estoque_total, comissao_total,
+                     taxas_total, custo_evento_total, custos_fixos_total):
+    """Monta a tabela da DRE (Descrição / Valor) a partir dos totais já agregados."""
+    dre_data = {
+        'Descrição': DESCRICOES_DRE,
+        'Valor (R$)': valores_dre(receita_bruta_total, descontos_total, custo_estoque_total, comissao_total,
+                                  taxas_total, custo_evento_total, custos_fixos_total)
+    }
+    return pd.DataFrame(dre_data)
+
+# --- DRE Mensal ---
+# Todas as linhas da DRE para cada mês (trimestre/ano) num único groupby sobre as vendas
+# ordenadas. custos_fixos não tem data: o cadastro é tratado como valor mensal e cada
+# período recebe esse valor vezes os meses que ele cobre.
+GRAOS_DRE = {'Mês': ('M', 1), 'Trimestre': ('Q', 3), 'Ano': ('Y', 12)}
+
+def dre_por_periodo(df_ordenado, df_estoque, custos_fixos_mensais, comissao_percentual, grao='Mês'):
+    """Matriz da DRE (DESCRICOES_DRE x períodos, mais 'Total') a partir de ordena_vendas_dre.
+
+    Cada coluna bate com calcula_dre sobre as vendas daquele período: CMV pelo custo médio
+    do produto_base e custo de evento rateado pela quantidade vendida no evento dentro do
+    período. Meses sem venda aparecem com as despesas fixas.
+    """
+    freq, meses = GRAOS_DRE[grao]
+    if df_ordenado.empty:
+        return pd.DataFrame(index=pd.Index(DESCRICOES_DRE, name='Descrição'), columns=['Total'], dtype='float64')
+
+    periodo = df_ordenado.index.to_period(freq)
+    quantidade = df_ordenado['quantidade_vendida']
+    codigos_evento = df_ordenado['evento'].cat.codes.to_numpy()
+    total_vendido = quantidade.groupby([periodo.asi8, codigos_evento]).transform('sum').where(codigos_evento >= 0, 1)
+    custo_evento = df_ordenado['custo_evento'].fillna(0) / total_vendido.where(total_vendido > 0) * quantidade
+    receita_bruta = df_ordenado['preco_venda'] * quantidade
+
+    somas = pd.DataFrame({
+        'receita_bruta': receita_bruta,
+        'descontos': df_ordenado['desconto'].fillna(0),
+        'custo_estoque': custo_medio_por_venda(df_ordenado, df_estoque) * quantidade,
+        'comissao': receita_bruta * comissao_percentual,
+        'taxas': df_ordenado['taxa_pagamento'].fillna(0),
+        'custo_evento': custo_evento.fillna(0),
+    }).groupby(periodo).sum()
+    somas = somas.reindex(pd.period_range(periodo.min(), periodo.max(), freq=freq), fill_value=0.0)
+
+    valores = valores_dre(
+        somas['receita_bruta'], somas['descontos'], somas['custo_estoque'], somas['comissao'],
+        somas['taxas'], somas['custo_evento'], pd.Series(custos_fixos_mensais * meses, index=somas.index),
+        vazio=np.nan
+    )
+    matriz = pd.DataFrame(dict(zip(DESCRICOES_DRE, valores)), index=somas.index).T.astype('float64')
+    matriz.columns = matriz.columns.astype(str)
+    matriz['Total'] = matriz.sum(axis=1, min_count=1)
+    matriz.index.name = 'Descrição'
+    return matriz
+
+@st.cache_data(ttl=30, max_entries=32)
+def carrega_dre_mensal(empresa_id, versao, grao, comissao_percentual, custos_fixos_mensais, _df_ordenado, _df_estoque):
+    """dre_por_periodo cacheada por empresa, versão de vendas/estoque, grão e parâmetros."""
+    return dre_por_periodo(_df_ordenado, _df_estoque, custos_fixos_mensais, comissao_percentual, grao)
+
+def exporta_dre_mensal(matriz):
+    """CSV da matriz no formato do Excel em português (; e vírgula decimal)."""
+    return matriz.to_csv(sep=';', decimal=',', float_format='%.2f').encode('utf-8-sig')
+
+# --- Sensibilidade do Ponto de Equilíbrio ---
+# A mesma conta da simulação manual (custo fixo / margem de contribuição), feita de uma vez
+# para a grade inteira comissão x meio de pagamento x custo x preço por broadcasting.
+def grade_ponto_equilibrio(precos, custos, taxas_percentuais, comissoes, custo_fixo):
+    """(margem, peças, receita) com forma (comissões, taxas, custos, preços).
+
+    Onde a margem de contribuição é zero ou negativa não há equilíbrio: peças e receita
+    ficam inf, sem laço por célula.
+    """
+    preco = np.asarray(precos, dtype='float64')
+    custo = np.asarray(custos, dtype='float64')[:, None]
+    fracao_variavel = np.add.outer(np.asarray(comissoes, dtype='float64'), np.asarray(taxas_percentuais, dtype='float64') / 100)
+    margem = preco * (1 - fracao_variavel[:, :, None, None]) - custo
+    pecas = np.divide(custo_fixo, margem, out=np.full(margem.shape, np.inf), where=margem > 0)
+    return margem, pecas, pecas * preco
+
+def cenarios_pagamento(df_taxas):
+    """(nomes, taxas percentuais) dos meios de pagamento, mais o Mix (média) da simulação manual."""
+    if df_taxas.empty:
+        return ["Sem taxa"], np.zeros(1)
+    taxas = df_taxas['taxa_percentual'].astype('float64').to_numpy()
+    return df_taxas['forma_pagamento'].tolist() + ["Mix"], np.append(taxas, taxas.mean())
+
+# --- DRE no Servidor ---
+# A função dre_por_evento (supabase/migrations) agrega as vendas do período por evento
+# no Postgres, então a resposta tem uma linha por evento e não uma por venda.
+# O cálculo em pandas (calcula_dre) continua como fallback e referência de corretude.
+FUNCAO_AUSENTE_TTL = 300  # segundos até tentar de novo uma função que o banco não tinha
+CODIGOS_FUNCAO_AUSENTE = ('PGRST202', '42883')  # PostgREST / Postgres: função não encontrada
+
+@st.cache_data(ttl=30)
+def carrega_dre_por_evento(empresa_id, periodo_inicio, periodo_fim, comissao_percentual, versao, _contexto=None):
+    """Agregados da DRE por evento via RPC. Erros do cliente sobem (e não ficam em cache)."""
+    if _contexto is not None:
+        _contexto.registra_chamadas_backend(1)
+    response = supabase.rpc('dre_por_evento', {
+        'p_empresa_id': empresa_id,
+        'p_inicio': str(periodo_inicio),
+        'p_fim': str(periodo_fim),
+        'p_comissao': float(comissao_percentual)
+    }).execute()
+    return pd.DataFrame(response.data, columns=COLUNAS_DRE_POR_EVENTO)
+
+@st.cache_resource
+def get_funcoes_ausentes():
+    """{nome da função: instante em que o banco respondeu que ela não existe}."""
+    return {}
+
+def dre_por_evento_ou_fallback(empresa_id, periodo_inicio, periodo_fim, comissao_percentual, versao, contexto):
+    """carrega_dre_por_evento, ou None para a aba calcular em pandas.
+
+    Só "função inexistente" fica lembrada (por FUNCAO_AUSENTE_TTL); uma falha de rede vale
+    só para este rerun, e o próximo tenta a RPC de novo. Toda falha vai para o log.
+    """
+    ausentes = get_funcoes_ausentes()
+    if time.time() - ausentes.get('dre_por_evento', -FUNCAO_AUSENTE_TTL) < FUNCAO_AUSENTE_TTL:
+        return None
+    try:
+        return carrega_dre_por_evento(empresa_id, periodo_inicio, periodo_fim, comissao_percentual, versao, _contexto=contexto)
+    except Exception as e:
+        if getattr(e, 'code', None) in CODIGOS_FUNCAO_AUSENTE:
+            ausentes['dre_por_evento'] = time.time()
+            logger.warning("dre_por_evento não existe no banco; DRE calculada em pandas: %s", e)
+        else:
+            logger.exception("Falha na RPC dre_por_evento; DRE calculada em pandas neste rerun")
+        return None
+
+COLUNAS_DRE_POR_EVENTO = [
+    'evento', 'quantidade_vendas', 'receita_bruta', 'descontos', 'custo_estoque',
+    'comissoes', 'taxas', 'custo_evento_rateado'
+]
+
+def dre_de_agregados(df_dre_eventos, custos_fixos_total):
+    """Monta a tabela da DRE somando as linhas por evento devolvidas pela RPC."""
+    totais = df_dre_eventos[COLUNAS_DRE_POR_EVENTO[2:]].astype(float).sum()
+    return monta_tabela_dre(
+        receita_bruta_total=totais['receita_bruta'],
+        descontos_total=totais['descontos'],
+        custo_estoque_total=totais['custo_estoque'],
+        comissao_total=totais['comissoes'],
+        taxas_total=totais['taxas'],
+        custo_evento_total=totais['custo_evento_rateado'],
+        custos_fixos_total=custos_fixos_total
+    )
+
+def calcula_resumo_vendas(df_vendas, df_estoque, comissao_percentual):
+    """Calcula o lucro por venda e devolve (resumo por atributos e evento, resumo por evento)."""
+    # Receitas, custos e lucro por venda pelo motor de lucro
+    df_lucro = calcula_lucro_vendas(df_vendas, df_estoque, comissao_percentual)
+    vendas_completa = df_vendas.assign(
+        forma_pagamento=df_vendas['forma_pagamento'].fillna('não informado'),
+        taxa_pagamento=df_lucro['taxas'],
+        receita_bruta=df_lucro['receita_bruta'],
+        comissao=df_lucro['comissao'],
+        receita_liquida=df_lucro['receita_liquida'],
+        custo_estoque=df_lucro['custo_estoque'],
+        custo_evento_rateado=df_lucro['custo_evento_rateado'],
+        lucro_final=df_lucro['lucro'],
+    )
+
+    # Extrai atributos JSON (uma vez por variante distinta)
+    df_atributos_flat = expande_atributos(vendas_completa['atributos']).reset_index(drop=True)
+
+    vendas_display = pd.concat([vendas_completa.reset_index(drop=True), df_atributos_flat], axis=1)
+
+    nomes_atributos = df_atributos_flat.columns.tolist()
+    colunas_agrupamento = nomes_atributos + ['evento'] if 'evento' in vendas_display.columns else nomes_atributos
+
+    resumo = vendas_display.groupby(colunas_agrupamento).agg(
+        quantidade_vendida=('quantidade_vendida', 'sum'),
+        receita_bruta=('receita_bruta', 'sum'),
+        lucro_final=('lucro_final', 'sum')
+    ).reset_index()
+
+    resumo_evento = vendas_completa.groupby('evento').agg(
+        quantidade_vendida=('quantidade_vendida', 'sum'),
+        receita_bruta=('receita_bruta', 'sum'),
+        receita_liquida=('receita_liquida', 'sum'),
+        custo_estoque=('custo_estoque', 'sum'),
+        comissao=('comissao', 'sum'),
+        custo_evento_rateado=('custo_evento_rateado', 'sum'),
+        taxa_pagamento=('taxa_pagamento', 'sum'),
+        lucro_final=('lucro_final', 'sum')
+    ).reset_index()
+
+    return resumo, resumo_evento
+
+# --- Métricas do Dashboard ---
+# O Dashboard lê o resumo diário; metricas_dashboard_vendas é o mesmo cálculo sobre as
+# vendas linha a linha e serve de referência para a paridade (bench_bambuar.py --verificar).
+def _metricas_dashboard(receita_bruta, descontos, taxas, custo_estoque, custo_evento, total_pedidos, total_pecas, soma_preco, comissao_percentual):
+    comissao = receita_bruta * comissao_percentual
+    receita_liquida = receita_bruta - descontos
+    lucro = receita_liquida - custo_estoque - custo_evento - comissao - taxas
+    return {
+        'receita_bruta': receita_bruta,
+        'receita_liquida': receita_liquida,
+        'lucro': lucro,
+        'comissao': comissao,
+        'total_pedidos': int(total_pedidos),
+        'total_pecas': total_pecas,
+        'ticket_medio': receita_bruta / total_pecas if total_pecas > 0 else 0.0,
+        'lucro_por_unidade': lucro / total_pecas if total_pecas > 0 else 0.0,
+        'margem_lucro_percent': lucro / receita_bruta * 100 if receita_bruta > 0 else 0.0,
+        'valor_medio_venda': soma_preco / total_pedidos if total_pedidos > 0 else 0.0,
+    }
+
+def metricas_dashboard_resumo(df_resumo, df_estoque, df_eventos, comissao_percentual):
+    """Métricas gerais do Dashboard a partir do resumo diário (custo por variante, eventos da tabela)."""
+    # Custo e rateio só dependem da variante e do evento: agrega antes, para não ler JSON por grupo
+    por_variante = df_resumo.groupby('chave_variante', dropna=False, sort=False).agg(
+        atributos=('atributos', 'first'), quantidade_vendida=('quantidade_vendida', 'sum')
+    )
+    custo_estoque = custo_medio_por_venda(por_variante, df_estoque, base_custo='variante') * por_variante['quantidade_vendida']
+    por_evento = df_resumo.groupby('evento', dropna=False)['quantidade_vendida'].sum().reset_index()
+    return _metricas_dashboard(
+        df_resumo['receita_bruta'].sum(), df_resumo['descontos'].sum(), df_resumo['taxas'].sum(), custo_estoque.sum(),
+        rateia_custo_evento(por_evento, df_eventos).sum(), df_resumo['n_vendas'].sum(),
+        df_resumo['quantidade_vendida'].sum(), df_resumo['soma_preco_venda'].sum(), comissao_percentual
+    )
+
+def metricas_dashboard_vendas(df_vendas, df_estoque, df_eventos, comissao_percentual):
+    """As mesmas métricas calculadas sobre as vendas linha a linha (referência)."""
+    df_lucro = calcula_lucro_vendas(df_vendas, df_estoque, comissao_percentual, base_custo='variante', df_eventos=df_eventos)
+    return _metricas_dashboard(
+        df_lucro['receita_bruta'].sum(), df_vendas['desconto'].fillna(0).sum(), df_lucro['taxas'].sum(),
+        df_lucro['custo_estoque'].sum(), df_lucro['custo_evento_rateado'].sum(), len(df_vendas),
+        df_vendas['quantidade_vendida'].sum(), df_vendas['preco_venda'].sum(), comissao_percentual
+    )
+
+# --- Série Temporal do Dashboard ---
+# Receita, lucro e unidades por dia saem do resumo diário uma vez por versão dos dados;
+# trocar o grão só reagrupa essa série diária (um resample), sem refazer lucro nem atributos.
+GRAOS_SERIE = {'Dia': 'D', 'Semana': 'W-MON', 'Mês': 'MS'}
+COLUNAS_SERIE = ['receita_bruta', 'receita_liquida', 'lucro', 'quantidade_vendida', 'n_vendas']
+
+def serie_diaria_resumo(df_resumo, df_estoque, df_eventos, comissao_percentual):
+    """COLUNAS_SERIE por dia (DatetimeIndex ordenado), com a mesma regra de metricas_dashboard_resumo."""
+    if df_resumo.empty:
+        return pd.DataFrame(columns=COLUNAS_SERIE, index=pd.DatetimeIndex([], name='dia'), dtype='float64')
+    por_variante = df_resumo.groupby('chave_variante', dropna=False, sort=False).agg(atributos=('atributos', 'first'))
+    custo_variante = custo_medio_por_venda(por_variante, df_estoque, base_custo='variante')
+    quantidade = df_resumo['quantidade_vendida']
+    receita_bruta = df_resumo['receita_bruta']
+    receita_liquida = receita_bruta - df_resumo['descontos']
+    custo_estoque = df_resumo['chave_variante'].map(custo_variante).fillna(0) * quantidade
+    custos = custo_estoque + rateia_custo_evento(df_resumo, df_eventos) + receita_bruta * comissao_percentual + df_resumo['taxas']
+    df = pd.DataFrame({
+        'receita_bruta': receita_bruta,
+        'receita_liquida': receita_liquida,
+        'lucro': receita_liquida - custos,
+        'quantidade_vendida': quantidade,
+        'n_vendas': df_resumo['n_vendas'],
+    }).set_axis(pd.DatetimeIndex(pd.to_datetime(df_resumo['dia']), name='dia'))
+    return df[df.index.notna()].groupby(level='dia').sum()
+
+@st.cache_data(ttl=30, max_entries=32)
+def carrega_serie_diaria(empresa_id, versao, comissao_percentual, _df_resumo, _df_estoque, _df_eventos):
+    """serie_diaria_resumo em cache por (empresa, versão de vendas/estoque/eventos e do resumo, comissão)."""
+    return serie_diaria_resumo(_df_resumo, _df_estoque, _df_eventos, comissao_percentual)
+
+@st.cache_data(ttl=30, max_entries=96)
+def carrega_serie_temporal(empresa_id, versao, grao, _serie_diaria):
+    """A série diária reagrupada no grão (chave de GRAOS_SERIE); semanas começam na segunda."""
+    if _serie_diaria.empty:
+        return _serie_diaria
+    return _serie_diaria.resample(GRAOS_SERIE[grao], label='left', closed='left').sum()
+
+def vendas_por_atributo(df_resumo):
+    """Quantidade vendida por variante, com uma coluna por atributo (para o gráfico por atributo)."""
+    por_variante = df_resumo.groupby('chave_variante', dropna=False, sort=False).agg(
+        atributos=('atributos', 'first'), quantidade_vendida=('quantidade_vendida', 'sum')
+    ).reset_index(drop=True)
+    return pd.concat([expande_atributos(por_variante['atributos']), por_variante[['quantidade_vendida']]], axis=1)
+
+# --- Catálogo ---
+# Cada página do catálogo vai ao navegador como um único st.markdown (uma grade CSS),
+# em vez de um elemento por card; só as imagens da página visível são lidas.
+TAMANHOS_PAGINA_CATALOGO = [12, 24, 48, 96]
+CARD_SEM_IMAGEM = '<div style="height:180px; display:flex; align-items:center; justify-content:center; flex-direction:column; color:grey;">🖼️<br>Sem Imagem</div>'
+
+CACHE_IMAGENS_MB = int(os.environ.get("BAMBUAR_CACHE_IMAGENS_MB", 64))
+
+@st.cache_resource
+def get_cache_imagens():
+    """Cache de imagens do catálogo, compartilhado entre sessões e empresas (limite em bytes)."""
+    return CacheImagens(CACHE_IMAGENS_MB * 1024 * 1024)
+
+def pagina_catalogo(df_disponivel, tamanho_pagina, indice_pagina):
+    """Fatia a página pedida (índice a partir de 1). Retorna (df_pagina, total, num_paginas)."""
+    total = len(df_disponivel)
+    num_paginas = max(1, -(-total // tamanho_pagina))
+    indice_pagina = min(max(int(indice_pagina), 1), num_paginas)
+    inicio = (indice_pagina - 1) * tamanho_pagina
+    return df_disponivel.iloc[inicio:inicio + tamanho_pagina], total, num_paginas
+
+def html_pagina_catalogo(df_pagina, atributos_cols, pasta):
+    """HTML da grade com os cards de uma página, em uma string só."""
+    cards = []
+    for row in df_pagina.to_dict('records'):
+        # O card usa a miniatura (WebP > JPEG); o original fica para a visualização de detalhe
+        caminho_imagem, mime_imagem = imagem_para_card(pasta, row['chave_variante'])
+        base64_image = get_cache_imagens().base64(caminho_imagem) if caminho_imagem else None
+        image_html = f'<img src="data:{mime_imagem};base64,{base64_image}">' if base64_image else CARD_SEM_IMAGEM
+
+        titulo_card = str(row[atributos_cols[0]]) if atributos_cols else f"Produto {row['produto_base_id']}"
+        detalhes_card = " | ".join(str(row[col]) for col in atributos_cols[1:])
+        # Sem quebras de linha: linha em branco ou recuo dentro do bloco faria o markdown virar texto/código
+        cards.append(
+            '<div class="card">'
+            f'<div class="card-img-container">{image_html}</div>'
+            '<div class="card-body">'
+            f'<h5>{html.escape(titulo_card)}</h5>'
+            f'<p>{html.escape(detalhes_card)}</p>'
+            f"<p><b>Saldo: {int(row['saldo'])}</b></p>"
+            '</div></div>'
+        )
+    return f'<div class="catalogo-grid">{"".join(cards)}</div>'
+
+# --- Carga Inicial Concorrente ---
+def carrega_dados_iniciais(contexto):
+    """Carrega as tabelas da abertura do app em paralelo, pelo ContextoDados do rerun.
+
+    As independentes saem juntas no pool; atributo_tipos -> atributo_valores começa assim
+    que produtos_base chega. Retorna (dict tabela -> DataFrame, dict tabela -> segundos).
+    """
+    tempos = {}
+    ctx = get_script_run_ctx()
+    empresa_id = contexto.empresa_id
+
+    def carrega(table_name, query_params):
+        inicio = time.perf_counter()
+        df = contexto.carregar(table_name, query_params)
+        tempos[table_name] = time.perf_counter() - inicio
+        return df
+
+    def carrega_hierarquia(futuro_produtos):
+        df_produtos_base = futuro_produtos.result()
+        df_atributo_tipos = pd.DataFrame()
+        if not df_produtos_base.empty:
+            df_atributo_tipos = carrega('atributo_tipos', {"filters": {"produto_base_id": df_produtos_base['id'].tolist()}})
+        df_atributo_valores = pd.DataFrame()
+        if not df_atributo_tipos.empty:
+            df_atributo_valores = carrega('atributo_valores', {"filters": {"atributo_tipo_id": df_atributo_tipos['id'].tolist()}})
+        return df_atributo_tipos, df_atributo_valores
+
+    inicio_total = time.perf_counter()
+    # As threads herdam o contexto da sessão para que o cache do Streamlit funcione nelas
+    with ThreadPoolExecutor(max_workers=4, initializer=lambda: add_script_run_ctx(ctx=ctx)) as executor:
+        futuro_produtos = executor.submit(carrega, 'produtos_base', {"filters": {"empresa_id": empresa_id}})
+        futuro_variantes = executor.submit(carrega, 'produto_variantes', {"filters": {"empresa_id": empresa_id}})
+        futuro_taxas = executor.submit(carrega, 'taxas_pagamento', {"filters": {"empresa_id": empresa_id}})
+        futuro_hierarquia = executor.submit(carrega_hierarquia, futuro_produtos)
+        df_atributo_tipos, df_atributo_valores = futuro_hierarquia.result()
+        dados = {
+            'produtos_base': futuro_produtos.result(),
+            'produto_variantes': futuro_variantes.result(),
+            'taxas_pagamento': futuro_taxas.result(),
+            'atributo_tipos': df_atributo_tipos,
+            'atributo_valores': df_atributo_valores,
+        }
+    tempos['total'] = time.perf_counter() - inicio_total
+    return dados, tempos
+
 # --- Bloco Principal do App ---
 def main_app():
     user_id = st.session_state.user_session['user']['id']
@@ -328,21 +1721,33 @@ def main_app():
         for key in list(st.session_state.keys()): del st.session_state[key]
         st.rerun()
 
+    # Sobe as vendas que ficaram no diário (de outra sessão ou de antes de reiniciar)
+    sincronizador_vendas = get_sincronizador_vendas()
+    diario_vendas = get_diario_vendas()
+    if hasattr(supabase, 'online'):
+        # Só o stand-in local: simula a queda da conexão na feira
+        supabase.online = not st.sidebar.toggle("Simular sem conexão", value=not supabase.online)
+
+    # Todas as leituras deste rerun passam por aqui: cada tabela/consulta é carregada uma única vez
+    contexto_dados = ContextoDados(empresa_id)
+
     with st.spinner('Carregando dados da sua empresa...'):
-        df_produtos_base = load_data('produtos_base', {"filters": {"empresa_id": empresa_id}})
-        df_variantes = load_data('produto_variantes', {"filters": {"empresa_id": empresa_id}})
-        df_estoque = load_data('estoque', {"filters": {"empresa_id": empresa_id}})
-        df_vendas = load_data('vendas', {"filters": {"empresa_id": empresa_id}})
-        df_taxas = load_data('taxas_pagamento', {"filters": {"empresa_id": empresa_id}})
-                
-        
-        df_atributo_tipos = pd.DataFrame()
-        if not df_produtos_base.empty:
-            df_atributo_tipos = load_data('atributo_tipos', {"filters": {"produto_base_id": df_produtos_base['id'].tolist()}})
-        
-        df_atributo_valores = pd.DataFrame()
-        if not df_atributo_tipos.empty:
-            df_atributo_valores = load_data('atributo_valores', {"filters": {"atributo_tipo_id": df_atributo_tipos['id'].tolist()}})
+        # vendas e estoque são carregados em cada aba, só com as colunas que ela usa (PROJECOES)
+        dados_iniciais, tempos_carga = carrega_dados_iniciais(contexto_dados)
+        df_produtos_base = dados_iniciais['produtos_base']
+        df_variantes = dados_iniciais['produto_variantes']
+        df_taxas = dados_iniciais['taxas_pagamento']
+        df_atributo_tipos = dados_iniciais['atributo_tipos']
+        df_atributo_valores = dados_iniciais['atributo_valores']
+        st.session_state['tempos_carga'] = tempos_carga
+
+    latencias_escrita = st.session_state.setdefault('latencias_escrita', [])
+    painel_carga = st.sidebar.expander("⏱️ Tempos de carga")
+    with painel_carga:
+        st.dataframe(
+            pd.DataFrame({'tabela': list(tempos_carga), 'segundos': list(tempos_carga.values())}),
+            hide_index=True, use_container_width=True
+        )
 
     tab_list = ['Dashboard', 'Estoque', 'Estoque - Catálogo', 'Resumo de Vendas', 'Vendas e Eventos', 'DRE', 'Ponto de Equilíbrio', 'DRE Projetada', 'Produtos e Variantes', 'Configurações']
     selected_tab = st.radio("Navegação:", tab_list, horizontal=True, label_visibility="collapsed")
@@ -357,12 +1762,10 @@ def main_app():
         )
         st.markdown("---")
 
-        # Carrega os dados atualizados para as verificações
-        df_vendas = load_data('vendas', {"filters": {"empresa_id": empresa_id}})
-        df_estoque = load_data('estoque', {"filters": {"empresa_id": empresa_id}})
-        df_produtos_base = load_data('produtos_base', {"filters": {"empresa_id": empresa_id}})
-        df_atributo_tipos = load_data('atributo_tipos', {})
-        df_atributo_valores = load_data('atributo_valores', {})
+        # Índice do que já foi usado, para as verificações; produtos e atributos já vieram na carga inicial
+        versoes = get_versoes_cache()
+        versao_uso = (versoes.versao(empresa_id, 'estoque'), versoes.versao(empresa_id, 'vendas'))
+        valores_usados, atributos_usados = carrega_uso_atributos(empresa_id, versao_uso, _contexto=contexto_dados)
 
         # =========================
         # PASSO 1: CRIAR PRODUTO BASE
@@ -439,11 +1842,10 @@ def main_app():
                             col_nome, col_edit, col_del = st.columns([4, 1, 1])
                             col_nome.markdown(f"**{tipo['nome_atributo']}**")
 
-                            em_estoque = (df_estoque['atributos'].astype(str).str.contains(tipo['nome_atributo'], na=False)).any() if not df_estoque.empty else False
-                            em_vendas = (df_vendas['atributos'].astype(str).str.contains(tipo['nome_atributo'], na=False)).any() if not df_vendas.empty else False
+                            em_uso = tipo['nome_atributo'] in atributos_usados
 
                             if col_edit.button("✏️", key=f"edit_attr_{tipo['id']}"):
-                                if em_estoque or em_vendas:
+                                if em_uso:
                                     st.warning(f"Não é possível editar o atributo '{tipo['nome_atributo']}' pois ele já foi usado.")
                                 else:
                                     novo_nome_input = st.text_input(
@@ -452,17 +1854,17 @@ def main_app():
                                         key=f"input_attr_{tipo['id']}"
                                     )
                                     if st.button("Salvar alteração", key=f"save_attr_{tipo['id']}"):
-                                        supabase.table('atributo_tipos').update(
-                                            {'nome_atributo': novo_nome_input}
-                                        ).eq('id', tipo['id']).execute()
+                                        with UnidadeDeTrabalho(empresa_id, latencias_escrita) as unidade:
+                                            unidade.atualizar('atributo_tipos', {'nome_atributo': novo_nome_input}, {'id': tipo['id']})
                                         st.success("Atributo atualizado!")
                                         st.rerun()
 
                             if col_del.button("🗑️", key=f"del_attr_{tipo['id']}"):
-                                if em_estoque or em_vendas:
+                                if em_uso:
                                     st.warning(f"Não é possível excluir o atributo '{tipo['nome_atributo']}' pois ele já foi usado.")
                                 else:
-                                    supabase.table('atributo_tipos').delete().eq('id', tipo['id']).execute()
+                                    with UnidadeDeTrabalho(empresa_id, latencias_escrita) as unidade:
+                                        unidade.excluir('atributo_tipos', {'id': tipo['id']})
                                     st.success(f"Atributo '{tipo['nome_atributo']}' excluído!")
                                     st.rerun()
                     else:
@@ -499,6 +1901,7 @@ def main_app():
                             tipos_com_produto['id'] == x, 'display_name'
                         ].iloc[0]
                     )
+                    nome_tipo_val = tipos_com_produto.loc[tipos_com_produto['id'] == tipo_id_val, 'nome_atributo'].iloc[0]
 
                     col_val1, col_val2 = st.columns([1, 2])
                     with col_val1:
@@ -537,11 +1940,10 @@ def main_app():
                                 col_nome, col_edit, col_del = st.columns([4, 1, 1])
                                 col_nome.markdown(f"{val['valor']}")
 
-                                em_estoque = (df_estoque['atributos'].astype(str).str.contains(val['valor'], na=False)).any() if not df_estoque.empty else False
-                                em_vendas = (df_vendas['atributos'].astype(str).str.contains(val['valor'], na=False)).any() if not df_vendas.empty else False
+                                em_uso = (nome_tipo_val, val['valor']) in valores_usados
 
                                 if col_edit.button("✏️", key=f"edit_val_{val['id']}"):
-                                    if em_estoque or em_vendas:
+                                    if em_uso:
                                         st.warning(f"Não é possível editar o valor '{val['valor']}' pois ele já foi usado.")
                                     else:
                                         novo_nome_valor = st.text_input(
@@ -550,17 +1952,17 @@ def main_app():
                                             key=f"input_val_{val['id']}"
                                         )
                                         if st.button("Salvar valor", key=f"save_val_{val['id']}"):
-                                            supabase.table('atributo_valores').update(
-                                                {'valor': novo_nome_valor}
-                                            ).eq('id', val['id']).execute()
+                                            with UnidadeDeTrabalho(empresa_id, latencias_escrita) as unidade:
+                                                unidade.atualizar('atributo_valores', {'valor': novo_nome_valor}, {'id': val['id']})
                                             st.success("Valor atualizado!")
                                             st.rerun()
 
                                 if col_del.button("🗑️", key=f"del_val_{val['id']}"):
-                                    if em_estoque or em_vendas:
+                                    if em_uso:
                                         st.warning(f"Não é possível excluir o valor '{val['valor']}' pois ele já foi usado.")
                                     else:
-                                        supabase.table('atributo_valores').delete().eq('id', val['id']).execute()
+                                        with UnidadeDeTrabalho(empresa_id, latencias_escrita) as unidade:
+                                            unidade.excluir('atributo_valores', {'id': val['id']})
                                         st.success(f"Valor '{val['valor']}' excluído!")
                                         st.rerun()
                         else:
@@ -634,23 +2036,70 @@ def main_app():
                                 )).encode('utf-8')
                             ).hexdigest()
 
-                            # Salvando a imagem, se foi enviada
+                            # Salvando a imagem, se foi enviada: original + miniaturas (JPEG e WebP)
                             if imagem is not None:
-                                pasta_imagens = os.path.join("dados", str(empresa_id), "imagens_estoque")
-                                os.makedirs(pasta_imagens, exist_ok=True)
-
-                                caminho_arquivo = os.path.join(pasta_imagens, f"{chave_variante}.jpg")
-                                with open(caminho_arquivo, "wb") as f:
-                                    f.write(imagem.read())
+                                try:
+                                    salva_imagem_estoque(imagem.getvalue(), pasta_imagens(empresa_id), chave_variante)
+                                except ValueError as e:
+                                    st.warning(f"O item foi adicionado, mas a imagem não foi salva. {e}")
 
                             st.success("Produto adicionado ao estoque!")
                             st.rerun()
             else:
                 st.warning("Defina os atributos para este produto na aba 'Configurar Catálogo'.")
 
+            with st.expander("📥 Importar entradas de uma planilha (CSV/XLSX)"):
+                st.caption(
+                    "Uma linha por entrada: `produto`, uma coluna por atributo (ex.: Cor, Tamanho), `quantidade`, "
+                    "`valor_custo` e, opcionalmente, `data_entrada` e `observacao`. Atributos que o produto não tem ficam em branco."
+                )
+                st.download_button(
+                    "Baixar modelo (CSV)", modelo_planilha_estoque(df_produtos_base, df_atributo_tipos),
+                    file_name="modelo_estoque.csv", mime="text/csv"
+                )
+                if resultado_importacao := st.session_state.pop('resultado_importacao_estoque', None):
+                    st.success(resultado_importacao)
+                # Trocar a key limpa o arquivo depois de importar, para não importar duas vezes
+                arquivo = st.file_uploader(
+                    "Planilha de estoque", type=['csv', 'xlsx'],
+                    key=f"arquivo_importacao_estoque_{st.session_state.get('importacoes_estoque', 0)}"
+                )
+                if arquivo is not None:
+                    try:
+                        df_validas, df_erros = valida_importacao_estoque(
+                            le_planilha(arquivo.name, arquivo.getvalue()),
+                            df_produtos_base, df_atributo_tipos, df_atributo_valores, datetime.today().date()
+                        )
+                    except ValueError as e:
+                        st.error(str(e))
+                    else:
+                        st.write(f"**{len(df_validas)}** linha(s) válida(s), **{len(df_erros)}** com erro.")
+                        if not df_erros.empty:
+                            st.dataframe(df_erros, hide_index=True, use_container_width=True)
+                        if not df_validas.empty and st.button(f"Importar {len(df_validas)} linha(s) válida(s)", type="primary"):
+                            inicio_importacao = time.perf_counter()
+                            try:
+                                inseridas = insere_em_lotes('estoque', df_validas.drop(columns='linha').to_dict('records'), empresa_id)
+                            except Exception as e:
+                                st.error(f"Erro ao importar o estoque: {e}")
+                            else:
+                                duracao = time.perf_counter() - inicio_importacao
+                                st.session_state['resultado_importacao_estoque'] = (
+                                    f"{inseridas} entrada(s) importada(s) em {duracao:.2f}s ({inseridas / max(duracao, 1e-9):,.0f} linhas/s)."
+                                )
+                                st.session_state['importacoes_estoque'] = st.session_state.get('importacoes_estoque', 0) + 1
+                                st.rerun()
+
         st.markdown("---")
         st.subheader("Estoque Atual (Saldo)")
-        df_saldo_final = calcula_estoque_final(df_estoque, df_vendas)
+        if st.button("🔄 Reconstruir saldos a partir do histórico"):
+            divergencias = confere_livro_saldos(contexto_dados)
+            if divergencias:
+                st.warning(f"{divergencias} variante(s) divergiam do histórico. Os saldos foram reconstruídos.")
+            else:
+                st.success("Saldos conferidos com o histórico: nenhuma divergência.")
+
+        df_saldo_final = saldo_estoque(contexto_dados, com_custo=True)
         if not df_saldo_final.empty:
             st.dataframe(df_saldo_final, hide_index=True, use_container_width=True)
         else:
@@ -662,16 +2111,15 @@ def main_app():
     elif selected_tab == 'Estoque - Catálogo':
         st.header("🖼️ Catálogo Visual de Estoque")
 
-        @st.cache_data
-        def get_image_as_base64(path):
-            if not os.path.exists(path):
-                return None
-            with open(path, "rb") as f:
-                return base64.b64encode(f.read()).decode()
-
         # CSS melhorado para os cards
         st.markdown("""
             <style>
+            .catalogo-grid {
+                display: grid;
+                grid-template-columns: repeat(4, minmax(0, 1fr));
+                gap: 1.5rem 1rem;
+                margin-bottom: 1rem;
+            }
             .card {
                 background-color: #262730;
                 border: 1px solid #444;
@@ -716,7 +2164,7 @@ def main_app():
             </style>
         """, unsafe_allow_html=True)
 
-        df_catalogo = calcula_estoque_final(df_estoque, df_vendas)
+        df_catalogo = saldo_estoque(contexto_dados)
 
         if df_catalogo.empty:
             st.warning("Não há produtos no estoque para exibir.")
@@ -735,57 +2183,53 @@ def main_app():
                     ).hexdigest(),
                     axis=1
                 )
-                # Ordenar o DataFrame pelo primeiro atributo
-                df_disponivel.sort_values(by=atributos_cols[0], inplace=True)
+                # Ordenar pelo primeiro atributo; a chave desempata para a paginação ser estável
+                df_disponivel.sort_values(by=atributos_cols[:1] + ['chave_variante'], inplace=True)
                 df_disponivel.reset_index(drop=True, inplace=True)
 
-                # Total de produtos e número de colunas
-                num_produtos = len(df_disponivel)
-                num_colunas = 4
-                col_list = st.columns(num_colunas)
-
-                for i, (_, row) in enumerate(df_disponivel.iterrows()):
-                    # Quando for o início de uma nova linha (exceto a primeira), insere uma div espaçadora
-                    if i > 0 and i % num_colunas == 0:
-                        st.markdown(
-                            "<div style='height:1.5rem;'></div>", unsafe_allow_html=True
-                        )
-                        col_list = st.columns(num_colunas)  # Reinicializa as colunas para a nova linha
-
-                    with col_list[i % num_colunas]:
-                        chave_variante = row['chave_variante']
-                        nome_arquivo = f"{chave_variante}.jpg"
-                        caminho_imagem = os.path.join(f"dados/{empresa_id}/imagens_estoque", nome_arquivo)
-                        base64_image = get_image_as_base64(caminho_imagem)
+                col_tamanho, col_pagina, col_total = st.columns([1, 1, 2])
+                tamanho_pagina = col_tamanho.selectbox("Cards por página", TAMANHOS_PAGINA_CATALOGO, index=1, key="catalogo_tamanho_pagina")
+                num_paginas = max(1, -(-len(df_disponivel) // tamanho_pagina))
+                # Ao aumentar o tamanho da página, o índice guardado pode passar do fim
+                if st.session_state.get("catalogo_pagina", 1) > num_paginas:
+                    st.session_state["catalogo_pagina"] = num_paginas
+                indice_pagina = col_pagina.number_input("Página", min_value=1, max_value=num_paginas, step=1, key="catalogo_pagina")
+                df_pagina, total_variantes, num_paginas = pagina_catalogo(df_disponivel, tamanho_pagina, indice_pagina)
+                inicio_pagina = (indice_pagina - 1) * tamanho_pagina
+                col_total.caption(
+                    f"Mostrando {inicio_pagina + 1}–{inicio_pagina + len(df_pagina)} de {total_variantes} variantes "
+                    f"com saldo (página {indice_pagina} de {num_paginas})"
+                )
 
-                        image_html = (
-                            f'<img src="data:image/jpeg;base64,{base64_image}">' if base64_image
-                            else '<div style="height:180px; display:flex; align-items:center; justify-content:center; flex-direction:column; color:grey;">🖼️<br>Sem Imagem</div>'
-                        )
+                st.markdown(html_pagina_catalogo(df_pagina, atributos_cols, pasta_imagens(empresa_id)), unsafe_allow_html=True)
+                cache = get_cache_imagens().estatisticas()
+                st.caption(
+                    f"Cache de imagens: {cache['acertos']} acertos, {cache['faltas']} faltas, {cache['descartes']} descartes | "
+                    f"{cache['entradas']} imagens, {cache['bytes'] / 1024**2:.1f} de {cache['limite_bytes'] / 1024**2:.0f} MB"
+                )
 
-                        titulo_card = str(row[atributos_cols[0]]) if atributos_cols else f"Produto {row['produto_base_id']}"
-                        detalhes_card = " | ".join(str(row[col]) for col in atributos_cols[1:]) if len(atributos_cols) > 1 else ""
-
-                        html_card = f"""
-                        <div class="card">
-                            <div class="card-img-container">{image_html}</div>
-                            <div class="card-body">
-                                <h5>{titulo_card}</h5>
-                                <p>{detalhes_card}</p>
-                                <p><b>Saldo: {int(row['saldo'])}</b></p>
-                            </div>
-                        </div>
-                        """
-                        st.markdown(html_card, unsafe_allow_html=True)
-
-                # Preenche colunas restantes invisíveis, se necessário
-                restante = num_colunas - (len(df_disponivel) % num_colunas) if len(df_disponivel) % num_colunas != 0 else 0
-                for i in range(restante):
-                    with col_list[(len(df_disponivel) + i) % num_colunas]:
-                        st.markdown(
-                            "<div class='card' style='opacity:0; border:none; box-shadow:none; height:100%'></div>",
-                            unsafe_allow_html=True
+                # Detalhe: só aqui o original (em tamanho cheio) é enviado ao navegador
+                st.markdown("---")
+                rotulos_detalhe = dict(zip(
+                    df_pagina['chave_variante'],
+                    df_pagina[atributos_cols].astype(str).agg(" | ".join, axis=1)
+                ))
+                chave_detalhe = st.selectbox(
+                    "🔍 Ver imagem original",
+                    options=[None] + list(rotulos_detalhe),
+                    format_func=lambda chave: "---" if chave is None else rotulos_detalhe[chave]
+                )
+                if chave_detalhe is not None:
+                    caminho_original = caminhos_imagem(pasta_imagens(empresa_id), chave_detalhe)['original']
+                    formato_original = formato_imagem(caminho_original)
+                    if formato_original:
+                        # Formato pelo conteúdo: original antigo pode ser PNG gravado como .jpg
+                        st.image(
+                            caminho_original, caption=rotulos_detalhe[chave_detalhe],
+                            output_format=formato_original if formato_original in ('JPEG', 'PNG') else 'auto',
                         )
+                    else:
+                        st.info("Esta variante não tem imagem.")
 
 
 
@@ -794,43 +2238,40 @@ def main_app():
     elif selected_tab == 'Dashboard':
         st.header(f"📊 Dashboard: {nome_da_empresa}")
 
-        # Carrega dados
-        df_comissao = load_data('comissao', {"filters": {"empresa_id": empresa_id}})
-        df_eventos = load_data('eventos', {"filters": {"empresa_id": empresa_id}})
+        # Carrega dados (as vendas vêm somadas do resumo diário, não linha a linha)
+        df_resumo = resumo_diario_em_dia(contexto_dados)
+        df_estoque = contexto_dados.tabela('estoque', 'dashboard')
+        df_comissao = contexto_dados.tabela('comissao')
+        df_eventos = contexto_dados.tabela('eventos')
         COMISSAO_PERCENTUAL = df_comissao['percentual_comissao'].iloc[0] if not df_comissao.empty else 0.10
 
-        if df_vendas.empty:
+        if df_resumo.empty:
             st.warning("Nenhuma venda registrada para exibir o Dashboard.")
         else:
             # ==================== CÁLCULOS ====================
-            df_vendas_dash = df_vendas.copy()
-
-            # Receita e lucro
-            df_vendas_dash['receita_bruta'] = df_vendas_dash['preco_venda'] * df_vendas_dash['quantidade_vendida']
-            df_vendas_dash['receita_liquida'] = df_vendas_dash['receita_bruta'] - df_vendas_dash['desconto'].fillna(0)
-            df_vendas_dash['lucro'] = calcula_lucro_v3(df_vendas_dash, df_estoque, df_eventos, COMISSAO_PERCENTUAL)
+            # Receita e lucro (custo por variante e custo de evento da tabela de eventos)
+            metricas = metricas_dashboard_resumo(df_resumo, df_estoque, df_eventos, COMISSAO_PERCENTUAL)
 
             # Totais
-            receita_bruta_total = df_vendas_dash['receita_bruta'].sum()
-            receita_liquida_total = df_vendas_dash['receita_liquida'].sum()
-            lucro_total = df_vendas_dash['lucro'].sum()
-            comissao_total = (df_vendas_dash['receita_bruta'] * COMISSAO_PERCENTUAL).sum()
+            receita_bruta_total = metricas['receita_bruta']
+            receita_liquida_total = metricas['receita_liquida']
+            lucro_total = metricas['lucro']
+            comissao_total = metricas['comissao']
             total_custos_evento = (
                 (df_eventos['aluguel'].sum() if not df_eventos.empty else 0) +
                 (df_eventos['estacionamento'].sum() if not df_eventos.empty else 0) +
                 (df_eventos['alimentacao'].sum() if not df_eventos.empty else 0) +
                 (df_eventos['outros_custos'].sum() if not df_eventos.empty else 0)
             )
-            total_pedidos = len(df_vendas)
-            total_pecas_vendidas = df_vendas['quantidade_vendida'].sum()
+            total_pedidos = metricas['total_pedidos']
 
             # Métricas
-            ticket_medio = receita_bruta_total / total_pecas_vendidas if total_pecas_vendidas > 0 else 0.0
-            lucro_por_unidade = lucro_total / total_pecas_vendidas if total_pecas_vendidas > 0 else 0.0
-            margem_lucro_percent = (lucro_total / receita_bruta_total) * 100 if receita_bruta_total > 0 else 0.0
+            ticket_medio = metricas['ticket_medio']
+            lucro_por_unidade = metricas['lucro_por_unidade']
+            margem_lucro_percent = metricas['margem_lucro_percent']
 
             # Estoque atual
-            df_saldo_dash = calcula_estoque_final(df_estoque, df_vendas)
+            df_saldo_dash = saldo_estoque(contexto_dados)
             estoque_total = df_saldo_dash['saldo'].sum() if not df_saldo_dash.empty else 0
             valor_estoque_reais = 0.0
             if not df_estoque.empty and not df_saldo_dash.empty:
@@ -838,7 +2279,7 @@ def main_app():
                 df_saldo_dash['valor_custo_medio'] = df_saldo_dash['produto_base_id'].map(custos_medios)
                 valor_estoque_reais = (df_saldo_dash['saldo'] * df_saldo_dash['valor_custo_medio'].fillna(0)).sum()
 
-            valor_medio_venda = df_vendas['preco_venda'].mean() if not df_vendas.empty else 0.0
+            valor_medio_venda = metricas['valor_medio_venda']
             valor_mercado_estoque = estoque_total * valor_medio_venda
 
             # ==================== MÉTRICAS ====================
@@ -871,19 +2312,11 @@ def main_app():
             # --- Gráfico Vendas por Atributo ---
             st.subheader("Vendas por Atributo")
 
-            # Extrai os atributos JSON para colunas
-            df_vendas_analise = df_vendas.copy()
-            df_vendas_analise['atributos'] = df_vendas_analise['atributos'].apply(
-                lambda x: json.loads(x) if isinstance(x, str) else x
-            )
-            df_atributos_vendas = pd.json_normalize(df_vendas_analise['atributos'])
-            df_vendas_final = pd.concat(
-                [df_vendas_analise.drop('atributos', axis=1), df_atributos_vendas],
-                axis=1
-            )
+            # Quantidade por variante, com os atributos JSON em colunas (uma linha por variante)
+            df_vendas_final = vendas_por_atributo(df_resumo)
 
             # Opções dinâmicas para o selectbox
-            nomes_atributos = list(df_atributos_vendas.columns)
+            nomes_atributos = [coluna for coluna in df_vendas_final.columns if coluna != 'quantidade_vendida']
             if nomes_atributos:
                 atributo_selecionado = st.selectbox(
                     "Analisar vendas por qual atributo?",
@@ -906,14 +2339,48 @@ def main_app():
             else:
                 st.info("Não há atributos disponíveis para análise.")
 
+            # --- Evolução no Tempo ---
+            st.subheader("Evolução no Tempo")
+            # A versão local não vê escritas de outros processos; a reconstrução do resumo diário
+            # (por TTL) sim, então o instante dela entra na chave junto com as versões
+            versao_serie = tuple(get_versoes_cache().versao(empresa_id, tabela) for tabela in ('vendas', 'estoque', 'eventos'))
+            versao_serie += (resumo_diario(empresa_id).reconstruido_em,)
+            serie_diaria = carrega_serie_diaria(empresa_id, versao_serie, COMISSAO_PERCENTUAL, df_resumo, df_estoque, df_eventos)
+            rotulos_serie = {'receita_bruta': 'Receita Bruta (R$)', 'receita_liquida': 'Receita Líquida (R$)', 'lucro': 'Lucro (R$)', 'quantidade_vendida': 'Unidades'}
+            col_grao, col_medida = st.columns(2)
+            grao = col_grao.radio("Agrupar por", list(GRAOS_SERIE), index=2, horizontal=True, key='dashboard_grao')
+            medida = col_medida.selectbox("Medida", list(rotulos_serie), format_func=rotulos_serie.get, key='dashboard_medida_serie')
+            serie = carrega_serie_temporal(empresa_id, versao_serie, grao, serie_diaria)
+            if serie.empty:
+                st.info("As vendas não têm data válida para montar a série.")
+            else:
+                atual = serie.iloc[-1]
+                anterior = serie.iloc[-2] if len(serie) > 1 else None
+                st.caption(f"Último período ({grao.lower()} iniciado em {serie.index[-1]:%d/%m/%Y}) comparado ao anterior.")
+                colunas_comparacao = st.columns(len(rotulos_serie))
+                for coluna_metrica, (coluna, rotulo) in zip(colunas_comparacao, rotulos_serie.items()):
+                    variacao = None
+                    if anterior is not None and anterior[coluna] != 0:
+                        variacao = f"{(atual[coluna] / anterior[coluna] - 1) * 100:+.1f}%"
+                    valor = f"{int(atual[coluna])}" if coluna == 'quantidade_vendida' else f"{atual[coluna]:,.2f}"
+                    coluna_metrica.metric(rotulo, valor, variacao)
+                df_grafico_serie = serie[[medida]].rename(columns={medida: 'Período atual'})
+                df_grafico_serie['Período anterior'] = serie[medida].shift(1)
+                fig_serie = px.line(
+                    df_grafico_serie.reset_index(), x='dia', y=['Período atual', 'Período anterior'],
+                    labels={'dia': grao, 'value': rotulos_serie[medida], 'variable': ''},
+                    title=f"{rotulos_serie[medida]} por {grao.lower()}"
+                )
+                st.plotly_chart(fig_serie, use_container_width=True)
+
 
                 
     # Adicione ou substitua este bloco elif ao seu main_app()
     elif selected_tab == 'Vendas e Eventos':
         st.header('📅 Gestão de Vendas e Eventos')
         # Carrega os dados
-        df_eventos = load_data('eventos', {"filters": {"empresa_id": empresa_id}})
-        df_taxas = load_data('taxas_pagamento', {"filters": {"empresa_id": empresa_id}})
+        df_eventos = contexto_dados.tabela('eventos')
+        df_taxas = contexto_dados.tabela('taxas_pagamento')
 
         with st.expander("Cadastrar Novo Evento", expanded=False):
             with st.form('form_evento', clear_on_submit=True):
@@ -950,9 +2417,22 @@ def main_app():
         st.markdown('---')
 
         st.subheader('🛒 Registrar Nova Venda')
-        df_vendas = load_data('vendas', {"filters": {"empresa_id": empresa_id}})
-        df_estoque = load_data('estoque', {"filters": {"empresa_id": empresa_id}})
-        df_saldo_vendas = calcula_estoque_final(df_estoque, df_vendas)
+        if resultado_venda := st.session_state.pop('resultado_venda', None):
+            st.success(resultado_venda)
+        contagens_diario = diario_vendas.contagens(empresa_id)
+        col_pendentes, col_sincronizadas, col_erro, col_acoes = st.columns(4)
+        col_pendentes.metric("Aguardando envio", contagens_diario['pendentes'])
+        col_sincronizadas.metric("Sincronizadas", contagens_diario['sincronizadas'])
+        col_erro.metric("Com erro", contagens_diario['com_erro'])
+        if col_acoes.button("🔄 Sincronizar agora", disabled=not (contagens_diario['pendentes'] or contagens_diario['com_erro'])):
+            if contagens_diario['com_erro']:
+                diario_vendas.liberar_com_erro(empresa_id)
+            enviadas = sincronizador_vendas.sincronizar()
+            st.session_state['resultado_venda'] = f"{enviadas} venda(s) enviada(s)."
+            st.rerun()
+        if (contagens_diario['pendentes'] or contagens_diario['com_erro']) and (ultimo_erro := diario_vendas.ultimo_erro(empresa_id)):
+            st.caption(f"Último erro de envio: {ultimo_erro}")
+        df_saldo_vendas = saldo_estoque(contexto_dados)
 
         if df_saldo_vendas.empty or df_saldo_vendas['saldo'].sum() <= 0:
             st.warning("Não há produtos com saldo em estoque para vender.")
@@ -1046,21 +2526,86 @@ def main_app():
                             'observacao': observacao_venda
                         }
 
-                        response = add_data('vendas', dados_para_inserir, empresa_id)
-                        if response and response.data:
-                            st.success("Venda registrada com sucesso!")
+                        try:
+                            registra_venda(empresa_id, dados_para_inserir)
+                        except Exception as e:
+                            st.error(f"Falha ao registrar a venda: {e}")
                         else:
-                            st.error("Falha ao registrar a venda. Veja o log no terminal.")
+                            st.session_state['resultado_venda'] = "Venda registrada com sucesso!"
+                            st.rerun()
+
+        with st.expander("📥 Importar vendas de uma exportação (maquininha/marketplace, CSV/XLSX)"):
+            if resultado_importacao := st.session_state.pop('resultado_importacao_vendas', None):
+                st.success(resultado_importacao)
+            # Trocar a key limpa o arquivo (e o mapeamento) depois de importar, para não importar duas vezes
+            rodada_importacao = st.session_state.get('importacoes_vendas', 0)
+            arquivo = st.file_uploader("Exportação de vendas", type=['csv', 'xlsx'], key=f"arquivo_importacao_vendas_{rodada_importacao}")
+            df_arquivo = None
+            if arquivo is not None:
+                try:
+                    df_arquivo = le_planilha(arquivo.name, arquivo.getvalue())
+                except ValueError as e:
+                    st.error(str(e))
+            if df_arquivo is not None:
+                nomes_atributo = list(dict.fromkeys(df_atributo_tipos['nome_atributo'])) if not df_atributo_tipos.empty else []
+                sugestao = sugere_mapeamento_vendas(df_arquivo.columns, nomes_atributo)
+                st.write("**Mapeamento das colunas** (campo da venda ← coluna da exportação)")
+                opcoes_coluna = [None] + list(df_arquivo.columns)
+                mapeamento = {}
+                colunas_mapeamento = st.columns(3)
+                for i, campo in enumerate(list(CAMPOS_VENDAS) + nomes_atributo):
+                    mapeamento[campo] = colunas_mapeamento[i % 3].selectbox(
+                        campo, opcoes_coluna, index=opcoes_coluna.index(sugestao.get(campo)),
+                        format_func=lambda coluna: "— não importar —" if coluna is None else str(coluna),
+                        key=f"mapeamento_vendas_{rodada_importacao}_{campo}"
+                    )
+                try:
+                    df_validas, df_erros, df_excesso = valida_importacao_vendas(
+                        df_arquivo, mapeamento, df_produtos_base, df_atributo_tipos, df_atributo_valores,
+                        df_taxas, df_eventos, saldo_por_chave(contexto_dados), datetime.today().date()
+                    )
+                except ValueError as e:
+                    st.error(str(e))
+                else:
+                    # Simulação: nada foi gravado até aqui
+                    st.write(f"**Simulação:** {len(df_validas)} venda(s) válida(s), {len(df_erros)} linha(s) com erro, "
+                             f"{len(df_excesso)} variante(s) acima do saldo.")
+                    if not df_erros.empty:
+                        st.dataframe(df_erros, hide_index=True, use_container_width=True)
+                    if not df_excesso.empty:
+                        st.warning("Estas variantes ficariam com saldo negativo:")
+                        st.dataframe(df_excesso, hide_index=True, use_container_width=True)
+                    incluir_excesso = st.checkbox("Importar também as vendas das variantes acima do saldo", value=False) if not df_excesso.empty else False
+                    df_importar = df_validas if incluir_excesso else df_validas[~df_validas['acima_do_saldo']]
+                    if not df_importar.empty and st.button(f"Importar {len(df_importar)} venda(s)", type="primary"):
+                        inicio_importacao = time.perf_counter()
+                        try:
+                            inseridas = insere_em_lotes(
+                                'vendas', df_importar.drop(columns=['linha', 'chave_variante', 'acima_do_saldo']).to_dict('records'), empresa_id
+                            )
+                        except Exception as e:
+                            st.error(f"Erro ao importar as vendas: {e}")
+                        else:
+                            duracao = time.perf_counter() - inicio_importacao
+                            st.session_state['resultado_importacao_vendas'] = (
+                                f"{inseridas} venda(s) importada(s) em {duracao:.2f}s ({inseridas / max(duracao, 1e-9):,.0f} linhas/s)."
+                            )
+                            st.session_state['importacoes_vendas'] = rodada_importacao + 1
+                            st.rerun()
 
         st.markdown('---')
         st.subheader('Histórico de Vendas Recentes')
-        if not df_vendas.empty:
-            df_vendas_display = df_vendas.copy()
-            df_vendas_display['atributos'] = df_vendas_display['atributos'].apply(
-                lambda x: ' | '.join(f"{v}" for k, v in json.loads(x).items()) if isinstance(x, str) else "Produto Removido"
-            )
+        # Só as últimas vendas, ordenadas e limitadas no servidor
+        df_historico = contexto_dados.carregar('vendas', {
+            "filters": {"empresa_id": empresa_id},
+            "order": "data_venda.desc,id.desc",
+            "limit": LIMITE_HISTORICO_VENDAS
+        })
+        if not df_historico.empty:
+            df_vendas_display = df_historico.copy()
+            df_vendas_display['atributos'] = formata_atributos(df_vendas_display['atributos'])
             st.dataframe(
-                df_vendas_display.drop(columns=['empresa_id'], errors='ignore').rename(
+                df_vendas_display.drop(columns=['empresa_id', 'chave_idempotencia'], errors='ignore').rename(
                     columns={'id': 'id_venda', 'atributos': 'produto'}
                 ),
                 hide_index=True
@@ -1077,8 +2622,8 @@ def main_app():
         st.header("⚙️ Configurações da Empresa")
 
         # Carrega os dados financeiros necessários para esta aba
-        df_comissao = load_data('comissao', {"filters": {"empresa_id": empresa_id}})
-        df_taxas = load_data('taxas_pagamento', {"filters": {"empresa_id": empresa_id}})
+        df_comissao = contexto_dados.tabela('comissao')
+        df_taxas = contexto_dados.tabela('taxas_pagamento')
         COMISSAO_PERCENTUAL = df_comissao['percentual_comissao'].iloc[0] if not df_comissao.empty else 0.10
 
         # Menu interno para as diferentes seções de configuração
@@ -1108,11 +2653,16 @@ def main_app():
                     taxa = st.number_input("Taxa (%)", min_value=0.0, format="%.2f")
                     if st.form_submit_button("Salvar Taxa"):
                         if fp.strip():
-                            # Lógica de "Upsert": deleta a antiga (se existir) e insere a nova.
-                            supabase.table('taxas_pagamento').delete().match({'forma_pagamento': fp.strip(), 'empresa_id': empresa_id}).execute()
-                            add_data('taxas_pagamento', {'forma_pagamento': fp.strip(), 'taxa_percentual': taxa}, empresa_id)
-                            st.success(f"Taxa para '{fp.strip()}' salva com sucesso.")
-                            st.rerun()
+                            # Upsert nativo: uma chamada, sem janela em que a taxa some
+                            try:
+                                with UnidadeDeTrabalho(empresa_id, latencias_escrita) as unidade:
+                                    unidade.upsert('taxas_pagamento', {'forma_pagamento': fp.strip(), 'taxa_percentual': taxa},
+                                                   on_conflict='empresa_id,forma_pagamento')
+                            except Exception as e:
+                                st.error(f"Erro ao salvar a taxa: {e}")
+                            else:
+                                st.success(f"Taxa para '{fp.strip()}' salva com sucesso.")
+                                st.rerun()
                         else:
                             st.warning("O nome da forma de pagamento não pode ser vazio.")
             
@@ -1120,7 +2670,7 @@ def main_app():
                 if not df_taxas.empty:
                     st.write("**Excluir Taxa Existente**")
                     # Carrega as vendas para verificar o uso das taxas
-                    df_vendas = load_data('vendas', {"filters": {"empresa_id": empresa_id}})
+                    df_vendas = contexto_dados.tabela('vendas', 'uso_taxas')
                     formas_pagamento_usadas = set(df_vendas['forma_pagamento'].dropna().unique()) if not df_vendas.empty and 'forma_pagamento' in df_vendas.columns else set()
                     
                     taxa_para_deletar = st.selectbox("Selecione uma taxa para deletar", options=["---"] + df_taxas['forma_pagamento'].tolist())
@@ -1129,7 +2679,8 @@ def main_app():
                             if taxa_para_deletar in formas_pagamento_usadas:
                                 st.error(f"A taxa '{taxa_para_deletar}' já foi usada em vendas e não pode ser excluída.")
                             else:
-                                supabase.table('taxas_pagamento').delete().match({'forma_pagamento': taxa_para_deletar, 'empresa_id': empresa_id}).execute()
+                                with UnidadeDeTrabalho(empresa_id, latencias_escrita) as unidade:
+                                    unidade.excluir('taxas_pagamento', {'forma_pagamento': taxa_para_deletar, 'empresa_id': empresa_id})
                                 st.success(f"Taxa '{taxa_para_deletar}' deletada.")
                                 st.rerun()
         
@@ -1148,139 +2699,115 @@ def main_app():
             )
             
             if st.button("Salvar Comissão"):
-                comissao_decimal = comissao_nova / 100
-                if not df_comissao.empty:
-                    # Atualiza a comissão existente para esta empresa
-                    id_comissao = df_comissao['id'].iloc[0]
-                    supabase.table('comissao').update({'percentual_comissao': comissao_decimal}).eq('id', int(id_comissao)).execute()
+                # Upsert por empresa: atualiza a existente ou cria (caso o onboarding tenha falhado)
+                try:
+                    with UnidadeDeTrabalho(empresa_id, latencias_escrita) as unidade:
+                        unidade.upsert('comissao', {'percentual_comissao': comissao_nova / 100}, on_conflict='empresa_id')
+                except Exception as e:
+                    st.error(f"Erro ao salvar a comissão: {e}")
                 else:
-                    # Caso o onboarding tenha falhado, cria a comissão pela primeira vez
-                    add_data('comissao', {'percentual_comissao': comissao_decimal}, empresa_id)
-                
-                st.success("Percentual de comissão atualizado com sucesso!")
-                st.rerun()
+                    st.success("Percentual de comissão atualizado com sucesso!")
+                    st.rerun()
                             
     # Adicione este bloco elif ao seu main_app()
     elif selected_tab == 'DRE':
         st.header("🧾 Demonstração de Resultados do Exercício (DRE)")
 
         # Carrega os dados financeiros necessários para esta aba
-        df_comissao = load_data('comissao', {"filters": {"empresa_id": empresa_id}})
-        df_eventos = load_data('eventos', {"filters": {"empresa_id": empresa_id}})
-        df_custos_fixos = load_data('custos_fixos', {"filters": {"empresa_id": empresa_id}})
+        df_comissao = contexto_dados.tabela('comissao')
+        df_eventos = contexto_dados.tabela('eventos')
+        df_custos_fixos = contexto_dados.tabela('custos_fixos')
         COMISSAO_PERCENTUAL = df_comissao['percentual_comissao'].iloc[0] if not df_comissao.empty else 0.10
 
-        if df_vendas.empty:
+        # Limites do período: só a primeira e a última data, sem baixar o histórico inteiro
+        df_primeira = contexto_dados.carregar('vendas', {"select": "data_venda", "filters": {"empresa_id": empresa_id}, "order": "data_venda.asc.nullslast", "limit": 1})
+        df_ultima = contexto_dados.carregar('vendas', {"select": "data_venda", "filters": {"empresa_id": empresa_id}, "order": "data_venda.desc.nullslast", "limit": 1})
+        data_min = pd.to_datetime(df_primeira['data_venda'].iloc[0], errors='coerce') if not df_primeira.empty else pd.NaT
+        data_max = pd.to_datetime(df_ultima['data_venda'].iloc[0], errors='coerce') if not df_ultima.empty else pd.NaT
+
+        if pd.isna(data_min) or pd.isna(data_max):
             st.warning('Não há vendas registradas para gerar uma DRE.')
         else:
-            df_vendas_dre = df_vendas.copy()
-            df_vendas_dre['data_venda'] = pd.to_datetime(df_vendas_dre['data_venda'], errors='coerce')
-            df_vendas_dre.dropna(subset=['data_venda'], inplace=True)
-            
             # --- Filtros de Período e Evento ---
-            data_min = df_vendas_dre['data_venda'].min().date()
-            data_max = df_vendas_dre['data_venda'].max().date()
+            data_min = data_min.date()
+            data_max = data_max.date()
             
-            col1, col2 = st.columns(2)
-            with col1:
-                periodo_inicio = st.date_input("Data de Início", data_min, min_value=data_min, max_value=data_max, key="dre_inicio")
-            with col2:
-                periodo_fim = st.date_input("Data de Fim", data_max, min_value=data_min, max_value=data_max, key="dre_fim")
-
-            if periodo_inicio > periodo_fim:
-                st.error("A data de início não pode ser posterior à data de fim.")
+            visao_dre = st.radio("Visão", ["Período", "DRE mensal"], horizontal=True, key="dre_visao")
+
+            if visao_dre == "DRE mensal":
+                # Matriz linhas x períodos sobre o histórico todo, calculada em pandas a partir do espelho
+                grao_dre = st.radio("Agrupar por", list(GRAOS_DRE), horizontal=True, key="dre_grao")
+                versoes = get_versoes_cache()
+                versao_dre = (versoes.versao(empresa_id, 'vendas'), versoes.versao(empresa_id, 'estoque'))
+                custos_fixos_mensais = float(df_custos_fixos['valor'].sum()) if not df_custos_fixos.empty else 0.0
+                df_vendas_dre = carrega_vendas_dre_ordenadas(empresa_id, versao_dre[0], _contexto=contexto_dados)
+                df_dre_mensal = carrega_dre_mensal(
+                    empresa_id, versao_dre, grao_dre, float(COMISSAO_PERCENTUAL), custos_fixos_mensais,
+                    _df_ordenado=df_vendas_dre, _df_estoque=contexto_dados.tabela('estoque', 'dre')
+                )
+                st.caption(f"Despesas fixas: R$ {custos_fixos_mensais:,.2f} por mês (cadastro de custos fixos), alocadas por mês de cada período.")
+                st.dataframe(
+                    df_dre_mensal.style.format(lambda x: f"R$ {x:,.2f}" if pd.notna(x) else ""),
+                    height=420,
+                    use_container_width=True
+                )
+                st.download_button(
+                    "Exportar DRE (CSV)", exporta_dre_mensal(df_dre_mensal),
+                    file_name=f"dre_{grao_dre.lower()}.csv", mime="text/csv", key="dre_exportar"
+                )
             else:
-                df_filtered = df_vendas_dre[
-                    (df_vendas_dre['data_venda'].dt.date >= periodo_inicio) & 
-                    (df_vendas_dre['data_venda'].dt.date <= periodo_fim)
-                ]
-                
-                if not df_filtered.empty and 'evento' in df_filtered.columns:
-                    eventos_disponiveis = ["Todos"] + df_filtered['evento'].dropna().unique().tolist()
-                    evento_selecionado = st.selectbox("Filtrar por evento (opcional)", options=eventos_disponiveis, key="dre_evento")
-                    if evento_selecionado != "Todos":
-                        df_filtered = df_filtered[df_filtered['evento'] == evento_selecionado]
-
-                if not df_filtered.empty:
-                    df_dre = df_filtered.copy()
-                    
-                    # --- Lógica V3 para Calcular o Custo do Estoque ---
-                    # --- Lógica V3 para Calcular o Custo do Estoque ---
-                    if not df_estoque.empty:
-                        custos_medios = df_estoque.groupby('produto_base_id')['valor_custo'].mean()
-                        df_dre['custo_unitario'] = df_dre['produto_base_id'].map(custos_medios).fillna(0)
-                        df_dre['custo_estoque'] = df_dre['custo_unitario'] * df_dre['quantidade_vendida']
-                    else:
-                        df_dre['custo_estoque'] = 0
-
-                    
-                    # --- Demais Cálculos da DRE ---
-                    df_dre['comissao'] = (df_dre['preco_venda'] * df_dre['quantidade_vendida']) * COMISSAO_PERCENTUAL
-                    df_dre['receita_bruta'] = df_dre['preco_venda'] * df_dre['quantidade_vendida']
-                    df_dre['receita_liquida'] = df_dre['receita_bruta'] - df_dre['desconto'].fillna(0)
-                    df_dre['taxas_pagamento'] = df_dre['taxa_pagamento'].fillna(0)
-
-                    vendas_por_evento_filtrado = df_dre.groupby('evento')['quantidade_vendida'].sum().to_dict()
-                    custo_rateado_dre = []
-                    for _, venda in df_dre.iterrows():
-                        total_vendido_evento = vendas_por_evento_filtrado.get(venda['evento'], 1)
-                        custo_unitario_evento = (venda.get('custo_evento', 0) or 0) / total_vendido_evento if total_vendido_evento > 0 else 0
-                        custo_rateado_dre.append(custo_unitario_evento * venda['quantidade_vendida'])
-                    df_dre['custo_evento_rateado'] = custo_rateado_dre
-                    
-                    # Soma dos custos fixos totais da empresa (não filtrado por período, por padrão)
-                    custos_fixos_total = df_custos_fixos['valor'].sum() if not df_custos_fixos.empty else 0
-                    
-                    # --- Montagem da Tabela Final da DRE ---
-                    st.subheader(f"DRE para o Período e Filtro Selecionado")
-                    receita_bruta_total = df_dre['receita_bruta'].sum()
-                    descontos_total = df_dre['desconto'].sum()
-                    custo_estoque_total = df_dre['custo_estoque'].sum()
-                    custo_evento_total = df_dre['custo_evento_rateado'].sum()
-                    comissao_total = df_dre['comissao'].sum()
-                    taxas_total = df_dre['taxas_pagamento'].sum()
-                    
-                    lucro_bruto = receita_bruta_total - descontos_total - custo_estoque_total
-                    resultado_antes_impostos = lucro_bruto - comissao_total - taxas_total - custo_evento_total - custos_fixos_total
-
-                    dre_data = {
-                        'Descrição': [
-                            '(+) Receita Bruta de Vendas', 
-                            '(-) Descontos Concedidos', 
-                            '(=) Receita Líquida', 
-                            '(-) Custo dos Produtos Vendidos (CPV/CMV)', 
-                            '(=) Lucro Bruto',
-                            '(-) Despesas Variáveis',
-                            '    (-) Comissões', 
-                            '    (-) Taxas de Pagamento', 
-                            '    (-) Custos de Evento (Rateado)',
-                            '(-) Despesas Fixas',
-                            '(=) Lucro Líquido (Resultado do Exercício)'
-                        ],
-                        'Valor (R$)': [
-                            receita_bruta_total, 
-                            -descontos_total, 
-                            receita_bruta_total - descontos_total,
-                            -custo_estoque_total,
-                            lucro_bruto,
-                            '',
-                            -comissao_total,
-                            -taxas_total,
-                            -custo_evento_total,
-                            -custos_fixos_total,
-                            resultado_antes_impostos
-                        ]
-                    }
-                    df_dre_final = pd.DataFrame(dre_data)
-                    # MUDANÇA AQUI: Adicionado o parâmetro height
-                    st.dataframe(
-                        df_dre_final.style.format({'Valor (R$)': lambda x: f"R$ {x:,.2f}" if isinstance(x, (int, float)) else ""}), 
-                        height=420,  # Altura em pixels, ajuste conforme necessário
-                        hide_index=True, 
-                        use_container_width=True
-                    )
+                col1, col2 = st.columns(2)
+                with col1:
+                    periodo_inicio = st.date_input("Data de Início", data_min, min_value=data_min, max_value=data_max, key="dre_inicio")
+                with col2:
+                    periodo_fim = st.date_input("Data de Fim", data_max, min_value=data_min, max_value=data_max, key="dre_fim")
+
+                if periodo_inicio > periodo_fim:
+                    st.error("A data de início não pode ser posterior à data de fim.")
                 else:
-                    st.info("Nenhuma venda encontrada para os filtros selecionados.")
+                    versoes = get_versoes_cache()
+                    versao_dre = (versoes.versao(empresa_id, 'vendas'), versoes.versao(empresa_id, 'estoque'))
+                    df_dre_eventos = dre_por_evento_ou_fallback(empresa_id, periodo_inicio, periodo_fim, COMISSAO_PERCENTUAL, versao_dre, contexto_dados)
+                    df_dre_final = None
+
+                    if df_dre_eventos is not None:
+                        # Caminho principal: uma linha por evento, agregada no Postgres
+                        if not df_dre_eventos.empty:
+                            eventos_disponiveis = ["Todos"] + df_dre_eventos['evento'].dropna().tolist()
+                            evento_selecionado = st.selectbox("Filtrar por evento (opcional)", options=eventos_disponiveis, key="dre_evento")
+                            if evento_selecionado != "Todos":
+                                df_dre_eventos = df_dre_eventos[df_dre_eventos['evento'] == evento_selecionado]
+                            custos_fixos_total = df_custos_fixos['valor'].sum() if not df_custos_fixos.empty else 0
+                            df_dre_final = dre_de_agregados(df_dre_eventos, custos_fixos_total)
+                    else:
+                        # Fallback sem a função no banco: calcula em pandas sobre as vendas do espelho,
+                        # ordenadas por data uma vez por versão; o período é uma fatia por busca binária
+                        df_estoque = contexto_dados.tabela('estoque', 'dre')
+                        df_filtered = pd.DataFrame()
+                        df_vendas_dre = carrega_vendas_dre_ordenadas(empresa_id, versao_dre[0], _contexto=contexto_dados)
+                        if not df_vendas_dre.empty:
+                            df_filtered = fatia_periodo_dre(df_vendas_dre, periodo_inicio, periodo_fim)
+
+                        if not df_filtered.empty:
+                            eventos_disponiveis = ["Todos"] + eventos_dre(df_filtered)
+                            evento_selecionado = st.selectbox("Filtrar por evento (opcional)", options=eventos_disponiveis, key="dre_evento")
+                            if evento_selecionado != "Todos":
+                                df_filtered = filtra_evento_dre(df_filtered, evento_selecionado)
+
+                        if not df_filtered.empty:
+                            df_dre_final = calcula_dre(df_filtered, df_estoque, df_custos_fixos, COMISSAO_PERCENTUAL)
+
+                    if df_dre_final is not None:
+                        st.subheader(f"DRE para o Período e Filtro Selecionado")
+                        # MUDANÇA AQUI: Adicionado o parâmetro height
+                        st.dataframe(
+                            df_dre_final.style.format({'Valor (R$)': lambda x: f"R$ {x:,.2f}" if isinstance(x, (int, float)) else ""}), 
+                            height=420,  # Altura em pixels, ajuste conforme necessário
+                            hide_index=True, 
+                            use_container_width=True
+                        )
+                    else:
+                        st.info("Nenhuma venda encontrada para os filtros selecionados.")
                     
                     
     # Adicione este bloco elif ao seu main_app()
@@ -1289,8 +2816,8 @@ def main_app():
         st.subheader("Simulação Manual para um Evento Futuro")
 
         # Carrega os dados financeiros necessários para esta aba
-        df_taxas = load_data('taxas_pagamento', {"filters": {"empresa_id": empresa_id}})
-        df_comissao = load_data('comissao', {"filters": {"empresa_id": empresa_id}})
+        df_taxas = contexto_dados.tabela('taxas_pagamento')
+        df_comissao = contexto_dados.tabela('comissao')
         COMISSAO_PERCENTUAL = df_comissao['percentual_comissao'].iloc[0] if not df_comissao.empty else 0.10
         
         # --- Custos Fixos do Evento (Input do Usuário) ---
@@ -1307,6 +2834,7 @@ def main_app():
         st.markdown("**Variáveis por Unidade Vendida (R$)**")
         preco_venda_manual = st.number_input("Preço de Venda Unitário", min_value=0.01, value=100.0, step=10.0, key="pe_preco_venda")
         
+        df_estoque = contexto_dados.tabela('estoque', 'custo_medio')
         custo_medio_estoque_real = df_estoque['valor_custo'].mean() if not df_estoque.empty else 30.0
         preco_custo_manual = st.number_input("Custo de Estoque Unitário", min_value=0.01, value=float(custo_medio_estoque_real), step=5.0, key="pe_custo_estoque")
 
@@ -1347,6 +2875,66 @@ def main_app():
             else:
                 st.error("Margem de Contribuição negativa ou zero.")
                 st.warning("Não é possível atingir o ponto de equilíbrio com os valores atuais.")
+
+        # --- Sensibilidade: grade de preço x custo para todos os meios de pagamento ---
+        st.markdown("---")
+        st.subheader("Análise de Sensibilidade")
+        st.caption("Ponto de equilíbrio para cada combinação de preço e custo unitário. Células em branco não atingem o equilíbrio (margem zero ou negativa).")
+        col1, col2 = st.columns(2)
+        with col1:
+            faixa_preco = st.slider("Faixa de Preço de Venda (R$)", 0.01, float(max(preco_venda_manual * 3, 10.0)),
+                                    (float(max(preco_venda_manual * 0.5, 0.01)), float(preco_venda_manual * 1.5)), key="pe_faixa_preco")
+        with col2:
+            faixa_custo = st.slider("Faixa de Custo de Estoque (R$)", 0.01, float(max(preco_custo_manual * 3, 10.0)),
+                                    (float(max(preco_custo_manual * 0.5, 0.01)), float(preco_custo_manual * 1.5)), key="pe_faixa_custo")
+        resolucao = st.select_slider("Resolução da grade", options=[25, 50, 100, 200], value=200, key="pe_resolucao")
+        variar_comissao = st.checkbox("Variar também a comissão", key="pe_variar_comissao")
+        comissoes = np.array([COMISSAO_PERCENTUAL], dtype='float64')
+        if variar_comissao:
+            comissoes = np.round(np.linspace(0.0, 0.30, 7), 2)
+
+        precos_grade = np.linspace(*faixa_preco, resolucao)
+        custos_grade = np.linspace(*faixa_custo, resolucao)
+        nomes_pagamento, taxas_pagamento = cenarios_pagamento(df_taxas)
+        margem_grade, pecas_grade, receita_grade = grade_ponto_equilibrio(
+            precos_grade, custos_grade, taxas_pagamento, comissoes, custo_fixo_total_evento
+        )
+
+        # A grade inteira já está calculada: trocar meio de pagamento/comissão/medida só indexa
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            pagamento_grade = st.selectbox("Meio de Pagamento", nomes_pagamento, key="pe_grade_pagamento")
+        with col2:
+            comissao_grade = st.select_slider("Comissão", options=comissoes.tolist(), format_func=lambda x: f"{x:.0%}",
+                                              key="pe_grade_comissao") if variar_comissao else comissoes[0]
+        with col3:
+            medida_grade = st.radio("Medida", ["Peças", "Receita (R$)"], horizontal=True, key="pe_grade_medida")
+        indice = (int(np.flatnonzero(comissoes == comissao_grade)[0]), nomes_pagamento.index(pagamento_grade))
+        z = np.ceil(pecas_grade[indice]) if medida_grade == "Peças" else receita_grade[indice]
+        z = np.where(np.isfinite(z), z, np.nan)
+
+        sem_equilibrio = float(np.mean(margem_grade[indice] <= 0))
+        if np.isnan(z).all():
+            st.warning("Nenhuma combinação da grade atinge o ponto de equilíbrio.")
+        else:
+            # Perto da margem zero o ponto de equilíbrio explode; a escala vai até o percentil 95
+            limite_cor = float(np.nanquantile(z, 0.95)) or 1.0
+            fig_grade = px.imshow(
+                z, x=precos_grade, y=custos_grade, origin='lower', aspect='auto',
+                color_continuous_scale='RdYlGn_r', range_color=(0, limite_cor),
+                labels={'x': 'Preço de Venda (R$)', 'y': 'Custo de Estoque (R$)', 'color': medida_grade},
+            )
+            fig_grade.add_contour(
+                z=z, x=precos_grade, y=custos_grade, showscale=False, hoverinfo='skip',
+                contours={'coloring': 'lines', 'showlabels': True, 'start': 0, 'end': limite_cor, 'size': limite_cor / 8},
+                line={'color': 'black', 'width': 1},
+            )
+            fig_grade.add_scatter(
+                x=[preco_venda_manual], y=[preco_custo_manual], mode='markers', name='Simulação manual',
+                marker={'symbol': 'x', 'size': 12, 'color': 'black'},
+            )
+            st.plotly_chart(fig_grade, use_container_width=True)
+        st.caption(f"{sem_equilibrio:.0%} das combinações sem ponto de equilíbrio com {pagamento_grade} e comissão de {comissao_grade:.0%}.")
             
             
     # Adicione este outro bloco elif ao seu main_app()
@@ -1354,8 +2942,8 @@ def main_app():
         st.header("💡 DRE Projetada por Evento")
         
         # Carrega os dados financeiros necessários para esta aba
-        df_taxas = load_data('taxas_pagamento', {"filters": {"empresa_id": empresa_id}})
-        df_comissao = load_data('comissao', {"filters": {"empresa_id": empresa_id}})
+        df_taxas = contexto_dados.tabela('taxas_pagamento')
+        df_comissao = contexto_dados.tabela('comissao')
         COMISSAO_PERCENTUAL = df_comissao['percentual_comissao'].iloc[0] if not df_comissao.empty else 0.10
 
         st.markdown("### Receita Estimada")
@@ -1364,6 +2952,7 @@ def main_app():
         receita_bruta = preco_venda_unit_dre * quantidade_vendida_dre
 
         st.markdown("### Custos Variáveis")
+        df_estoque = contexto_dados.tabela('estoque', 'custo_medio')
         custo_medio_estoque_dre = df_estoque['valor_custo'].mean() if not df_estoque.empty else 30.0
         preco_custo_unit_dre = st.number_input("Custo Unitário de Estoque (R$)", min_value=0.0, value=float(custo_medio_estoque_dre), step=5.0, key="preco_custo_unit_dre")
         custo_estoque_total = preco_custo_unit_dre * quantidade_vendida_dre
@@ -1417,68 +3006,16 @@ def main_app():
         st.header('📋 Resumo de Vendas')
 
         # Carrega todos os dados necessários
-        df_vendas = load_data('vendas', {"filters": {"empresa_id": empresa_id}})
-        df_estoque = load_data('estoque', {"filters": {"empresa_id": empresa_id}})
-        df_comissao = load_data('comissao', {"filters": {"empresa_id": empresa_id}})
-        df_eventos = load_data('eventos', {"filters": {"empresa_id": empresa_id}})
+        df_vendas = contexto_dados.tabela('vendas', 'resumo')
+        df_estoque = contexto_dados.tabela('estoque', 'resumo')
+        df_comissao = contexto_dados.tabela('comissao')
+        df_eventos = contexto_dados.tabela('eventos')
         COMISSAO_PERCENTUAL = df_comissao['percentual_comissao'].iloc[0] if not df_comissao.empty else 0.10
 
         if df_vendas.empty:
             st.warning('Não há vendas registradas para gerar um resumo.')
         else:
-            vendas_completa = df_vendas.copy()
-
-            # Preenche campos nulos
-            vendas_completa['forma_pagamento'] = vendas_completa['forma_pagamento'].fillna('não informado')
-            vendas_completa['taxa_pagamento'] = vendas_completa['taxa_pagamento'].fillna(0.0)
-
-            # Calcula receita e comissões
-            vendas_completa['receita_bruta'] = vendas_completa['preco_venda'] * vendas_completa['quantidade_vendida']
-            vendas_completa['comissao'] = vendas_completa['receita_bruta'] * COMISSAO_PERCENTUAL
-            vendas_completa['receita_liquida'] = vendas_completa['receita_bruta'] - vendas_completa['desconto'].fillna(0)
-
-            # Calcula custos médios por produto_base_id (estoque)
-            if not df_estoque.empty:
-                custos_medios = df_estoque.groupby('produto_base_id')['valor_custo'].mean()
-                vendas_completa['custo_unitario'] = vendas_completa['produto_base_id'].map(custos_medios).fillna(0)
-            else:
-                vendas_completa['custo_unitario'] = 0
-
-            vendas_completa['custo_estoque'] = vendas_completa['custo_unitario'] * vendas_completa['quantidade_vendida']
-
-            # Custo por evento rateado
-            vendas_por_evento = vendas_completa.groupby('evento')['quantidade_vendida'].sum().to_dict()
-            custo_rateado = []
-            for _, venda in vendas_completa.iterrows():
-                total_vendido_evento = vendas_por_evento.get(venda['evento'], 1) or 1
-                custo_evento = venda.get('custo_evento', 0) or 0
-                custo_rateado.append((custo_evento / total_vendido_evento) * venda['quantidade_vendida'])
-
-            vendas_completa['custo_evento_rateado'] = custo_rateado
-            vendas_completa['lucro_final'] = (
-                vendas_completa['receita_liquida'] -
-                vendas_completa['custo_estoque'] -
-                vendas_completa['comissao'] -
-                vendas_completa['custo_evento_rateado'] -
-                vendas_completa['taxa_pagamento']
-            )
-
-            # Extrai atributos JSON
-            vendas_completa['atributos'] = vendas_completa['atributos'].apply(
-                lambda x: json.loads(x) if isinstance(x, str) else x
-            )
-            df_atributos_flat = pd.json_normalize(vendas_completa['atributos'])
-
-            vendas_display = pd.concat([vendas_completa.reset_index(drop=True), df_atributos_flat], axis=1)
-
-            nomes_atributos = df_atributos_flat.columns.tolist()
-            colunas_agrupamento = nomes_atributos + ['evento'] if 'evento' in vendas_display.columns else nomes_atributos
-
-            resumo = vendas_display.groupby(colunas_agrupamento).agg(
-                quantidade_vendida=('quantidade_vendida', 'sum'),
-                receita_bruta=('receita_bruta', 'sum'),
-                lucro_final=('lucro_final', 'sum')
-            ).reset_index()
+            resumo, resumo_evento = calcula_resumo_vendas(df_vendas, df_estoque, COMISSAO_PERCENTUAL)
 
             st.subheader('Resumo Agregado por Produto (Atributos) e Evento')
             st.dataframe(
@@ -1487,22 +3024,24 @@ def main_app():
             )
 
             st.subheader('Resumo Consolidado por Evento')
-            resumo_evento = vendas_completa.groupby('evento').agg(
-                quantidade_vendida=('quantidade_vendida', 'sum'),
-                receita_bruta=('receita_bruta', 'sum'),
-                receita_liquida=('receita_liquida', 'sum'),
-                custo_estoque=('custo_estoque', 'sum'),
-                comissao=('comissao', 'sum'),
-                custo_evento_rateado=('custo_evento_rateado', 'sum'),
-                taxa_pagamento=('taxa_pagamento', 'sum'),
-                lucro_final=('lucro_final', 'sum')
-            ).reset_index()
-
             st.dataframe(
                 resumo_evento.style.format(precision=2).background_gradient(subset=['lucro_final'], cmap='Blues'),
                 hide_index=True, use_container_width=True
             )
 
+    # Contadores do rerun inteiro (carga inicial + aba), mostrados junto dos tempos de carga
+    contadores = dict(contexto_dados.contadores)
+    st.session_state['contadores_carga'] = contadores
+    with painel_carga:
+        st.caption(
+            f"Neste rerun: {contadores['pedidos']} leituras pedidas, {contadores['reaproveitadas']} reaproveitadas, "
+            f"{contadores['chamadas_backend']} chamadas ao backend."
+        )
+        if latencias_escrita:
+            del latencias_escrita[:-20]
+            st.write("Escritas recentes (por chamada):")
+            st.dataframe(pd.DataFrame(latencias_escrita).round({'ms': 1}), hide_index=True, use_container_width=True)
+
     
     
     
@@ -0,0 +1,925 @@
+"""Benchmark offline do Bambuar V3.
+
+Gera um tenant sintético (produtos_base, hierarquia de atributos, estoque, vendas,
+eventos, taxas) e cronometra as funções de cálculo do app, além de load_data/add_data
+contra o stand-in local do Supabase (supabase_local.py). Não precisa de rede.
+
+Uso:
+    python bench_bambuar.py                        # tamanhos 1k e 100k
+    python bench_bambuar.py --tamanhos 1k,100k,1m --repeticoes 3
+    python bench_bambuar.py --casos dre,resumo --saida bench.json
+    python bench_bambuar.py --tamanhos 10k --verificar   # confere DRE (RPC x pandas), rateio, livro de saldos e resumo diário
+    DATABASE_URL=postgresql://... python bench_bambuar.py --tamanhos 10k --verificar   # + SQL das migrações num Postgres descartável
+    python bench_bambuar.py --tamanhos 100k --casos rateio_evento_iterrows,rateio_evento_vetorizado,dre,resumo
+    python bench_bambuar.py --tamanhos 10k --casos importacao_estoque_validacao,importacao_estoque,importacao_vendas_validacao
+    python bench_bambuar.py --tamanhos 100k --latencia-ms 20 --casos load_data_vendas,espelho_vendas_carga_completa,espelho_vendas_apos_venda
+"""
+import argparse
+import glob
+import json
+import logging
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# O app precisa enxergar o stand-in antes de ser importado
+os.environ.setdefault("BAMBUAR_BACKEND", "local")
+
+# Silencia os avisos de "bare mode" do Streamlit ao rodar o app fora do `streamlit run`
+logging.disable(logging.WARNING)
+
+import bambuar_prof_v3 as app  # noqa: E402
+from importacao import PRIMEIRA_LINHA_DADOS, sugere_mapeamento_vendas, valida_importacao_estoque, valida_importacao_vendas  # noqa: E402
+
+TAMANHOS = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+
+# (produtos, modelos por produto, cores por modelo, tamanhos por cor) para cada faixa de vendas
+CATALOGOS = {
+    1_000: (2, 3, 4, 3),
+    10_000: (3, 5, 5, 4),
+    100_000: (5, 8, 6, 4),
+    1_000_000: (10, 12, 8, 5),
+}
+
+CORES = ['Azul', 'Azul Claro', 'Verde', 'Verde Musgo', 'Preto', 'Branco', 'Vermelho', 'Rosa',
+         'Amarelo', 'Cinza', 'Marrom', 'Laranja']
+TAMANHOS_ROUPA = ['PP', 'P', 'M', 'G', 'GG', 'XG']
+TAXAS = [('Débito', 1.5), ('Crédito', 3.2), ('Crédito 2x', 4.5), ('Pix', 0.0), ('Dinheiro', 0.0)]
+
+
+def _catalogo_para(n_vendas):
+    faixas = sorted(CATALOGOS)
+    escolhida = next((f for f in faixas if n_vendas <= f), faixas[-1])
+    return CATALOGOS[escolhida]
+
+
+def gerar_tenant_sintetico(n_vendas, seed=42, empresa_id=1):
+    """Gera as tabelas de um tenant com `n_vendas` vendas. Retorna dict nome -> DataFrame."""
+    rng = np.random.default_rng(seed)
+    n_produtos, n_modelos, n_cores, n_tamanhos = _catalogo_para(n_vendas)
+
+    produtos, tipos, valores, variantes = [], [], [], []
+    id_tipo = id_valor = 0
+    for p in range(1, n_produtos + 1):
+        produtos.append({'id': p, 'empresa_id': empresa_id, 'nome_produto': f'Produto {p}'})
+        ids_tipo = {}
+        for nome_atributo in ('Modelo', 'Cor', 'Tamanho'):
+            id_tipo += 1
+            ids_tipo[nome_atributo] = id_tipo
+            tipos.append({'id': id_tipo, 'produto_base_id': p, 'nome_atributo': nome_atributo})
+        for m in range(n_modelos):
+            id_valor += 1
+            id_modelo, modelo = id_valor, f'Modelo {m + 1}'
+            valores.append({'id': id_modelo, 'atributo_tipo_id': ids_tipo['Modelo'], 'valor': modelo, 'parent_valor_id': None})
+            for c in range(n_cores):
+                id_valor += 1
+                id_cor, cor = id_valor, CORES[c % len(CORES)]
+                valores.append({'id': id_cor, 'atributo_tipo_id': ids_tipo['Cor'], 'valor': cor, 'parent_valor_id': id_modelo})
+                for t in range(n_tamanhos):
+                    id_valor += 1
+                    tamanho = TAMANHOS_ROUPA[t % len(TAMANHOS_ROUPA)]
+                    valores.append({'id': id_valor, 'atributo_tipo_id': ids_tipo['Tamanho'], 'valor': tamanho, 'parent_valor_id': id_cor})
+                    variantes.append((p, json.dumps({'Modelo': modelo, 'Cor': cor, 'Tamanho': tamanho})))
+
+    n_variantes = len(variantes)
+    var_produto = np.array([v[0] for v in variantes])
+    var_atributos = np.array([v[1] for v in variantes], dtype=object)
+    var_custo = rng.uniform(10, 60, n_variantes).round(2)
+    var_preco = (var_custo * rng.uniform(1.8, 3.0, n_variantes)).round(2)
+
+    # Popularidade desigual entre variantes, como num catálogo real
+    pesos = 1.0 / np.arange(1, n_variantes + 1) ** 0.8
+    pesos = rng.permutation(pesos / pesos.sum())
+
+    n_eventos = int(min(200, max(3, n_vendas // 2_000)))
+    inicio = np.datetime64('2022-01-01')
+    dias = 3 * 365
+    eventos = pd.DataFrame({
+        'id': np.arange(1, n_eventos + 1),
+        'empresa_id': empresa_id,
+        'nome_evento': [f'Feira {i}' for i in range(1, n_eventos + 1)],
+        'data_evento': (inicio + rng.integers(0, dias, n_eventos)).astype(str),
+        'aluguel': rng.uniform(200, 2000, n_eventos).round(2),
+        'estacionamento': rng.uniform(0, 150, n_eventos).round(2),
+        'alimentacao': rng.uniform(0, 300, n_eventos).round(2),
+        'outros_custos': rng.uniform(0, 200, n_eventos).round(2),
+        'observacao': '',
+    })
+    custo_total_evento = eventos[['aluguel', 'estacionamento', 'alimentacao', 'outros_custos']].sum(axis=1).to_numpy()
+
+    n_estoque = max(n_variantes, n_vendas // 5)
+    idx_estoque = np.concatenate([np.arange(n_variantes), rng.choice(n_variantes, n_estoque - n_variantes, p=pesos)])
+    estoque = pd.DataFrame({
+        'id': np.arange(1, n_estoque + 1),
+        'empresa_id': empresa_id,
+        'produto_base_id': var_produto[idx_estoque],
+        'variante_id': idx_estoque + 1,
+        'atributos': var_atributos[idx_estoque],
+        'quantidade': rng.integers(5, 40, n_estoque),
+        'valor_custo': (var_custo[idx_estoque] * rng.uniform(0.9, 1.1, n_estoque)).round(2),
+        'data_entrada': (inicio + rng.integers(0, dias, n_estoque)).astype(str),
+        'observacao': '',
+    })
+
+    idx_venda = rng.choice(n_variantes, n_vendas, p=pesos)
+    quantidade = rng.integers(1, 4, n_vendas)
+    preco = var_preco[idx_venda]
+    idx_evento = rng.integers(-1, n_eventos, n_vendas)
+    idx_evento[rng.random(n_vendas) < 0.3] = -1
+    evento = np.where(idx_evento >= 0, eventos['nome_evento'].to_numpy()[np.maximum(idx_evento, 0)], None)
+    idx_taxa = rng.integers(0, len(TAXAS), n_vendas)
+    percentual = np.array([t[1] for t in TAXAS])[idx_taxa]
+    desconto = np.where(rng.random(n_vendas) < 0.15, (preco * quantidade * 0.1).round(2), 0.0)
+    vendas = pd.DataFrame({
+        'id': np.arange(1, n_vendas + 1),
+        'empresa_id': empresa_id,
+        'produto_base_id': var_produto[idx_venda],
+        'variante_id': idx_venda + 1,
+        'atributos': var_atributos[idx_venda],
+        'quantidade_vendida': quantidade,
+        'preco_venda': preco,
+        'desconto': desconto,
+        'data_venda': (inicio + np.sort(rng.integers(0, dias, n_vendas))).astype(str),
+        'evento': pd.Series(evento, dtype=object),
+        'custo_evento': np.where(idx_evento >= 0, custo_total_evento[np.maximum(idx_evento, 0)], 0.0),
+        'forma_pagamento': np.array([t[0] for t in TAXAS], dtype=object)[idx_taxa],
+        'taxa_pagamento': (preco * quantidade * percentual / 100).round(2),
+        'percentual_taxa_pagamento': percentual,
+        'observacao': '',
+    })
+
+    return {
+        'empresas': pd.DataFrame([{'id': empresa_id, 'nome_empresa': 'Empresa Sintética'}]),
+        'perfis': pd.DataFrame([{'id': 'usuario-benchmark', 'empresa_id': empresa_id}]),
+        'produtos_base': pd.DataFrame(produtos),
+        'atributo_tipos': pd.DataFrame(tipos),
+        'atributo_valores': pd.DataFrame(valores),
+        'estoque': estoque,
+        'vendas': vendas,
+        'eventos': eventos,
+        'taxas_pagamento': pd.DataFrame([
+            {'id': i, 'empresa_id': empresa_id, 'forma_pagamento': fp, 'taxa_percentual': tx}
+            for i, (fp, tx) in enumerate(TAXAS, start=1)
+        ]),
+        'comissao': pd.DataFrame([{'id': 1, 'empresa_id': empresa_id, 'percentual_comissao': 0.10}]),
+        'custos_fixos': pd.DataFrame([
+            {'id': 1, 'empresa_id': empresa_id, 'descricao': 'Aluguel do ateliê', 'valor': 1500.0},
+            {'id': 2, 'empresa_id': empresa_id, 'descricao': 'Internet', 'valor': 120.0},
+        ]),
+    }
+
+
+def popular_supabase_local(cliente, tenant):
+    """Carrega as tabelas do tenant sintético no stand-in local."""
+    for nome, df in tenant.items():
+        df = df.astype(object).where(df.notna(), None)
+        cliente.carregar_tabela(nome, df.to_dict('records'))
+
+
+def cronometrar(func, preparar=None, repeticoes=3):
+    """Executa func(*preparar()) `repeticoes` vezes. Retorna (tempos, último resultado)."""
+    tempos, resultado = [], None
+    for _ in range(repeticoes):
+        args = preparar() if preparar else ()
+        t0 = time.perf_counter()
+        resultado = func(*args)
+        tempos.append(time.perf_counter() - t0)
+    return tempos, resultado
+
+
+def casos_de_benchmark(tenant):
+    """Lista de (nome, func, preparar) para o tenant informado."""
+    empresa_id = int(tenant['empresas']['id'].iloc[0])
+    comissao = float(tenant['comissao']['percentual_comissao'].iloc[0])
+    vendas, estoque, eventos = tenant['vendas'], tenant['estoque'], tenant['eventos']
+    valores, tipos, produtos = tenant['atributo_valores'], tenant['atributo_tipos'], tenant['produtos_base']
+
+    def dre():
+        df_vendas_dre = vendas.copy()
+        df_vendas_dre['data_venda'] = pd.to_datetime(df_vendas_dre['data_venda'], errors='coerce')
+        df_vendas_dre.dropna(subset=['data_venda'], inplace=True)
+        inicio, fim = df_vendas_dre['data_venda'].min().date(), df_vendas_dre['data_venda'].max().date()
+        df_filtered = app.filtra_periodo_dre(df_vendas_dre, inicio, fim)
+        return app.calcula_dre(df_filtered, estoque, tenant['custos_fixos'], comissao)
+
+    vendas_dre_ordenadas = app.ordena_vendas_dre(vendas)
+    periodo_um_mes = (pd.Timestamp('2023-06-01').date(), pd.Timestamp('2023-06-30').date())
+
+    def dre_fatia_periodo():
+        # Mover as datas na aba DRE (fallback pandas): fatia + DRE do período, sem reconverter datas
+        df_fatia = app.fatia_periodo_dre(vendas_dre_ordenadas, *periodo_um_mes)
+        return app.calcula_dre(df_fatia, estoque, tenant['custos_fixos'], comissao)
+
+    meses_vendas = pd.period_range(vendas_dre_ordenadas.index.min(), vendas_dre_ordenadas.index.max(), freq='M')
+    custos_fixos_mensais = float(tenant['custos_fixos']['valor'].sum())
+
+    def dre_mensal_por_janela():
+        # A matriz mensal montada como antes: uma DRE de período para cada mês
+        return [
+            app.calcula_dre(app.fatia_periodo_dre(vendas_dre_ordenadas, mes.start_time.date(), mes.end_time.date()),
+                            estoque, tenant['custos_fixos'], comissao)
+            for mes in meses_vendas
+        ]
+
+    # Grade 200 x 200 da aba Ponto de Equilíbrio, para todos os meios de pagamento do tenant
+    precos_grade, custos_grade = np.linspace(50, 150, 200), np.linspace(15, 45, 200)
+    _, taxas_grade = app.cenarios_pagamento(tenant['taxas_pagamento'])
+    grade_equilibrio = (precos_grade, custos_grade, taxas_grade, np.array([comissao]), 1500.0)
+    grade_equilibrio_comissao = (precos_grade, custos_grade, taxas_grade, np.linspace(0.0, 0.30, 7), 1500.0)
+
+    def dre_filtro_periodo():
+        # O mesmo recorte pelo caminho antigo: converte as datas e compara .dt.date linha a linha
+        df_vendas_dre = vendas.copy()
+        df_vendas_dre['data_venda'] = pd.to_datetime(df_vendas_dre['data_venda'], errors='coerce')
+        df_filtered = app.filtra_periodo_dre(df_vendas_dre.dropna(subset=['data_venda']), *periodo_um_mes)
+        return app.calcula_dre(df_filtered, estoque, tenant['custos_fixos'], comissao)
+
+    def dre_rpc():
+        app.carrega_dre_por_evento.clear()
+        inicio, fim = vendas['data_venda'].min(), vendas['data_venda'].max()
+        df_eventos = app.carrega_dre_por_evento(empresa_id, inicio, fim, comissao, 0)
+        return app.dre_de_agregados(df_eventos, tenant['custos_fixos']['valor'].sum())
+
+    def load_vendas():
+        app.invalida_tabelas(empresa_id, 'vendas')
+        return app.load_data('vendas', {"filters": {"empresa_id": empresa_id}})
+
+    def carga_inicial():
+        app.invalida_tabelas(empresa_id, 'produtos_base', 'produto_variantes', 'taxas_pagamento', 'atributo_tipos', 'atributo_valores')
+        dados, _ = app.carrega_dados_iniciais(app.ContextoDados(empresa_id))
+        return dados['atributo_valores']
+
+    venda_nova = _linha_para_inserir(vendas.iloc[0])
+
+    def livro_reconstrucao():
+        return app.saldo_estoque(app.ContextoDados(empresa_id), reconstruir=True)
+
+    def livro_apos_venda():
+        # Caminho normal do app: uma venda entra pelo delta e o saldo sai do livro
+        app.add_data('vendas', dict(venda_nova), empresa_id)
+        return app.saldo_estoque(app.ContextoDados(empresa_id))
+
+    def dashboard_vendas():
+        return app.metricas_dashboard_vendas(vendas, estoque, eventos, comissao)
+
+    def dashboard_resumo_apos_venda():
+        # Regime normal: a venda entra pelo delta e as métricas saem do resumo diário
+        app.add_data('vendas', dict(venda_nova), empresa_id)
+        df_resumo = app.resumo_diario_em_dia(app.ContextoDados(empresa_id))
+        return app.metricas_dashboard_resumo(df_resumo, estoque, eventos, comissao)
+
+    def serie_temporal_troca_de_grao():
+        # Trocar o grão: a série diária vem do cache e só o resample roda
+        app.carrega_serie_temporal.clear()
+        df_resumo = app.resumo_diario_em_dia(app.ContextoDados(empresa_id))
+        serie_diaria = app.carrega_serie_diaria(empresa_id, 'bench', comissao, df_resumo, estoque, eventos)
+        return [app.carrega_serie_temporal(empresa_id, 'bench', grao, serie_diaria) for grao in app.GRAOS_SERIE][-1]
+
+    def espelho_carga_completa():
+        app.reconcilia_espelhos(empresa_id, 'vendas')
+        return app.ContextoDados(empresa_id).tabela('vendas', 'resumo_diario')
+
+    def espelho_apos_venda():
+        # Regime normal: uma venda nova e a releitura só busca o delta
+        app.add_data('vendas', dict(venda_nova), empresa_id)
+        return app.ContextoDados(empresa_id).tabela('vendas', 'resumo_diario')
+
+    planilha_estoque = planilha_de_estoque(tenant)
+    hoje = pd.Timestamp.today().date()
+
+    exportacao_vendas = exportacao_de_vendas(tenant)
+    mapeamento_vendas = sugere_mapeamento_vendas(exportacao_vendas.columns, list(dict.fromkeys(tipos['nome_atributo'])))
+
+    def importacao_vendas_validacao():
+        saldos = app.saldo_por_chave(app.ContextoDados(empresa_id))
+        return valida_importacao_vendas(
+            exportacao_vendas, mapeamento_vendas, produtos, tipos, valores, tenant['taxas_pagamento'], eventos, saldos, hoje
+        )
+
+    def importacao_estoque():
+        df_validas, _ = valida_importacao_estoque(planilha_estoque, produtos, tipos, valores, hoje)
+        return range(app.insere_em_lotes('estoque', df_validas.drop(columns='linha').to_dict('records'), empresa_id))
+
+    return [
+        ('calcula_estoque_final', app.calcula_estoque_final, lambda: (estoque.copy(), vendas.copy())),
+        ('calcula_lucro_vendas', lambda: app.calcula_lucro_vendas(vendas, estoque, comissao), None),
+        ('calcula_lucro_vendas_variante', lambda: app.calcula_lucro_vendas(vendas, estoque, comissao, base_custo='variante', df_eventos=eventos), None),
+        ('rateio_evento_iterrows', lambda: rateio_evento_iterrows(vendas), None),
+        ('rateio_evento_vetorizado', lambda: app.rateia_custo_evento(vendas), None),
+        ('gerar_tabela_pivotada', lambda: app.gerar_tabela_pivotada(valores, tipos, produtos), None),
+        ('gerar_visualizacao_hierarquia', lambda: app.gerar_visualizacao_hierarquia(valores, tipos, produtos), None),
+        ('dre', dre, None),
+        ('dre_rpc', dre_rpc, None),
+        ('dre_filtro_periodo', dre_filtro_periodo, None),
+        ('dre_fatia_periodo', dre_fatia_periodo, None),
+        ('dre_ordenacao_vendas', lambda: app.ordena_vendas_dre(vendas), None),
+        ('dre_mensal_por_janela', dre_mensal_por_janela, None),
+        ('ponto_equilibrio_por_celula', lambda: ponto_equilibrio_por_celula(*grade_equilibrio), None),
+        ('ponto_equilibrio_grade', lambda: app.grade_ponto_equilibrio(*grade_equilibrio), None),
+        ('ponto_equilibrio_grade_comissao', lambda: app.grade_ponto_equilibrio(*grade_equilibrio_comissao), None),
+        ('dre_mensal', lambda: app.dre_por_periodo(vendas_dre_ordenadas, estoque, custos_fixos_mensais, comissao, 'Mês'), None),
+        ('resumo', lambda: app.calcula_resumo_vendas(vendas, estoque, comissao), None),
+        ('load_data_vendas', load_vendas, None),
+        ('carga_inicial', carga_inicial, None),
+        ('add_data_vendas', lambda: app.add_data('vendas', dict(venda_nova), empresa_id), None),
+        ('livro_saldos_reconstrucao', livro_reconstrucao, None),
+        ('livro_saldos_apos_venda', livro_apos_venda, None),
+        ('dashboard_vendas', dashboard_vendas, None),
+        ('dashboard_resumo_apos_venda', dashboard_resumo_apos_venda, None),
+        ('serie_diaria', lambda: app.serie_diaria_resumo(app.resumo_diario_em_dia(app.ContextoDados(empresa_id)), estoque, eventos, comissao), None),
+        ('serie_temporal_troca_de_grao', serie_temporal_troca_de_grao, None),
+        ('resumo_diario_reconstrucao', lambda: app.resumo_diario_em_dia(app.ContextoDados(empresa_id), reconstruir=True), None),
+        ('espelho_vendas_carga_completa', espelho_carga_completa, None),
+        ('espelho_vendas_apos_venda', espelho_apos_venda, None),
+        ('importacao_estoque_validacao', lambda: valida_importacao_estoque(planilha_estoque, produtos, tipos, valores, hoje), None),
+        ('importacao_estoque', importacao_estoque, None),
+        ('importacao_vendas_validacao', importacao_vendas_validacao, None),
+    ]
+
+
+def exportacao_de_vendas(tenant, n_linhas=5000):
+    """Exportação de vendas (texto, colunas com nomes de maquininha) com n_linhas vendas sorteadas do tenant."""
+    amostra = tenant['vendas'].sample(n_linhas, replace=True, random_state=0).reset_index(drop=True)
+    nomes = dict(zip(tenant['produtos_base']['id'], tenant['produtos_base']['nome_produto']))
+    return pd.concat([
+        pd.DataFrame({'Item': amostra['produto_base_id'].map(nomes)}),
+        pd.json_normalize(amostra['atributos'].map(json.loads).tolist()),
+        pd.DataFrame({
+            'Qtd': amostra['quantidade_vendida'].astype(str),
+            'Preço unitário': amostra['preco_venda'].map('{:.2f}'.format).str.replace('.', ',', regex=False),
+            'Meio de pagamento': amostra['forma_pagamento'],
+            'Canal': amostra['evento'],
+            'Data': pd.to_datetime(amostra['data_venda']).dt.strftime('%d/%m/%Y'),
+        }),
+    ], axis=1)
+
+
+def planilha_de_estoque(tenant, n_linhas=5000):
+    """Planilha de importação (texto, como lida do CSV) com n_linhas entradas sorteadas do estoque do tenant."""
+    amostra = tenant['estoque'].sample(n_linhas, replace=True, random_state=0).reset_index(drop=True)
+    nomes = dict(zip(tenant['produtos_base']['id'], tenant['produtos_base']['nome_produto']))
+    return pd.concat([
+        pd.DataFrame({'produto': amostra['produto_base_id'].map(nomes)}),
+        pd.json_normalize(amostra['atributos'].map(json.loads).tolist()),
+        pd.DataFrame({'quantidade': amostra['quantidade'].astype(str), 'valor_custo': amostra['valor_custo'].map('{:.2f}'.format)}),
+    ], axis=1)
+
+
+def rateio_evento_iterrows(df_vendas):
+    """Rateio do custo de evento linha a linha, como DRE e Resumo faziam antes do motor de lucro.
+
+    Fica aqui só como referência de tempo e de resultado para rateia_custo_evento.
+    """
+    vendas_por_evento = df_vendas.groupby('evento')['quantidade_vendida'].sum().to_dict()
+    custo_rateado = []
+    for _, venda in df_vendas.iterrows():
+        total_vendido_evento = vendas_por_evento.get(venda['evento'], 1)
+        custo_unitario_evento = (venda.get('custo_evento', 0) or 0) / total_vendido_evento if total_vendido_evento > 0 else 0
+        custo_rateado.append(custo_unitario_evento * venda['quantidade_vendida'])
+    return pd.Series(custo_rateado, index=df_vendas.index)
+
+
+def verificar_rateio_evento(tenant):
+    """Compara o rateio vetorizado com a referência iterrows. Retorna o número de vendas divergentes."""
+    esperado = rateio_evento_iterrows(tenant['vendas'])
+    obtido = app.rateia_custo_evento(tenant['vendas'])
+    return int((~np.isclose(esperado, obtido, rtol=1e-9, atol=1e-9)).sum())
+
+
+def _linha_para_inserir(linha):
+    """Linha do tenant sem id e com tipos nativos do Python, pronta para add_data."""
+    return {k: (v.item() if hasattr(v, 'item') else v) for k, v in linha.drop(labels=['id']).to_dict().items()}
+
+
+def verificar_livro_saldos(tenant, n_escritas=20):
+    """Aplica vendas e entradas pelo add_data e compara o livro com calcula_estoque_final.
+
+    Retorna o número de variantes divergentes (0 quando confere).
+    """
+    empresa_id = int(tenant['empresas']['id'].iloc[0])
+    app.saldo_estoque(app.ContextoDados(empresa_id), reconstruir=True)
+    for i in range(n_escritas):
+        app.add_data('vendas', _linha_para_inserir(tenant['vendas'].iloc[i * 7 % len(tenant['vendas'])]), empresa_id)
+        app.add_data('estoque', _linha_para_inserir(tenant['estoque'].iloc[i * 5 % len(tenant['estoque'])]), empresa_id)
+    livro = app.saldo_estoque(app.ContextoDados(empresa_id))
+    esperado = app.calcula_estoque_final(pd.DataFrame(app.supabase.linhas('estoque')), pd.DataFrame(app.supabase.linhas('vendas')))
+    return app.conta_divergencias_saldo(livro, esperado)
+
+
+def verificar_resumo_diario(tenant, n_escritas=20):
+    """Compara as métricas e o gráfico por atributo do Dashboard (resumo diário) com o cálculo
+    sobre as vendas linha a linha, depois da reconstrução e depois de vendas pelo delta.
+
+    Retorna a lista de divergências (vazia quando tudo confere).
+    """
+    empresa_id = int(tenant['empresas']['id'].iloc[0])
+    comissao = float(tenant['comissao']['percentual_comissao'].iloc[0])
+    estoque, eventos = tenant['estoque'], tenant['eventos']
+    app.resumo_diario_em_dia(app.ContextoDados(empresa_id), reconstruir=True)
+    # A chave de cache da série abaixo não muda entre tenants; limpa para não reaproveitar o anterior
+    app.carrega_serie_temporal.clear()
+    divergencias = []
+    for etapa in ('reconstrucao', 'delta'):
+        if etapa == 'delta':
+            for i in range(n_escritas):
+                app.add_data('vendas', _linha_para_inserir(tenant['vendas'].iloc[i * 11 % len(tenant['vendas'])]), empresa_id)
+            linhas = [_linha_para_inserir(tenant['vendas'].iloc[i]) for i in range(300)]
+            app.insere_em_lotes('vendas', linhas, empresa_id, tamanho_lote=128)
+        if not app.resumo_diario(empresa_id).versao:
+            divergencias.append((etapa, 'resumo diário desatualizado depois do delta'))
+        df_resumo = app.resumo_diario_em_dia(app.ContextoDados(empresa_id))
+        vendas = pd.DataFrame(app.supabase.linhas('vendas'))
+        esperado = app.metricas_dashboard_vendas(vendas, estoque, eventos, comissao)
+        obtido = app.metricas_dashboard_resumo(df_resumo, estoque, eventos, comissao)
+        for nome, valor in esperado.items():
+            if not np.isclose(valor, obtido[nome], rtol=1e-9, atol=1e-6):
+                divergencias.append((etapa, nome, valor, obtido[nome]))
+        # A série temporal soma, em qualquer grão, o mesmo que as métricas gerais
+        serie_diaria = app.serie_diaria_resumo(df_resumo, estoque, eventos, comissao)
+        for grao in app.GRAOS_SERIE:
+            totais = app.carrega_serie_temporal(empresa_id, ('verificacao', etapa), grao, serie_diaria).sum()
+            for nome in ('receita_bruta', 'receita_liquida', 'lucro'):
+                if not np.isclose(totais[nome], esperado[nome], rtol=1e-9, atol=1e-6):
+                    divergencias.append((etapa, f'série por {grao}', nome, esperado[nome], totais[nome]))
+        df_atributos = app.expande_atributos(vendas['atributos'])
+        df_grafico = app.vendas_por_atributo(df_resumo)
+        for atributo in df_atributos.columns:
+            quantidade_esperada = vendas['quantidade_vendida'].groupby(df_atributos[atributo]).sum()
+            quantidade_obtida = df_grafico.groupby(atributo)['quantidade_vendida'].sum()
+            if not quantidade_esperada.sort_index().equals(quantidade_obtida.sort_index().astype(quantidade_esperada.dtype)):
+                divergencias.append((etapa, f'vendas por {atributo}'))
+    return divergencias
+
+
+def verificar_importacao_estoque(tenant):
+    """Importa uma planilha em lotes e compara o livro (delta único) com calcula_estoque_final.
+
+    Retorna o número de variantes divergentes (0 quando confere).
+    """
+    empresa_id = int(tenant['empresas']['id'].iloc[0])
+    app.saldo_estoque(app.ContextoDados(empresa_id), reconstruir=True)
+    df_validas, df_erros = valida_importacao_estoque(
+        planilha_de_estoque(tenant, 1200), tenant['produtos_base'], tenant['atributo_tipos'], tenant['atributo_valores'],
+        pd.Timestamp.today().date()
+    )
+    if not df_erros.empty:
+        return len(df_erros)
+    app.insere_em_lotes('estoque', df_validas.drop(columns='linha').to_dict('records'), empresa_id)
+    livro = app.saldo_estoque(app.ContextoDados(empresa_id))
+    esperado = app.calcula_estoque_final(pd.DataFrame(app.supabase.linhas('estoque')), pd.DataFrame(app.supabase.linhas('vendas')))
+    return app.conta_divergencias_saldo(livro, esperado)
+
+
+def datas_de_planilha(n_linhas):
+    """(texto, esperado 'aaaa-mm-dd') de n_linhas datas seguidas, alternando ISO, ISO com hora
+    (célula de data do XLSX lida como str) e dd/mm/aaaa; metade delas tem dia <= 12."""
+    datas = pd.Series(pd.date_range('2023-01-01', periods=n_linhas, freq='D'))
+    formatos = np.array(['%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%d/%m/%Y'])[np.arange(n_linhas) % 3]
+    texto = pd.Series([data.strftime(formato) for data, formato in zip(datas, formatos)])
+    return texto, datas.dt.strftime('%Y-%m-%d')
+
+
+def verificar_datas_importacao(tenant):
+    """Importa data_entrada (estoque) e data_venda (exportação de vendas) nos três formatos de
+    datas_de_planilha e confere a data gravada.
+
+    Retorna o número de linhas com data trocada ou recusada (0 quando confere).
+    """
+    empresa_id = int(tenant['empresas']['id'].iloc[0])
+    hoje = pd.Timestamp.today().date()
+    planilha = planilha_de_estoque(tenant, 600)
+    planilha['data_entrada'], esperado_estoque = datas_de_planilha(len(planilha))
+    validas_estoque, erros_estoque = valida_importacao_estoque(
+        planilha, tenant['produtos_base'], tenant['atributo_tipos'], tenant['atributo_valores'], hoje
+    )
+    exportacao = exportacao_de_vendas(tenant, 600)
+    exportacao['Data'], esperado_vendas = datas_de_planilha(len(exportacao))
+    mapeamento = sugere_mapeamento_vendas(exportacao.columns, list(dict.fromkeys(tenant['atributo_tipos']['nome_atributo'])))
+    validas_vendas, erros_vendas, _ = valida_importacao_vendas(
+        exportacao, mapeamento, tenant['produtos_base'], tenant['atributo_tipos'], tenant['atributo_valores'],
+        tenant['taxas_pagamento'], tenant['eventos'], app.saldo_por_chave(app.ContextoDados(empresa_id)), hoje
+    )
+    divergentes = len(erros_estoque) + len(erros_vendas)
+    for df_validas, coluna, esperado in ((validas_estoque, 'data_entrada', esperado_estoque), (validas_vendas, 'data_venda', esperado_vendas)):
+        esperado.index = esperado.index + PRIMEIRA_LINHA_DADOS
+        divergentes += int((df_validas[coluna].to_numpy() != esperado[df_validas['linha']].to_numpy()).sum())
+    return divergentes
+
+
+def verificar_diario(tenant, n_vendas=25):
+    """Vendas registradas sem conexão, uma resposta perdida e a volta da conexão.
+
+    Registra as vendas com o stand-in offline, confere que a sincronização não envia nada,
+    perde a resposta do primeiro lote ao voltar e sincroniza até o fim. Retorna a lista de
+    divergências: chaves duplicadas no banco, vendas pendentes, campos numéricos que voltaram
+    como texto e saldo do livro diferente de calcula_estoque_final.
+    """
+    empresa_id = int(tenant['empresas']['id'].iloc[0])
+    cliente = app.supabase
+    diario, sincronizador = app.get_diario_vendas(), app.get_sincronizador_vendas()
+    sincronizador.tamanho_lote = 10
+    app.saldo_estoque(app.ContextoDados(empresa_id), reconstruir=True)
+
+    divergencias = []
+    cliente.online = False
+    try:
+        # Números como escalares do numpy, como saem de um DataFrame no formulário (np.int64 não é int)
+        chaves = []
+        for i in range(n_vendas):
+            venda = tenant['vendas'].iloc[i * 11 % len(tenant['vendas'])].drop(labels=['id', 'empresa_id']).to_dict()
+            venda = {campo: (np.asarray(valor)[()] if isinstance(valor, (int, float)) else valor) for campo, valor in venda.items()}
+            venda['custo_evento'] = np.int64(round(venda['custo_evento']))
+            chaves.append(app.registra_venda(empresa_id, venda))
+        if sincronizador.sincronizar() != 0:
+            divergencias.append(('enviadas sem conexão',))
+    finally:
+        cliente.online = True
+    cliente.respostas_perdidas = 1
+    sincronizador.sincronizar()  # grava o primeiro lote, perde a resposta e para
+    sincronizador.sincronizar()  # reenvia o lote (duplicatas ignoradas) e o resto
+    sincronizador.tamanho_lote = 200
+
+    contagens = diario.contagens(empresa_id)
+    if contagens['pendentes'] or contagens['com_erro']:
+        divergencias.append(('pendentes', contagens))
+    gravadas = pd.DataFrame(cliente.linhas('vendas'))
+    gravadas = gravadas[gravadas['chave_idempotencia'].isin(chaves)]
+    if len(gravadas) != n_vendas or gravadas['chave_idempotencia'].duplicated().any():
+        divergencias.append(('vendas gravadas', len(gravadas), n_vendas))
+    for coluna in ('produto_base_id', 'quantidade_vendida', 'preco_venda', 'custo_evento', 'percentual_taxa_pagamento'):
+        if gravadas[coluna].map(lambda valor: isinstance(valor, str)).any():
+            divergencias.append(('texto em vez de número', coluna))
+    livro = app.saldo_estoque(app.ContextoDados(empresa_id))
+    esperado = app.calcula_estoque_final(pd.DataFrame(cliente.linhas('estoque')), pd.DataFrame(cliente.linhas('vendas')))
+    if app.conta_divergencias_saldo(livro, esperado):
+        divergencias.append(('saldo', app.conta_divergencias_saldo(livro, esperado)))
+    return divergencias
+
+
+COLUNAS_DRE_POSTGRES = {
+    'vendas': ('id bigint primary key, empresa_id bigint, produto_base_id bigint, quantidade_vendida integer, '
+               'preco_venda numeric, desconto numeric, taxa_pagamento numeric, custo_evento numeric, evento text, '
+               'data_venda timestamptz'),
+    'estoque': 'id bigint primary key, empresa_id bigint, produto_base_id bigint, valor_custo numeric',
+}
+
+
+def verificar_dre_postgres(tenant, url):
+    """Roda as migrações de dre_por_evento num Postgres de verdade e compara com calcula_dre.
+
+    Tudo numa transação desfeita no fim: as tabelas (só as colunas que a função lê) ficam
+    num schema temporário e o texto das migrações só troca `public.` por ele. A sessão usa
+    o fuso de São Paulo e uma venda com preco_venda nulo entra junto. Confere também que
+    um período de um mês usa o índice (empresa_id, data_venda).
+    Retorna a lista de divergências (vazia quando tudo confere).
+    """
+    import psycopg2  # só para esta verificação
+    from psycopg2.extras import execute_values
+
+    empresa_id = int(tenant['empresas']['id'].iloc[0])
+    comissao = float(tenant['comissao']['percentual_comissao'].iloc[0])
+    vendas = pd.concat([tenant['vendas'], tenant['vendas'].tail(1).assign(id=len(tenant['vendas']) + 1, preco_venda=np.nan)], ignore_index=True)
+    migracoes = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'supabase', 'migrations', '*dre_por_evento*.sql')))
+    schema = 'verificacao_dre'
+
+    conexao = psycopg2.connect(url)
+    divergencias = []
+    try:
+        with conexao.cursor() as cursor:
+            cursor.execute("set local time zone 'America/Sao_Paulo'")
+            cursor.execute("do $$ begin if not exists (select from pg_roles where rolname = 'authenticated') "
+                           "then create role authenticated; end if; end $$")
+            cursor.execute(f"create schema {schema}")
+            for tabela, colunas in COLUNAS_DRE_POSTGRES.items():
+                cursor.execute(f"create table {schema}.{tabela} ({colunas})")
+                nomes = [coluna.split()[0] for coluna in colunas.split(', ')]
+                df = vendas if tabela == 'vendas' else tenant['estoque']
+                linhas = df[nomes].astype(object).where(df[nomes].notna(), None).itertuples(index=False, name=None)
+                execute_values(cursor, f"insert into {schema}.{tabela} ({', '.join(nomes)}) values %s", list(linhas))
+            for migracao in migracoes:
+                with open(migracao, encoding='utf-8') as f:
+                    cursor.execute(f.read().replace('public.', f'{schema}.'))
+            cursor.execute(f"analyze {schema}.vendas")
+
+            vendas['data_venda'] = pd.to_datetime(vendas['data_venda'])
+            inicio, fim = vendas['data_venda'].min().date(), vendas['data_venda'].max().date()
+            um_mes = (pd.Timestamp('2023-06-01').date(), pd.Timestamp('2023-06-30').date())
+            for periodo_inicio, periodo_fim in [(inicio, fim), (pd.Timestamp('2023-01-01').date(), pd.Timestamp('2023-12-31').date()), um_mes]:
+                cursor.execute(f"select * from {schema}.dre_por_evento(%s, %s, %s, %s)", (empresa_id, periodo_inicio, periodo_fim, comissao))
+                df_eventos = pd.DataFrame(cursor.fetchall(), columns=app.COLUNAS_DRE_POR_EVENTO)
+                df_periodo = app.filtra_periodo_dre(vendas, periodo_inicio, periodo_fim)
+                for evento in ['Todos'] + df_periodo['evento'].dropna().unique().tolist()[:3]:
+                    df_filtrado = df_periodo if evento == 'Todos' else df_periodo[df_periodo['evento'] == evento]
+                    df_sql = df_eventos if evento == 'Todos' else df_eventos[df_eventos['evento'] == evento]
+                    esperado = app.calcula_dre(df_filtrado, tenant['estoque'], tenant['custos_fixos'], comissao)
+                    obtido = app.dre_de_agregados(df_sql, tenant['custos_fixos']['valor'].sum())
+                    for (descricao, valor_esperado), valor_obtido in zip(esperado.itertuples(index=False), obtido['Valor (R$)']):
+                        if valor_esperado == '' and valor_obtido == '':
+                            continue
+                        if not np.isclose(float(valor_esperado), float(valor_obtido), rtol=1e-9, atol=1e-6):
+                            divergencias.append(('postgres', periodo_inicio, periodo_fim, evento, descricao, valor_esperado, valor_obtido))
+
+            cursor.execute(f"explain select * from {schema}.dre_por_evento(%s, %s, %s, %s)", (empresa_id, *um_mes, comissao))
+            plano = '\n'.join(linha for linha, in cursor.fetchall())
+            if 'vendas_empresa_data_venda' not in plano:
+                divergencias.append(('postgres', 'plano de um mês sem o índice (empresa_id, data_venda)', plano))
+    finally:
+        conexao.rollback()
+        conexao.close()
+    return divergencias
+
+
+def verificar_paginacao(tenant):
+    """busca_paginada com estimativa do planner baixa, exata e alta, e com max-rows do servidor
+    menor que a página: tem de trazer todas as linhas, uma vez cada, sem nenhum count exato.
+    Também confere que as buscas com limit 1 (limites de data da DRE) são uma chamada só.
+    Retorna a lista de divergências (vazia quando tudo confere).
+    """
+    empresa_id = int(tenant['empresas']['id'].iloc[0])
+    cliente = app.supabase
+    max_rows, contagens_antes = cliente.max_rows, cliente.contagens_exatas
+    esperado = sorted(tenant['vendas']['id'].tolist())
+    divergencias = []
+    try:
+        for cliente.max_rows in (max_rows, 300):
+            for cliente.erro_estimativa in (-0.6, 0.0, 0.6):
+                df = app.busca_paginada('vendas', {"select": "id", "filters": {"empresa_id": empresa_id}})
+                if sorted(df['id'].tolist()) != esperado:
+                    divergencias.append(('linhas', cliente.max_rows, cliente.erro_estimativa, len(df), len(esperado)))
+            for limite in (1, 2500):
+                chamadas = cliente.chamadas
+                df = app.busca_paginada('vendas', {"select": "id", "filters": {"empresa_id": empresa_id}, "order": "id.asc", "limit": limite})
+                if df['id'].tolist() != esperado[:limite]:
+                    divergencias.append(('limit', cliente.max_rows, limite, len(df)))
+                if limite == 1 and cliente.chamadas - chamadas != 1:
+                    divergencias.append(('chamadas com limit 1', cliente.chamadas - chamadas))
+    finally:
+        cliente.max_rows, cliente.erro_estimativa = max_rows, 0.0
+    if cliente.contagens_exatas != contagens_antes:
+        divergencias.append(('count exato', cliente.contagens_exatas - contagens_antes))
+    return divergencias
+
+
+def verificar_espelho(tenant, n_vendas=5):
+    """Deltas do espelho de vendas sem count exato dentro da janela de reconciliação; uma
+    exclusão feita por fora aparece no count do meio da janela.
+    Retorna a lista de divergências (vazia quando tudo confere).
+    """
+    empresa_id = int(tenant['empresas']['id'].iloc[0])
+    cliente = app.supabase
+    espelho = app.espelho_tabela(empresa_id, 'vendas')
+    ler = lambda: app.ContextoDados(empresa_id).tabela('vendas', 'resumo_diario')
+    app.reconcilia_espelhos(empresa_id, 'vendas')
+    ler()
+    divergencias = []
+    contagens_antes = cliente.contagens_exatas
+    for i in range(n_vendas):
+        app.add_data('vendas', _linha_para_inserir(tenant['vendas'].iloc[i]), empresa_id)
+        espelho.conferido_em -= app.ESPELHO_TTL + 1
+        ler()
+    if cliente.contagens_exatas != contagens_antes:
+        divergencias.append(('count exato nos deltas', cliente.contagens_exatas - contagens_antes))
+    removida = cliente.linhas('vendas')[0]['id']
+    cliente.carregar_tabela('vendas', [r for r in cliente.linhas('vendas') if r['id'] != removida])
+    espelho.conferido_em -= app.ESPELHO_TTL + 1
+    espelho.contado_em -= app.ESPELHO_RECONCILIACAO / 2 + 1
+    if len(ler()) != len(cliente.linhas('vendas')):
+        divergencias.append(('exclusão externa', len(ler()), len(cliente.linhas('vendas'))))
+    return divergencias
+
+
+def verificar_paridade_dre(tenant):
+    """Compara a DRE da RPC dre_por_evento e a da fatia por índice ordenado com o cálculo em
+    pandas linha a linha (filtra_periodo_dre + calcula_dre).
+
+    Usa o período inteiro e um recorte de um ano, com e sem filtro de evento.
+    Retorna a lista de divergências (vazia quando tudo confere).
+    """
+    empresa_id = int(tenant['empresas']['id'].iloc[0])
+    comissao = float(tenant['comissao']['percentual_comissao'].iloc[0])
+    vendas = tenant['vendas'].copy()
+    vendas['data_venda'] = pd.to_datetime(vendas['data_venda'])
+    custos_fixos_total = tenant['custos_fixos']['valor'].sum()
+    inicio, fim = vendas['data_venda'].min().date(), vendas['data_venda'].max().date()
+    periodos = [(inicio, fim), (pd.Timestamp('2023-01-01').date(), pd.Timestamp('2023-12-31').date())]
+
+    # A chave de cache abaixo não muda entre tenants; limpa para não reaproveitar o anterior
+    app.carrega_dre_por_evento.clear()
+    vendas_ordenadas = app.ordena_vendas_dre(tenant['vendas'])
+    divergencias = []
+    for periodo_inicio, periodo_fim in periodos:
+        df_periodo = app.filtra_periodo_dre(vendas, periodo_inicio, periodo_fim)
+        df_fatia = app.fatia_periodo_dre(vendas_ordenadas, periodo_inicio, periodo_fim)
+        df_eventos = app.carrega_dre_por_evento(empresa_id, periodo_inicio, periodo_fim, comissao, ('verificacao', periodo_inicio))
+        for evento in ['Todos'] + df_periodo['evento'].dropna().unique().tolist()[:5]:
+            if evento == 'Todos':
+                df_filtrado, df_rpc, df_fatiado = df_periodo, df_eventos, df_fatia
+            else:
+                df_filtrado = df_periodo[df_periodo['evento'] == evento]
+                df_rpc = df_eventos[df_eventos['evento'] == evento]
+                df_fatiado = app.filtra_evento_dre(df_fatia, evento)
+            esperado = app.calcula_dre(df_filtrado, tenant['estoque'], tenant['custos_fixos'], comissao)
+            # RPC e fatia por índice ordenado (fallback da aba DRE) contra o filtro linha a linha
+            for origem, obtido in (
+                ('rpc', app.dre_de_agregados(df_rpc, custos_fixos_total)),
+                ('fatia', app.calcula_dre(df_fatiado, tenant['estoque'], tenant['custos_fixos'], comissao)),
+            ):
+                for (descricao, valor_esperado), valor_obtido in zip(esperado.itertuples(index=False), obtido['Valor (R$)']):
+                    if valor_esperado == '' and valor_obtido == '':
+                        continue
+                    if not np.isclose(float(valor_esperado), float(valor_obtido), rtol=1e-9, atol=1e-6):
+                        divergencias.append((origem, periodo_inicio, periodo_fim, evento, descricao, valor_esperado, valor_obtido))
+    return divergencias
+
+
+def verificar_dre_mensal(tenant):
+    """Compara cada coluna da DRE mensal (dre_por_periodo) com calcula_dre sobre as vendas do
+    período filtradas linha a linha, com os custos fixos mensais vezes os meses do período.
+
+    Retorna a lista de divergências (vazia quando tudo confere).
+    """
+    comissao = float(tenant['comissao']['percentual_comissao'].iloc[0])
+    vendas = tenant['vendas'].copy()
+    vendas['data_venda'] = pd.to_datetime(vendas['data_venda'])
+    custos_fixos_mensais = float(tenant['custos_fixos']['valor'].sum())
+    vendas_ordenadas = app.ordena_vendas_dre(tenant['vendas'])
+    divergencias = []
+    for grao, (freq, meses) in app.GRAOS_DRE.items():
+        matriz = app.dre_por_periodo(vendas_ordenadas, tenant['estoque'], custos_fixos_mensais, comissao, grao)
+        periodos = [p for p in matriz.columns if p != 'Total']
+        for rotulo in periodos[:4] + periodos[-2:]:
+            periodo = pd.Period(rotulo, freq=freq)
+            df_periodo = app.filtra_periodo_dre(vendas, periodo.start_time.date(), periodo.end_time.date())
+            custos_fixos = pd.DataFrame({'valor': [custos_fixos_mensais * meses]})
+            esperado = app.calcula_dre(df_periodo, tenant['estoque'], custos_fixos, comissao)
+            for (descricao, valor_esperado), valor_obtido in zip(esperado.itertuples(index=False), matriz[rotulo]):
+                if valor_esperado == '' and pd.isna(valor_obtido):
+                    continue
+                if not np.isclose(float(valor_esperado), float(valor_obtido), rtol=1e-9, atol=1e-6):
+                    divergencias.append((grao, rotulo, descricao, valor_esperado, valor_obtido))
+        # O total de cada linha é a soma dos períodos, e todo período do intervalo aparece
+        if not np.allclose(matriz['Total'].fillna(0), matriz[periodos].sum(axis=1)):
+            divergencias.append((grao, 'Total', 'soma dos períodos'))
+        if len(periodos) != len(pd.period_range(periodos[0], periodos[-1], freq=freq)):
+            divergencias.append((grao, 'períodos', len(periodos)))
+    return divergencias
+
+
+def ponto_equilibrio_por_celula(precos, custos, taxas_percentuais, comissoes, custo_fixo):
+    """Referência: a conta escalar da simulação manual, uma célula da grade por vez."""
+    pecas = np.empty((len(comissoes), len(taxas_percentuais), len(custos), len(precos)))
+    for i, comissao in enumerate(comissoes):
+        for j, taxa in enumerate(taxas_percentuais):
+            for k, custo in enumerate(custos):
+                for m, preco in enumerate(precos):
+                    margem = preco - custo - preco * comissao - preco * (taxa / 100)
+                    pecas[i, j, k, m] = custo_fixo / margem if margem > 0 else np.inf
+    return pecas
+
+
+def verificar_ponto_equilibrio(tenant):
+    """Compara grade_ponto_equilibrio com a conta célula a célula numa grade pequena que
+    inclui margens negativas e zero. Retorna o número de células divergentes."""
+    _, taxas = app.cenarios_pagamento(tenant['taxas_pagamento'])
+    precos, custos, comissoes = np.linspace(10, 200, 39), np.linspace(10, 200, 39), np.array([0.0, 0.1, 0.25])
+    _, pecas, receita = app.grade_ponto_equilibrio(precos, custos, taxas, comissoes, 1500.0)
+    esperado = ponto_equilibrio_por_celula(precos, custos, taxas, comissoes, 1500.0)
+    divergentes = ~np.isclose(pecas, esperado, rtol=1e-12) | ~np.isclose(receita, esperado * precos, rtol=1e-12)
+    return int(divergentes.sum())
+
+
+def executar(tamanhos, casos=None, repeticoes=3, seed=42, max_rows=1000, latencia_ms=0.0, verificar=False):
+    cliente = app.supabase
+    cliente.max_rows = max_rows
+    cliente.latencia = latencia_ms / 1000
+    resultados = []
+    for rotulo in tamanhos:
+        n = TAMANHOS[rotulo]
+        t0 = time.perf_counter()
+        tenant = gerar_tenant_sintetico(n, seed=seed)
+        popular_supabase_local(cliente, tenant)
+        # Os dados mudaram por fora do app: descarta caches, espelhos e livros da empresa
+        app.invalida_tabelas(int(tenant['empresas']['id'].iloc[0]), *tenant)
+        app.reconcilia_espelhos(int(tenant['empresas']['id'].iloc[0]), *tenant)
+        print(f"# tenant {rotulo}: {n} vendas, {len(tenant['estoque'])} entradas de estoque, "
+              f"{len(tenant['atributo_valores'])} valores de atributo (gerado em {time.perf_counter() - t0:.1f}s)",
+              file=sys.stderr)
+        if verificar:
+            divergencias_paginacao = verificar_paginacao(tenant)
+            for divergencia in divergencias_paginacao:
+                print("DIVERGÊNCIA PAGINAÇÃO:", divergencia, file=sys.stderr)
+            if divergencias_paginacao:
+                raise SystemExit(1)
+            print(f"# paginação sem count exato (estimativa baixa/alta, max-rows menor): ok ({rotulo})", file=sys.stderr)
+            divergencias = verificar_paridade_dre(tenant)
+            for divergencia in divergencias:
+                print("DIVERGÊNCIA DRE:", divergencia, file=sys.stderr)
+            if divergencias:
+                raise SystemExit(1)
+            print(f"# DRE RPC (cópia em Python do stand-in) e fatia ordenada x pandas: ok ({rotulo})", file=sys.stderr)
+            if os.environ.get('DATABASE_URL'):
+                divergencias_postgres = verificar_dre_postgres(tenant, os.environ['DATABASE_URL'])
+                for divergencia in divergencias_postgres:
+                    print("DIVERGÊNCIA DRE NO POSTGRES:", divergencia, file=sys.stderr)
+                if divergencias_postgres:
+                    raise SystemExit(1)
+                print(f"# DRE das migrações no Postgres x pandas: ok ({rotulo})", file=sys.stderr)
+            else:
+                print("# DRE das migrações no Postgres: NÃO verificada (defina DATABASE_URL para rodar o SQL de verdade)", file=sys.stderr)
+            divergencias_mensal = verificar_dre_mensal(tenant)
+            for divergencia in divergencias_mensal:
+                print("DIVERGÊNCIA DRE MENSAL:", divergencia, file=sys.stderr)
+            if divergencias_mensal:
+                raise SystemExit(1)
+            print(f"# DRE mensal x calcula_dre por período: ok ({rotulo})", file=sys.stderr)
+            divergencias_equilibrio = verificar_ponto_equilibrio(tenant)
+            if divergencias_equilibrio:
+                print(f"DIVERGÊNCIA PONTO DE EQUILÍBRIO: {divergencias_equilibrio} célula(s)", file=sys.stderr)
+                raise SystemExit(1)
+            print(f"# grade do ponto de equilíbrio x conta por célula: ok ({rotulo})", file=sys.stderr)
+            divergencias_rateio = verificar_rateio_evento(tenant)
+            if divergencias_rateio:
+                print(f"DIVERGÊNCIA RATEIO DE EVENTO: {divergencias_rateio} venda(s)", file=sys.stderr)
+                raise SystemExit(1)
+            print(f"# rateio de evento vetorizado x iterrows: ok ({rotulo})", file=sys.stderr)
+            divergencias_saldo = verificar_livro_saldos(tenant)
+            if divergencias_saldo:
+                print(f"DIVERGÊNCIA LIVRO DE SALDOS: {divergencias_saldo} variante(s)", file=sys.stderr)
+                raise SystemExit(1)
+            print(f"# livro de saldos x calcula_estoque_final: ok ({rotulo})", file=sys.stderr)
+            divergencias_resumo = verificar_resumo_diario(tenant)
+            for divergencia in divergencias_resumo:
+                print("DIVERGÊNCIA RESUMO DIÁRIO:", divergencia, file=sys.stderr)
+            if divergencias_resumo:
+                raise SystemExit(1)
+            print(f"# resumo diário x vendas linha a linha (Dashboard): ok ({rotulo})", file=sys.stderr)
+            divergencias_importacao = verificar_importacao_estoque(tenant)
+            if divergencias_importacao:
+                print(f"DIVERGÊNCIA IMPORTAÇÃO DE ESTOQUE: {divergencias_importacao} variante(s)", file=sys.stderr)
+                raise SystemExit(1)
+            print(f"# importação de estoque x livro de saldos: ok ({rotulo})", file=sys.stderr)
+            divergencias_datas = verificar_datas_importacao(tenant)
+            if divergencias_datas:
+                print(f"DIVERGÊNCIA DATAS DA IMPORTAÇÃO: {divergencias_datas} linha(s)", file=sys.stderr)
+                raise SystemExit(1)
+            print(f"# datas da importação (ISO, XLSX e dd/mm/aaaa): ok ({rotulo})", file=sys.stderr)
+            divergencias_diario = verificar_diario(tenant)
+            for divergencia in divergencias_diario:
+                print("DIVERGÊNCIA DIÁRIO DE VENDAS:", divergencia, file=sys.stderr)
+            if divergencias_diario:
+                raise SystemExit(1)
+            print(f"# diário de vendas offline, resposta perdida e reenvio: ok ({rotulo})", file=sys.stderr)
+            divergencias_espelho = verificar_espelho(tenant)
+            for divergencia in divergencias_espelho:
+                print("DIVERGÊNCIA ESPELHO:", divergencia, file=sys.stderr)
+            if divergencias_espelho:
+                raise SystemExit(1)
+            print(f"# espelho: deltas sem count exato, exclusão externa no count da janela: ok ({rotulo})", file=sys.stderr)
+            popular_supabase_local(cliente, tenant)
+            app.invalida_tabelas(int(tenant['empresas']['id'].iloc[0]), *tenant)
+            app.reconcilia_espelhos(int(tenant['empresas']['id'].iloc[0]), *tenant)
+        for nome, func, preparar in casos_de_benchmark(tenant):
+            if casos and nome not in casos:
+                continue
+            tempos, resultado = cronometrar(func, preparar, repeticoes)
+            if isinstance(resultado, tuple):
+                resultado = resultado[0]
+            linhas = len(resultado) if hasattr(resultado, '__len__') else None
+            resultados.append({
+                'caso': nome, 'tamanho': rotulo, 'vendas': n, 'linhas_resultado': linhas,
+                'melhor_s': min(tempos), 'mediana_s': statistics.median(tempos),
+            })
+            print(f"{nome:32s} {rotulo:>5s}  melhor {min(tempos):9.4f}s  mediana {statistics.median(tempos):9.4f}s  linhas={linhas}")
+    return resultados
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tamanhos', default='1k,100k', help=f"faixas separadas por vírgula ({', '.join(TAMANHOS)})")
+    parser.add_argument('--casos', default='', help='casos separados por vírgula (padrão: todos)')
+    parser.add_argument('--repeticoes', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--max-rows', type=int, default=1000, help='limite de linhas por resposta do stand-in (PostgREST usa 1000)')
+    parser.add_argument('--latencia-ms', type=float, default=0.0, help='latência simulada por chamada ao backend')
+    parser.add_argument('--saida', default='', help='grava os resultados em JSON neste arquivo')
+    parser.add_argument('--verificar', action='store_true', help='confere DRE via RPC, rateio de evento e livro de saldos contra as referências')
+    args = parser.parse_args(argv)
+
+    tamanhos = [t.strip().lower() for t in args.tamanhos.split(',') if t.strip()]
+    invalidos = [t for t in tamanhos if t not in TAMANHOS]
+    if invalidos:
+        parser.error(f"tamanho(s) desconhecido(s): {', '.join(invalidos)}")
+    casos = {c.strip() for c in args.casos.split(',') if c.strip()}
+
+    resultados = executar(tamanhos, casos, args.repeticoes, args.seed, args.max_rows, args.latencia_ms, args.verificar)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Diário local de vendas (SQLite) com sincronização em segundo plano.
+
+Em feira a conexão cai. A venda é gravada primeiro aqui, em disco e na hora, com uma
+chave de idempotência; um worker envia as pendentes em lotes para `vendas` e as marca
+como sincronizadas. Reenviar um lote que já chegou (resposta perdida no caminho) não
+duplica nada: o upsert usa a chave de idempotência e ignora as que já existem.
+
+Erros de conexão só adiam a próxima tentativa (espera exponencial). Outros erros contam
+tentativas na venda; depois de MAX_TENTATIVAS ela sai do envio automático até alguém
+pedir para tentar de novo.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from itertools import groupby
+
+MAX_TENTATIVAS = 5
+
+_ESQUEMA = """
+create table if not exists vendas_diario (
+    chave_idempotencia text primary key,
+    empresa_id integer not null,
+    dados text not null,
+    criado_em real not null,
+    tentativas integer not null default 0,
+    ultimo_erro text,
+    sincronizado_em real
+);
+create index if not exists vendas_diario_pendentes on vendas_diario (sincronizado_em, criado_em);
+"""
+
+
+def erro_transitorio(erro):
+    """Falha de rede/tempo (tenta de novo sem contar tentativa), e não um erro da própria venda."""
+    if isinstance(erro, (ConnectionError, TimeoutError)):
+        return True
+    return any(classe.__module__.split('.')[0] in ('httpx', 'httpcore') for classe in type(erro).__mro__)
+
+
+class DiarioVendas:
+    """Vendas registradas localmente, pendentes ou já sincronizadas."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        if os.path.dirname(caminho):
+            os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with self._conexao() as conexao:
+            conexao.execute("pragma journal_mode=wal")
+            conexao.executescript(_ESQUEMA)
+
+    @contextmanager
+    def _conexao(self):
+        """Conexão curta (commit ao sair): o worker e os reruns do Streamlit rodam em threads diferentes."""
+        conexao = sqlite3.connect(self.caminho, timeout=30)
+        try:
+            conexao.execute("pragma synchronous=full")
+            with conexao:
+                yield conexao
+        finally:
+            conexao.close()
+
+    def registrar(self, empresa_id, dados):
+        """Grava a venda (commit em disco antes de voltar). Retorna a chave de idempotência."""
+        chave = str(uuid.uuid4())
+        with self._conexao() as conexao:
+            conexao.execute(
+                "insert into vendas_diario (chave_idempotencia, empresa_id, dados, criado_em) values (?, ?, ?, ?)",
+                (chave, empresa_id, json.dumps(dados, default=str), time.time())
+            )
+        return chave
+
+    def pendentes(self, empresa_id=None, limite=None, max_tentativas=None):
+        """[(chave, empresa_id, dados)] ainda não sincronizadas, na ordem em que foram registradas."""
+        sql = "select chave_idempotencia, empresa_id, dados from vendas_diario where sincronizado_em is null"
+        parametros = []
+        if empresa_id is not None:
+            sql += " and empresa_id = ?"
+            parametros.append(empresa_id)
+        if max_tentativas is not None:
+            sql += " and tentativas < ?"
+            parametros.append(max_tentativas)
+        sql += " order by criado_em"
+        if limite is not None:
+            sql += " limit ?"
+            parametros.append(limite)
+        with self._conexao() as conexao:
+            return [(chave, empresa, json.loads(dados)) for chave, empresa, dados in conexao.execute(sql, parametros)]
+
+    def marcar_sincronizadas(self, chaves):
+        with self._conexao() as conexao:
+            conexao.executemany(
+                "update vendas_diario set sincronizado_em = ?, ultimo_erro = null where chave_idempotencia = ?",
+                [(time.time(), chave) for chave in chaves]
+            )
+
+    def marcar_falha(self, chaves, erro, contar_tentativa=True):
+        with self._conexao() as conexao:
+            conexao.executemany(
+                "update vendas_diario set tentativas = tentativas + ?, ultimo_erro = ? where chave_idempotencia = ?",
+                [(int(contar_tentativa), str(erro)[:500], chave) for chave in chaves]
+            )
+
+    def liberar_com_erro(self, empresa_id):
+        """Zera as tentativas das vendas que saíram do envio automático, para tentar de novo."""
+        with self._conexao() as conexao:
+            conexao.execute(
+                "update vendas_diario set tentativas = 0 where empresa_id = ? and sincronizado_em is null", (empresa_id,)
+            )
+
+    def contagens(self, empresa_id, max_tentativas=MAX_TENTATIVAS):
+        """{'pendentes', 'com_erro', 'sincronizadas'}; com_erro são as pendentes fora do envio automático."""
+        with self._conexao() as conexao:
+            pendentes, com_erro, sincronizadas = conexao.execute(
+                "select"
+                " coalesce(sum(sincronizado_em is null and tentativas < ?), 0),"
+                " coalesce(sum(sincronizado_em is null and tentativas >= ?), 0),"
+                " coalesce(sum(sincronizado_em is not null), 0)"
+                " from vendas_diario where empresa_id = ?",
+                (max_tentativas, max_tentativas, empresa_id)
+            ).fetchone()
+        return {'pendentes': pendentes, 'com_erro': com_erro, 'sincronizadas': sincronizadas}
+
+    def ultimo_erro(self, empresa_id):
+        with self._conexao() as conexao:
+            linha = conexao.execute(
+                "select ultimo_erro from vendas_diario where empresa_id = ? and sincronizado_em is null"
+                " and ultimo_erro is not null order by criado_em limit 1", (empresa_id,)
+            ).fetchone()
+        return linha[0] if linha else None
+
+
+class SincronizadorVendas:
+    """Worker que envia as vendas pendentes do diário em lotes.
+
+    `enviar(empresa_id, registros)` grava uma lista de (chave, empresa_id, dados) no backend
+    e marca as chaves como sincronizadas no diário; se levantar exceção, nada foi confirmado.
+    """
+
+    def __init__(self, diario, enviar, tamanho_lote=200, intervalo=5.0, espera_maxima=300.0):
+        self.diario = diario
+        self.enviar = enviar
+        self.tamanho_lote = tamanho_lote
+        self.intervalo = intervalo
+        self.espera_maxima = espera_maxima
+        self.falhas_seguidas = 0
+        self.ultima_sincronizacao = None
+        self._acordar = threading.Event()
+        self._passada = threading.Lock()
+        self._thread = None
+
+    def iniciar(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._laco, name="sincronizador-vendas", daemon=True)
+            self._thread.start()
+        return self
+
+    def acordar(self):
+        """Pede uma passada já (ex.: logo depois de registrar uma venda)."""
+        self._acordar.set()
+
+    def _laco(self):
+        while True:
+            espera = self.intervalo if not self.falhas_seguidas else min(self.intervalo * 2 ** self.falhas_seguidas, self.espera_maxima)
+            self._acordar.wait(espera)
+            self._acordar.clear()
+            try:
+                self.sincronizar()
+            except Exception:
+                # O worker não pode morrer; a falha fica registrada nas vendas e na próxima passada
+                self.falhas_seguidas += 1
+
+    def sincronizar(self):
+        """Uma passada: envia as pendentes em lotes até acabar ou cair a conexão. Retorna quantas foram sincronizadas."""
+        with self._passada:
+            enviadas, recusadas = 0, set()
+            while lote := [r for r in self.diario.pendentes(limite=self.tamanho_lote + len(recusadas), max_tentativas=MAX_TENTATIVAS)
+                           if r[0] not in recusadas][:self.tamanho_lote]:
+                for empresa_id, registros in groupby(sorted(lote, key=lambda r: r[1]), key=lambda r: r[1]):
+                    registros = list(registros)
+                    if self._envia(empresa_id, registros, recusadas) == 'sem_conexao':
+                        self.falhas_seguidas += 1
+                        return enviadas
+                    enviadas += len([r for r in registros if r[0] not in recusadas])
+            self.falhas_seguidas = 0
+            self.ultima_sincronizacao = time.time()
+            return enviadas
+
+    def _envia(self, empresa_id, registros, recusadas):
+        """'ok', 'sem_conexao' ou 'recusada'. Um lote recusado é reenviado venda a venda para isolar a culpada."""
+        try:
+            self.enviar(empresa_id, registros)
+            return 'ok'
+        except Exception as e:
+            if erro_transitorio(e):
+                self.diario.marcar_falha([chave for chave, _, _ in registros], e, contar_tentativa=False)
+                return 'sem_conexao'
+            if len(registros) == 1:
+                self.diario.marcar_falha([registros[0][0]], e)
+                recusadas.add(registros[0][0])
+                return 'recusada'
+        for registro in registros:
+            if self._envia(empresa_id, [registro], recusadas) == 'sem_conexao':
+                return 'sem_conexao'
+        return 'ok'
@@ -0,0 +1,267 @@
+"""Pipeline das imagens do estoque (Pillow).
+
+No upload, a imagem é validada e gravada assim:
+    dados/{empresa_id}/imagens_estoque/{chave_variante}.jpg                original em JPEG, já na orientação do EXIF (detalhe)
+    dados/{empresa_id}/imagens_estoque/miniaturas/{chave_variante}.jpg     miniatura TAMANHO_MINIATURA
+    dados/{empresa_id}/imagens_estoque/miniaturas/{chave_variante}.webp    a mesma miniatura em WebP
+
+Um JPEG sem rotação no EXIF é gravado byte a byte; PNG, WebP, GIF etc. e fotos com rotação
+são regravados em JPEG (transparência sobre fundo branco). As miniaturas saem recortadas no
+tamanho fixo, então o catálogo embute alguns KB por card em vez da foto original.
+
+Backfill das imagens já existentes (normaliza originais gravados antes disso, que podem ser
+PNG com extensão .jpg ou estar deitados, e gera só as miniaturas que faltam ou estão velhas):
+    python imagens_estoque.py
+    python imagens_estoque.py --raiz dados --empresa 1 --forcar
+"""
+import argparse
+import base64
+import glob
+import io
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+ORIENTACAO_EXIF = 0x0112
+TAMANHO_MINIATURA = (360, 360)  # 2x o card de 180px do catálogo
+QUALIDADE_JPEG = 82
+QUALIDADE_ORIGINAL = 90
+QUALIDADE_WEBP = 78
+PASTA_MINIATURAS = "miniaturas"
+FUNDO_TRANSPARENCIA = (255, 255, 255)
+
+
+def pasta_imagens(empresa_id, raiz="dados"):
+    return os.path.join(raiz, str(empresa_id), "imagens_estoque")
+
+
+def caminhos_imagem(pasta, chave_variante):
+    """Caminhos do original e das miniaturas (jpg e webp) de uma variante."""
+    pasta_miniaturas = os.path.join(pasta, PASTA_MINIATURAS)
+    return {
+        'original': os.path.join(pasta, f"{chave_variante}.jpg"),
+        'miniatura': os.path.join(pasta_miniaturas, f"{chave_variante}.jpg"),
+        'webp': os.path.join(pasta_miniaturas, f"{chave_variante}.webp"),
+    }
+
+
+def formato_imagem(caminho):
+    """Formato do Pillow ('JPEG', 'PNG', 'WEBP'...) lido do conteúdo do arquivo, não da extensão."""
+    try:
+        with Image.open(caminho) as imagem:
+            return imagem.format
+    except (UnidentifiedImageError, OSError):
+        return None
+
+
+def mime_imagem(caminho):
+    """Mime do arquivo pelo conteúdo; None se não for uma imagem legível."""
+    return Image.MIME.get(formato_imagem(caminho))
+
+
+def _grava_atomico(caminho, dados):
+    """Grava num temporário e troca de nome, para ninguém ler um arquivo pela metade."""
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = f"{caminho}.tmp"
+    with open(temporario, "wb") as f:
+        f.write(dados)
+    os.replace(temporario, caminho)
+
+
+def _sem_alfa(imagem):
+    """RGB, com a transparência (se houver) pintada sobre FUNDO_TRANSPARENCIA."""
+    tem_alfa = imagem.mode in ('RGBA', 'LA') or (imagem.mode == 'P' and 'transparency' in imagem.info)
+    if not tem_alfa:
+        return imagem.convert('RGB')
+    imagem = imagem.convert('RGBA')
+    rgb = Image.new('RGB', imagem.size, FUNDO_TRANSPARENCIA)
+    rgb.paste(imagem, mask=imagem.getchannel('A'))
+    return rgb
+
+
+def _original_jpeg(conteudo):
+    """Conteúdo do original como JPEG na orientação certa, ou None se o upload já está assim."""
+    with Image.open(io.BytesIO(conteudo)) as imagem:
+        orientacao = imagem.getexif().get(ORIENTACAO_EXIF, 1)
+        if imagem.format == 'JPEG' and orientacao == 1:
+            return None
+        icc = imagem.info.get('icc_profile')
+        imagem = _sem_alfa(ImageOps.exif_transpose(imagem))
+    saida = io.BytesIO()
+    opcoes = {'icc_profile': icc} if icc else {}
+    imagem.save(saida, 'JPEG', quality=QUALIDADE_ORIGINAL, optimize=True, progressive=True, **opcoes)
+    return saida.getvalue()
+
+
+def normaliza_original(caminho_original):
+    """Regrava em JPEG e na orientação certa um original antigo. Retorna True se regravou."""
+    with open(caminho_original, "rb") as f:
+        jpeg = _original_jpeg(f.read())
+    if jpeg is None:
+        return False
+    _grava_atomico(caminho_original, jpeg)
+    return True
+
+
+def _miniatura(imagem):
+    """Aplica a orientação do EXIF e recorta no tamanho fixo. Retorna (RGB para JPEG, RGB/RGBA para WebP)."""
+    imagem = ImageOps.exif_transpose(imagem)
+    tem_alfa = imagem.mode in ('RGBA', 'LA') or (imagem.mode == 'P' and 'transparency' in imagem.info)
+    imagem = imagem.convert('RGBA' if tem_alfa else 'RGB')
+    imagem = ImageOps.fit(imagem, TAMANHO_MINIATURA, method=Image.Resampling.LANCZOS)
+    if not tem_alfa:
+        return imagem, imagem
+    rgb = Image.new('RGB', imagem.size, FUNDO_TRANSPARENCIA)
+    rgb.paste(imagem, mask=imagem.getchannel('A'))
+    return rgb, imagem
+
+
+def gera_miniaturas(caminho_original, pasta, chave_variante):
+    """Gera as miniaturas JPEG e WebP a partir do original gravado. Retorna os caminhos."""
+    caminhos = caminhos_imagem(pasta, chave_variante)
+    with Image.open(caminho_original) as imagem:
+        imagem.draft('RGB', (TAMANHO_MINIATURA[0] * 2, TAMANHO_MINIATURA[1] * 2))  # JPEG grande decodifica reduzido
+        miniatura_jpeg, miniatura_webp = _miniatura(imagem)
+    for caminho, miniatura, formato, opcoes in (
+        (caminhos['miniatura'], miniatura_jpeg, 'JPEG', {'quality': QUALIDADE_JPEG, 'optimize': True, 'progressive': True}),
+        (caminhos['webp'], miniatura_webp, 'WEBP', {'quality': QUALIDADE_WEBP, 'method': 4}),
+    ):
+        saida = io.BytesIO()
+        miniatura.save(saida, formato, **opcoes)
+        _grava_atomico(caminho, saida.getvalue())
+    return caminhos
+
+
+def salva_imagem_estoque(conteudo, pasta, chave_variante):
+    """Valida o upload, grava o original (em JPEG, já rotacionado) e gera as miniaturas.
+
+    Levanta ValueError se o conteúdo não for uma imagem que o Pillow consiga abrir.
+    """
+    try:
+        with Image.open(io.BytesIO(conteudo)) as imagem:
+            imagem.verify()
+        jpeg = _original_jpeg(conteudo)
+    except (UnidentifiedImageError, OSError, SyntaxError) as e:
+        raise ValueError(f"Arquivo de imagem inválido: {e}") from e
+    caminhos = caminhos_imagem(pasta, chave_variante)
+    _grava_atomico(caminhos['original'], conteudo if jpeg is None else jpeg)
+    return gera_miniaturas(caminhos['original'], pasta, chave_variante)
+
+
+def imagem_para_card(pasta, chave_variante):
+    """(caminho, mime) da menor imagem disponível para o card; (None, None) se não houver.
+
+    Antes do backfill, cai no original, que pode ser um PNG antigo gravado como .jpg;
+    por isso o mime vem do conteúdo do arquivo.
+    """
+    caminhos = caminhos_imagem(pasta, chave_variante)
+    for chave in ('webp', 'miniatura', 'original'):
+        mime = mime_imagem(caminhos[chave])
+        if mime:
+            return caminhos[chave], mime
+    return None, None
+
+
+class CacheImagens:
+    """LRU de imagens em base64, limitado em bytes e chaveado por (caminho, mtime, tamanho).
+
+    Uma imagem reenviada para o mesmo caminho muda mtime/tamanho, gera uma chave nova e a
+    entrada antiga do caminho é descartada na hora. Vale igual para miniatura e original.
+    """
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self.bytes = 0
+        self.acertos = self.faltas = self.descartes = 0
+        self._entradas = OrderedDict()  # (caminho, mtime_ns, tamanho) -> base64
+        self._chave_por_caminho = {}
+        self._lock = threading.Lock()
+
+    def base64(self, caminho):
+        """Conteúdo do arquivo em base64, ou None se ele não existir."""
+        try:
+            info = os.stat(caminho)
+        except FileNotFoundError:
+            return None
+        chave = (caminho, info.st_mtime_ns, info.st_size)
+        with self._lock:
+            if chave in self._entradas:
+                self._entradas.move_to_end(chave)
+                self.acertos += 1
+                return self._entradas[chave]
+            self.faltas += 1
+        with open(caminho, "rb") as f:
+            codificado = base64.b64encode(f.read()).decode()
+        with self._lock:
+            self._remove(self._chave_por_caminho.get(caminho))
+            if len(codificado) <= self.limite_bytes:
+                self._entradas[chave] = codificado
+                self._chave_por_caminho[caminho] = chave
+                self.bytes += len(codificado)
+                while self.bytes > self.limite_bytes:
+                    self._remove(next(iter(self._entradas)))
+                    self.descartes += 1
+        return codificado
+
+    def _remove(self, chave):
+        if chave in self._entradas:
+            self.bytes -= len(self._entradas.pop(chave))
+            del self._chave_por_caminho[chave[0]]
+
+    def estatisticas(self):
+        with self._lock:
+            return {
+                'entradas': len(self._entradas), 'bytes': self.bytes, 'limite_bytes': self.limite_bytes,
+                'acertos': self.acertos, 'faltas': self.faltas, 'descartes': self.descartes,
+            }
+
+
+def miniaturas_em_dia(caminho_original, pasta, chave_variante):
+    caminhos = caminhos_imagem(pasta, chave_variante)
+    mtime_original = os.path.getmtime(caminho_original)
+    return all(
+        os.path.exists(caminhos[chave]) and os.path.getmtime(caminhos[chave]) >= mtime_original
+        for chave in ('miniatura', 'webp')
+    )
+
+
+def backfill(raiz="dados", empresa_id=None, forcar=False, saida=sys.stdout):
+    """Normaliza os originais e gera as miniaturas das imagens já existentes. Retorna (geradas, em_dia, erros).
+
+    Um original regravado ganha mtime novo, então as miniaturas dele saem de novo.
+    """
+    empresas = [str(empresa_id)] if empresa_id is not None else ['*']
+    geradas = em_dia = erros = 0
+    for empresa in empresas:
+        for caminho_original in sorted(glob.glob(os.path.join(raiz, empresa, "imagens_estoque", "*.jpg"))):
+            pasta = os.path.dirname(caminho_original)
+            chave_variante = os.path.splitext(os.path.basename(caminho_original))[0]
+            try:
+                normaliza_original(caminho_original)
+                if not forcar and miniaturas_em_dia(caminho_original, pasta, chave_variante):
+                    em_dia += 1
+                    continue
+                gera_miniaturas(caminho_original, pasta, chave_variante)
+                geradas += 1
+            except (UnidentifiedImageError, OSError) as e:
+                erros += 1
+                print(f"erro em {caminho_original}: {e}", file=saida)
+    return geradas, em_dia, erros
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--raiz', default='dados', help='pasta com dados/{empresa_id}/imagens_estoque')
+    parser.add_argument('--empresa', type=int, default=None, help='só esta empresa (padrão: todas)')
+    parser.add_argument('--forcar', action='store_true', help='regera mesmo as miniaturas em dia')
+    args = parser.parse_args(argv)
+    geradas, em_dia, erros = backfill(args.raiz, args.empresa, args.forcar)
+    print(f"miniaturas geradas: {geradas} | já em dia: {em_dia} | erros: {erros}")
+    return 1 if erros else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
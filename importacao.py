@@ -0,0 +1,346 @@
+"""Importação em massa de planilhas (CSV/XLSX) para o Bambuar.
+
+Formato da planilha de estoque, uma linha por entrada:
+    produto | <uma coluna por atributo, ex.: Modelo, Cor, Tamanho> | quantidade | valor_custo | data_entrada | observacao
+
+`produto` é o nome do Produto Base (ou use `produto_base_id`). As colunas de atributo
+casam com os nomes de `atributo_tipos` e os valores com `atributo_valores`, sem
+diferenciar maiúsculas; células de atributos que o produto não tem ficam em branco.
+`data_entrada` e `observacao` são opcionais.
+
+Vendas vêm de exportações da maquininha/marketplace, com colunas de nomes variados:
+um mapeamento (campo de `vendas` -> coluna da exportação) as traz para o mesmo formato
+antes da validação.
+
+A validação é feita em bloco (merges sobre a planilha inteira) e devolve as linhas
+prontas para inserir e um relatório de erros por linha da planilha.
+"""
+import io
+import json
+from itertools import groupby
+from operator import itemgetter
+
+import numpy as np
+import pandas as pd
+
+COLUNAS_ESTOQUE = ['produto', 'produto_base_id', 'quantidade', 'valor_custo', 'data_entrada', 'observacao']
+APELIDOS_COLUNAS = {'custo': 'valor_custo', 'custo_unitario': 'valor_custo', 'data': 'data_entrada', 'observação': 'observacao'}
+PRIMEIRA_LINHA_DADOS = 2  # a linha 1 da planilha é o cabeçalho
+
+# Campos de vendas que a exportação pode preencher, com os nomes de coluna mais comuns
+CAMPOS_VENDAS = {
+    'produto': ['produto', 'nome_produto', 'item', 'descricao', 'descrição'],
+    'quantidade_vendida': ['quantidade_vendida', 'quantidade', 'qtd', 'qtde'],
+    'preco_venda': ['preco_venda', 'preço', 'preco', 'preco_unitario', 'preço unitário', 'valor_unitario', 'valor unitário'],
+    'desconto': ['desconto'],
+    'data_venda': ['data_venda', 'data', 'data da venda'],
+    'forma_pagamento': ['forma_pagamento', 'forma de pagamento', 'pagamento', 'meio de pagamento'],
+    'evento': ['evento', 'canal', 'loja'],
+    'observacao': ['observacao', 'observação', 'obs'],
+}
+CAMPOS_VENDAS_OBRIGATORIOS = ['produto', 'quantidade_vendida', 'preco_venda', 'forma_pagamento']
+COLUNAS_CUSTO_EVENTO = ['aluguel', 'estacionamento', 'alimentacao', 'outros_custos']
+
+
+def le_planilha(nome_arquivo, conteudo):
+    """DataFrame (tudo como texto) de um CSV ou XLSX. Levanta ValueError se não der para ler."""
+    try:
+        if nome_arquivo.lower().endswith(('.xlsx', '.xls')):
+            return pd.read_excel(io.BytesIO(conteudo), dtype=str)
+        texto = conteudo.decode('utf-8-sig')
+        # Excel em português salva CSV com ';'
+        cabecalho = texto.split('\n', 1)[0]
+        separador = ';' if cabecalho.count(';') > cabecalho.count(',') else ','
+        return pd.read_csv(io.StringIO(texto), sep=separador, dtype=str)
+    except ImportError as e:
+        raise ValueError(f"Para importar .xlsx instale o openpyxl ({e}).") from e
+    except (UnicodeDecodeError, pd.errors.ParserError, pd.errors.EmptyDataError, OSError) as e:
+        raise ValueError(f"Não foi possível ler a planilha: {e}") from e
+
+
+def _normaliza_colunas(df):
+    """Colunas fixas em minúsculas (com apelidos resolvidos); colunas de atributo só sem espaços nas pontas."""
+    nomes = {}
+    for coluna in df.columns:
+        nome = str(coluna).strip()
+        fixo = APELIDOS_COLUNAS.get(nome.lower(), nome.lower())
+        nomes[coluna] = fixo if fixo in COLUNAS_ESTOQUE else nome
+    df = df.rename(columns=nomes)
+    repetidas = df.columns[df.columns.duplicated()].unique().tolist()
+    if repetidas:
+        raise ValueError(f"Coluna(s) repetida(s) na planilha: {', '.join(map(str, repetidas))}.")
+    return df
+
+
+def _texto(serie):
+    """Texto sem espaços nas pontas; vazio vira NaN."""
+    texto = serie.astype('string').str.strip()
+    return texto.mask((texto == '').fillna(True))
+
+
+def _numero(serie):
+    """Número a partir de texto em formato brasileiro ('1.234,56') ou simples ('1234.56')."""
+    texto = _texto(serie)
+    brasileiro = texto.str.contains(',', regex=False, na=False)
+    texto = texto.mask(brasileiro, texto.str.replace('.', '', regex=False).str.replace(',', '.', regex=False))
+    return pd.to_numeric(texto, errors='coerce')
+
+
+def _erros(linhas, mensagens):
+    return pd.DataFrame({'linha': linhas, 'erro': mensagens})
+
+
+def _consolida_erros(erros):
+    """Um registro por linha da planilha, com todos os motivos juntos."""
+    df_erros = pd.concat(erros, ignore_index=True)
+    return df_erros.groupby('linha', sort=True)['erro'].agg('; '.join).reset_index()
+
+
+def _resolve_produto(df, df_produtos_base, linha_planilha, erros):
+    """id do Produto Base de cada linha (NaN quando não encontrado), pelo id ou pelo nome sem diferenciar maiúsculas."""
+    if 'produto_base_id' in df.columns:
+        produto_ids = _numero(df['produto_base_id'])
+        produto_ids = produto_ids.where(produto_ids.isin(df_produtos_base['id']))
+        referencia_produto = _texto(df['produto_base_id'])
+    else:
+        ids_por_nome = dict(zip(df_produtos_base['nome_produto'].str.strip().str.lower(), df_produtos_base['id']))
+        referencia_produto = _texto(df['produto'])
+        produto_ids = referencia_produto.str.lower().map(ids_por_nome).astype(float)
+    sem_produto = produto_ids.isna()
+    erros.append(_erros(linha_planilha[sem_produto], "produto '" + referencia_produto[sem_produto].fillna('') + "' não encontrado"))
+    return produto_ids
+
+
+def _inteiro_positivo(df, coluna, linha_planilha, erros):
+    valores = _numero(df[coluna])
+    invalido = valores.isna() | (valores < 1) | (valores % 1 != 0)
+    erros.append(_erros(linha_planilha[invalido], f"{coluna} deve ser um inteiro maior que zero"))
+    return valores
+
+
+def _data(df, coluna, data_padrao, linha_planilha, erros):
+    """Datas da coluna; células vazias ou coluna ausente ficam com data_padrao.
+
+    ISO (inclusive o texto de uma célula de data do XLSX lido como str) vem primeiro; só o que
+    não for ISO é lido com o dia primeiro (dd/mm/aaaa), senão 2024-03-05 viraria 3 de maio.
+    """
+    datas = pd.Series(pd.Timestamp(data_padrao), index=df.index)
+    if coluna in df.columns:
+        texto_data = _texto(df[coluna])
+        lidas = pd.to_datetime(texto_data, errors='coerce', format='ISO8601')
+        nao_iso = texto_data.notna() & lidas.isna()
+        if nao_iso.any():
+            lidas[nao_iso] = pd.to_datetime(texto_data[nao_iso], errors='coerce', dayfirst=True, format='mixed')
+        erros.append(_erros(linha_planilha[texto_data.notna() & lidas.isna()], f"{coluna} inválida"))
+        datas = lidas.fillna(datas)
+    return datas
+
+
+def _resolve_atributos(df, colunas_atributo, produto_ids, df_atributo_tipos, df_atributo_valores, linha_planilha, erros):
+    """Confere as células de atributo contra atributo_tipos/atributo_valores do produto de cada linha.
+
+    Retorna as células aceitas em formato longo (pos, ordem, nome_atributo, valor_cadastrado);
+    os problemas vão para `erros`.
+    """
+    if df_atributo_tipos.empty:
+        df_atributo_tipos = pd.DataFrame(columns=['id', 'produto_base_id', 'nome_atributo'])
+    if df_atributo_valores.empty:
+        df_atributo_valores = pd.DataFrame(columns=['atributo_tipo_id', 'valor'])
+
+    # Atributos em formato longo: (posição, atributo, valor) só das células preenchidas
+    celulas = (
+        df[colunas_atributo].apply(_texto).rename_axis('pos').reset_index()
+        .melt(id_vars='pos', var_name='coluna', value_name='valor').dropna(subset=['valor'])
+    )
+    celulas['chave_atributo'] = celulas['coluna'].str.lower()
+    celulas = celulas[produto_ids.notna().to_numpy()[celulas['pos'].to_numpy()]]
+
+    tipos = df_atributo_tipos[['id', 'produto_base_id', 'nome_atributo']].rename(columns={'id': 'atributo_tipo_id'})
+    tipos = tipos.assign(chave_atributo=tipos['nome_atributo'].str.strip().str.lower(), ordem=tipos.groupby('produto_base_id').cumcount())
+    com_produto = produto_ids.dropna()
+    exigidos = pd.DataFrame({'pos': com_produto.index, 'produto_base_id': com_produto.to_numpy()}).merge(tipos, on='produto_base_id', how='left')
+
+    sem_atributos = exigidos['atributo_tipo_id'].isna()
+    erros.append(_erros(linha_planilha[exigidos.loc[sem_atributos, 'pos']].to_numpy(), "o produto não tem atributos definidos"))
+    exigidos = exigidos[~sem_atributos]
+
+    cruzados = exigidos.merge(celulas[['pos', 'chave_atributo', 'coluna', 'valor']], on=['pos', 'chave_atributo'], how='outer', indicator=True)
+    faltam = cruzados[cruzados['_merge'] == 'left_only']
+    erros.append(_erros(linha_planilha[faltam['pos']].to_numpy(), "falta o atributo '" + faltam['nome_atributo'] + "'"))
+    sobram = cruzados[cruzados['_merge'] == 'right_only']
+    erros.append(_erros(linha_planilha[sobram['pos']].to_numpy(), "o produto não tem o atributo '" + sobram['coluna'] + "'"))
+
+    # Valores: casa sem diferenciar maiúsculas e grava como está cadastrado
+    valores = df_atributo_valores[['atributo_tipo_id', 'valor']].rename(columns={'valor': 'valor_cadastrado'})
+    valores = valores.assign(chave_valor=valores['valor_cadastrado'].str.strip().str.lower()).drop_duplicates(['atributo_tipo_id', 'chave_valor'])
+    preenchidos = cruzados[cruzados['_merge'] == 'both'].drop(columns='_merge')
+    preenchidos = preenchidos.assign(chave_valor=preenchidos['valor'].str.lower()).merge(valores, on=['atributo_tipo_id', 'chave_valor'], how='left')
+    desconhecidos = preenchidos[preenchidos['valor_cadastrado'].isna()]
+    erros.append(_erros(
+        linha_planilha[desconhecidos['pos']].to_numpy(),
+        "valor '" + desconhecidos['valor'] + "' não cadastrado para '" + desconhecidos['nome_atributo'] + "'"
+    ))
+    return preenchidos.dropna(subset=['valor_cadastrado'])[['pos', 'ordem', 'nome_atributo', 'valor_cadastrado']]
+
+
+def _json_atributos(preenchidos, posicoes):
+    """{pos: (json na ordem dos atributo_tipos, como o formulário grava; chave canônica com sort_keys)}."""
+    preenchidos = preenchidos[preenchidos['pos'].isin(posicoes)].sort_values(['pos', 'ordem'])
+    atributos = {}
+    for pos, itens in groupby(zip(preenchidos['pos'], preenchidos['nome_atributo'], preenchidos['valor_cadastrado']), key=itemgetter(0)):
+        attrs = {nome: valor for _, nome, valor in itens}
+        atributos[pos] = (json.dumps(attrs), json.dumps(attrs, sort_keys=True))
+    return atributos
+
+
+def valida_importacao_estoque(df_arquivo, df_produtos_base, df_atributo_tipos, df_atributo_valores, data_padrao):
+    """Valida a planilha de estoque inteira de uma vez.
+
+    Retorna (df_validas, df_erros): as linhas prontas para inserir em `estoque` (sem empresa_id)
+    e um erro por linha da planilha com problema (todos os motivos juntos).
+    Levanta ValueError se faltar uma coluna obrigatória.
+    """
+    df = _normaliza_colunas(df_arquivo).reset_index(drop=True)
+    if 'produto' not in df.columns and 'produto_base_id' not in df.columns:
+        raise ValueError("A planilha precisa de uma coluna 'produto' (ou 'produto_base_id').")
+    faltando = [coluna for coluna in ('quantidade', 'valor_custo') if coluna not in df.columns]
+    if faltando:
+        raise ValueError(f"Coluna(s) obrigatória(s) ausente(s): {', '.join(faltando)}.")
+
+    linha_planilha = pd.Series(df.index + PRIMEIRA_LINHA_DADOS, index=df.index)
+    erros = []
+    produto_ids = _resolve_produto(df, df_produtos_base, linha_planilha, erros)
+    quantidade = _inteiro_positivo(df, 'quantidade', linha_planilha, erros)
+    valor_custo = _numero(df['valor_custo'])
+    erros.append(_erros(linha_planilha[valor_custo.isna() | (valor_custo < 0)], "valor_custo deve ser um número maior ou igual a zero"))
+    data_entrada = _data(df, 'data_entrada', data_padrao, linha_planilha, erros)
+    colunas_atributo = [coluna for coluna in df.columns if coluna not in COLUNAS_ESTOQUE]
+    preenchidos = _resolve_atributos(df, colunas_atributo, produto_ids, df_atributo_tipos, df_atributo_valores, linha_planilha, erros)
+
+    df_erros = _consolida_erros(erros)
+    validas = ~linha_planilha.isin(df_erros['linha'])
+    atributos = _json_atributos(preenchidos, df.index[validas])
+
+    observacao = _texto(df['observacao']).fillna('') if 'observacao' in df.columns else pd.Series('', index=df.index)
+    df_validas = pd.DataFrame({
+        'linha': linha_planilha[validas].to_numpy(),
+        'produto_base_id': produto_ids[validas].to_numpy(dtype='int64'),
+        'atributos': np.array([atributos[pos][0] for pos in df.index[validas]], dtype=object),
+        'quantidade': quantidade[validas].to_numpy(dtype='int64'),
+        'valor_custo': valor_custo[validas].to_numpy(dtype=float),
+        'data_entrada': data_entrada[validas].dt.strftime('%Y-%m-%d').to_numpy(dtype=object),
+        'observacao': observacao[validas].to_numpy(dtype=object),
+    })
+    return df_validas, df_erros
+
+
+def modelo_planilha_estoque(df_produtos_base, df_atributo_tipos):
+    """CSV de exemplo com uma linha por produto e as colunas de atributo de todos eles."""
+    nomes_atributo = list(dict.fromkeys(df_atributo_tipos['nome_atributo'])) if not df_atributo_tipos.empty else []
+    colunas = ['produto'] + nomes_atributo + ['quantidade', 'valor_custo', 'data_entrada', 'observacao']
+    modelo = pd.DataFrame({'produto': df_produtos_base['nome_produto'] if not df_produtos_base.empty else []}, columns=colunas)
+    return modelo.to_csv(index=False, sep=';').encode('utf-8-sig')
+
+
+def sugere_mapeamento_vendas(colunas_arquivo, nomes_atributo):
+    """Palpite de campo -> coluna da exportação pelos nomes mais comuns (e pelo nome de cada atributo)."""
+    por_nome = {str(coluna).strip().lower(): coluna for coluna in colunas_arquivo}
+    sugestao = {}
+    for campo, apelidos in CAMPOS_VENDAS.items():
+        sugestao[campo] = next((por_nome[apelido] for apelido in apelidos if apelido in por_nome), None)
+    for nome in nomes_atributo:
+        sugestao[nome] = por_nome.get(str(nome).strip().lower())
+    return sugestao
+
+
+def valida_importacao_vendas(df_arquivo, mapeamento, df_produtos_base, df_atributo_tipos, df_atributo_valores,
+                             df_taxas, df_eventos, saldos, data_padrao):
+    """Valida uma exportação de vendas inteira de uma vez e confere o saldo de cada variante.
+
+    `mapeamento` leva cada campo (os de CAMPOS_VENDAS e os nomes de atributo) à coluna da
+    exportação (ou None). `saldos` é o saldo atual por chave canônica de atributos.
+
+    Retorna (df_validas, df_erros, df_excesso): df_validas traz as linhas no formato de `vendas`
+    (sem empresa_id) mais 'linha', 'chave_variante' e 'acima_do_saldo'; df_excesso tem uma
+    linha por variante cuja soma importada passa do saldo.
+    Levanta ValueError se faltar um campo obrigatório no mapeamento.
+    """
+    faltando = [campo for campo in CAMPOS_VENDAS_OBRIGATORIOS if not mapeamento.get(campo)]
+    if faltando:
+        raise ValueError(f"Indique a coluna de: {', '.join(faltando)}.")
+    usados = {campo: coluna for campo, coluna in mapeamento.items() if coluna}
+    df = pd.DataFrame({campo: df_arquivo[coluna].to_numpy() for campo, coluna in usados.items()})
+
+    linha_planilha = pd.Series(df.index + PRIMEIRA_LINHA_DADOS, index=df.index)
+    erros = []
+    produto_ids = _resolve_produto(df, df_produtos_base, linha_planilha, erros)
+    quantidade = _inteiro_positivo(df, 'quantidade_vendida', linha_planilha, erros)
+    preco = _numero(df['preco_venda'])
+    erros.append(_erros(linha_planilha[preco.isna() | (preco <= 0)], "preco_venda deve ser maior que zero"))
+    desconto = _numero(df['desconto']) if 'desconto' in df.columns else pd.Series(0.0, index=df.index)
+    erros.append(_erros(linha_planilha[desconto < 0], "desconto não pode ser negativo"))
+    desconto = desconto.fillna(0.0)
+    data_venda = _data(df, 'data_venda', data_padrao, linha_planilha, erros)
+
+    # Forma de pagamento e taxa, casando sem diferenciar maiúsculas
+    taxas = df_taxas if not df_taxas.empty else pd.DataFrame(columns=['forma_pagamento', 'taxa_percentual'])
+    chave_taxa = taxas['forma_pagamento'].str.strip().str.lower()
+    forma_informada = _texto(df['forma_pagamento']).str.lower()
+    forma_pagamento = forma_informada.map(dict(zip(chave_taxa, taxas['forma_pagamento'])))
+    sem_forma = forma_pagamento.isna()
+    erros.append(_erros(linha_planilha[sem_forma], "forma de pagamento '" + _texto(df['forma_pagamento'])[sem_forma].fillna('') + "' não cadastrada"))
+    taxa_percentual = forma_informada.map(dict(zip(chave_taxa, taxas['taxa_percentual']))).astype(float).fillna(0.0)
+
+    # Evento: vazio é venda sem evento; o custo total do evento vai em cada venda, como no formulário
+    evento = pd.Series(np.nan, index=df.index, dtype=object)
+    custo_evento = pd.Series(0.0, index=df.index)
+    if 'evento' in df.columns:
+        evento_informado = _texto(df['evento'])
+        if not df_eventos.empty and 'nome_evento' in df_eventos.columns:
+            chave_evento = evento_informado.str.lower()
+            nomes_evento = df_eventos['nome_evento'].str.strip().str.lower()
+            custos = df_eventos.reindex(columns=COLUNAS_CUSTO_EVENTO).apply(pd.to_numeric, errors='coerce').fillna(0).sum(axis=1)
+            evento = chave_evento.map(dict(zip(nomes_evento, df_eventos['nome_evento'])))
+            custo_evento = chave_evento.map(dict(zip(nomes_evento, custos))).astype(float).fillna(0.0)
+        sem_evento = evento_informado.notna() & evento.isna()
+        erros.append(_erros(linha_planilha[sem_evento], "evento '" + evento_informado[sem_evento].fillna('') + "' não cadastrado"))
+    evento = evento.astype(object).where(evento.notna(), None)
+
+    colunas_atributo = [campo for campo in usados if campo not in CAMPOS_VENDAS]
+    preenchidos = _resolve_atributos(df, colunas_atributo, produto_ids, df_atributo_tipos, df_atributo_valores, linha_planilha, erros)
+
+    df_erros = _consolida_erros(erros)
+    validas = ~linha_planilha.isin(df_erros['linha'])
+    posicoes = df.index[validas]
+    atributos = _json_atributos(preenchidos, posicoes)
+
+    observacao = _texto(df['observacao']).fillna('') if 'observacao' in df.columns else pd.Series('', index=df.index)
+    df_validas = pd.DataFrame({
+        'linha': linha_planilha[validas].to_numpy(),
+        'chave_variante': np.array([atributos[pos][1] for pos in posicoes], dtype=object),
+        'produto_base_id': produto_ids[validas].to_numpy(dtype='int64'),
+        'atributos': np.array([atributos[pos][0] for pos in posicoes], dtype=object),
+        'quantidade_vendida': quantidade[validas].to_numpy(dtype='int64'),
+        'preco_venda': preco[validas].to_numpy(dtype=float),
+        'desconto': desconto[validas].to_numpy(dtype=float),
+        'data_venda': data_venda[validas].dt.strftime('%Y-%m-%d').to_numpy(dtype=object),
+        'evento': evento[validas].to_numpy(dtype=object),
+        'custo_evento': custo_evento[validas].to_numpy(dtype=float),
+        'forma_pagamento': forma_pagamento[validas].to_numpy(dtype=object),
+        'taxa_pagamento': (preco * quantidade * taxa_percentual / 100)[validas].to_numpy(dtype=float),
+        'percentual_taxa_pagamento': taxa_percentual[validas].to_numpy(dtype=float),
+        'observacao': observacao[validas].to_numpy(dtype=object),
+    })
+
+    # Saldo: soma importada por variante contra o saldo atual, numa passada só
+    por_variante = df_validas.groupby('chave_variante', sort=False).agg(
+        produto_base_id=('produto_base_id', 'first'),
+        quantidade_importada=('quantidade_vendida', 'sum'),
+        linhas=('linha', lambda linhas: ', '.join(map(str, linhas))),
+    )
+    por_variante['saldo'] = por_variante.index.map(saldos).fillna(0).astype('int64')
+    por_variante['excesso'] = por_variante['quantidade_importada'] - por_variante['saldo']
+    df_excesso = por_variante[por_variante['excesso'] > 0].reset_index()
+    df_excesso['variante'] = [' | '.join(json.loads(chave).values()) for chave in df_excesso['chave_variante']]
+    df_validas['acima_do_saldo'] = df_validas['chave_variante'].isin(df_excesso['chave_variante'])
+    return df_validas, df_erros, df_excesso[['produto_base_id', 'variante', 'saldo', 'quantidade_importada', 'excesso', 'linhas']]
@@ -0,0 +1,21 @@
+-- Restrições únicas para o upsert nativo das configurações (UnidadeDeTrabalho.upsert no app):
+--   * taxas_pagamento: uma taxa por (empresa, forma de pagamento)  -> on_conflict=empresa_id,forma_pagamento
+--   * comissao: uma linha por empresa                               -> on_conflict=empresa_id
+-- O antigo "delete + insert" podia deixar duplicatas; fica a de maior id, que é a mais recente.
+
+delete from public.taxas_pagamento a
+using public.taxas_pagamento b
+where a.empresa_id = b.empresa_id
+  and a.forma_pagamento = b.forma_pagamento
+  and a.id < b.id;
+
+create unique index if not exists taxas_pagamento_empresa_forma_key
+    on public.taxas_pagamento (empresa_id, forma_pagamento);
+
+delete from public.comissao a
+using public.comissao b
+where a.empresa_id = b.empresa_id
+  and a.id < b.id;
+
+create unique index if not exists comissao_empresa_key
+    on public.comissao (empresa_id);
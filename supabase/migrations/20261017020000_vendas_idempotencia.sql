@@ -0,0 +1,10 @@
+-- Chave de idempotência das vendas que chegam pelo diário offline (diario_vendas.py).
+-- O app envia upsert(..., on_conflict=chave_idempotencia, ignore_duplicates=True): reenviar
+-- um lote cuja resposta se perdeu não duplica a venda. Vendas antigas ficam com null
+-- (nulls não conflitam entre si num índice único).
+
+alter table public.vendas
+    add column if not exists chave_idempotencia text;
+
+create unique index if not exists vendas_chave_idempotencia_key
+    on public.vendas (chave_idempotencia);
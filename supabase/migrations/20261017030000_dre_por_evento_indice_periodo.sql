@@ -0,0 +1,73 @@
+-- dre_por_evento com o período filtrado direto na coluna e um índice (empresa_id, data_venda).
+--
+-- Com `data_venda::date between ...` o Postgres precisava converter cada venda da empresa
+-- antes de comparar, então o tempo crescia com o histórico inteiro. Comparar a coluna com
+-- os limites (p_fim + 1 exclusivo, o dia de p_fim inteiro) deixa o índice abaixo restringir
+-- a leitura às vendas do período. As datas continuam no fuso da sessão, como no ::date.
+-- O resto da função é igual a 20261017000000_dre_por_evento.sql.
+
+create index if not exists vendas_empresa_data_venda
+    on public.vendas (empresa_id, data_venda);
+
+create or replace function public.dre_por_evento(
+    p_empresa_id bigint,
+    p_inicio date,
+    p_fim date,
+    p_comissao numeric
+)
+returns table (
+    evento text,
+    quantidade_vendas bigint,
+    receita_bruta numeric,
+    descontos numeric,
+    custo_estoque numeric,
+    comissoes numeric,
+    taxas numeric,
+    custo_evento_rateado numeric
+)
+language sql
+stable
+security invoker
+as $$
+    with vendas_periodo as (
+        select v.id, v.evento, v.produto_base_id, v.quantidade_vendida, v.preco_venda,
+               v.desconto, v.taxa_pagamento, v.custo_evento
+        from public.vendas v
+        where v.empresa_id = p_empresa_id
+          and v.data_venda >= p_inicio
+          and v.data_venda < p_fim + 1
+    ),
+    custos_medios as (
+        select e.produto_base_id, avg(e.valor_custo) as custo_unitario
+        from public.estoque e
+        where e.empresa_id = p_empresa_id
+        group by e.produto_base_id
+    ),
+    vendido_por_evento as (
+        select vp.evento, sum(vp.quantidade_vendida) as total_vendido
+        from vendas_periodo vp
+        where vp.evento is not null
+        group by vp.evento
+    )
+    select
+        vp.evento,
+        count(*) as quantidade_vendas,
+        coalesce(sum(vp.preco_venda * vp.quantidade_vendida), 0) as receita_bruta,
+        coalesce(sum(vp.desconto), 0) as descontos,
+        coalesce(sum(coalesce(cm.custo_unitario, 0) * vp.quantidade_vendida), 0) as custo_estoque,
+        coalesce(sum(vp.preco_venda * vp.quantidade_vendida * p_comissao), 0) as comissoes,
+        coalesce(sum(coalesce(vp.taxa_pagamento, 0)), 0) as taxas,
+        coalesce(sum(
+            case when coalesce(ve.total_vendido, 1) > 0
+                 then coalesce(vp.custo_evento, 0) / coalesce(ve.total_vendido, 1) * vp.quantidade_vendida
+                 else 0
+            end
+        ), 0) as custo_evento_rateado
+    from vendas_periodo vp
+    left join custos_medios cm on cm.produto_base_id = vp.produto_base_id
+    left join vendido_por_evento ve on ve.evento = vp.evento
+    group by vp.evento
+    order by min(vp.id);
+$$;
+
+grant execute on function public.dre_por_evento(bigint, date, date, numeric) to authenticated;
@@ -0,0 +1,413 @@
+"""Stand-in em memória do cliente Supabase/PostgREST usado pelo Bambuar V3.
+
+Implementa o subconjunto da API que o app usa (table/select/filtros/insert/update/
+delete/upsert/range/order/limit/single/rpc) para rodar o app e os benchmarks sem rede.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class RespostaLocal:
+    """Equivalente ao APIResponse do postgrest: expõe .data e .count."""
+
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+class ErroLocal(Exception):
+    """Erro devolvido pelo stand-in (equivalente ao APIError do postgrest, inclusive o .code)."""
+
+    def __init__(self, mensagem, code=None):
+        super().__init__(mensagem)
+        self.code = code
+
+
+class SemConexaoLocal(ConnectionError):
+    """Chamada feita com o stand-in offline (equivalente ao httpx.ConnectError)."""
+
+
+_OPERADORES = {
+    'eq': lambda v, x: v == x,
+    'neq': lambda v, x: v != x,
+    'gt': lambda v, x: v is not None and v > x,
+    'gte': lambda v, x: v is not None and v >= x,
+    'lt': lambda v, x: v is not None and v < x,
+    'lte': lambda v, x: v is not None and v <= x,
+    'in': lambda v, x: v in x,
+    'is': lambda v, x: v is x,
+}
+
+
+def _atende(registro, filtros):
+    return all(_OPERADORES[op](registro.get(coluna), valor) for op, coluna, valor in filtros)
+
+
+def _chave_ordem(valor, desc, nullsfirst):
+    # Padrão do Postgres: NULLS LAST em ordem crescente e NULLS FIRST em decrescente
+    nulos_primeiro = desc if nullsfirst is None else nullsfirst
+    marca_nulo = int(nulos_primeiro == desc)
+    if valor is None:
+        return (marca_nulo, 0)
+    return (1 - marca_nulo, valor)
+
+
+class ConsultaLocal:
+    """Query builder encadeável, no mesmo estilo de supabase.table(...)."""
+
+    def __init__(self, cliente, tabela):
+        self._cliente = cliente
+        self._tabela = tabela
+        self._operacao = 'select'
+        self._colunas = '*'
+        self._count = None
+        self._payload = None
+        self._on_conflict = 'id'
+        self._ignorar_duplicatas = False
+        self._filtros = []
+        self._ordem = []
+        self._limite = None
+        self._inicio = None
+        self._fim = None
+        self._single = False
+
+    # --- Operações ---
+    def select(self, colunas='*', count=None):
+        self._operacao = 'select'
+        self._colunas = colunas
+        self._count = count
+        return self
+
+    def insert(self, dados):
+        self._operacao = 'insert'
+        self._payload = dados
+        return self
+
+    def upsert(self, dados, on_conflict='id', ignore_duplicates=False):
+        self._operacao = 'upsert'
+        self._payload = dados
+        self._on_conflict = on_conflict
+        self._ignorar_duplicatas = ignore_duplicates
+        return self
+
+    def update(self, dados):
+        self._operacao = 'update'
+        self._payload = dados
+        return self
+
+    def delete(self):
+        self._operacao = 'delete'
+        return self
+
+    # --- Filtros ---
+    # Guardados como (operador, coluna, valor) para que consultas iguais possam
+    # reaproveitar o resultado já filtrado e ordenado (ver LocalSupabase._selecionar).
+    def _filtro(self, operador, coluna, valor):
+        self._filtros.append((operador, coluna, valor))
+        return self
+
+    def eq(self, coluna, valor):
+        return self._filtro('eq', coluna, valor)
+
+    def neq(self, coluna, valor):
+        return self._filtro('neq', coluna, valor)
+
+    def gt(self, coluna, valor):
+        return self._filtro('gt', coluna, valor)
+
+    def gte(self, coluna, valor):
+        return self._filtro('gte', coluna, valor)
+
+    def lt(self, coluna, valor):
+        return self._filtro('lt', coluna, valor)
+
+    def lte(self, coluna, valor):
+        return self._filtro('lte', coluna, valor)
+
+    def in_(self, coluna, valores):
+        return self._filtro('in', coluna, frozenset(valores))
+
+    def is_(self, coluna, valor):
+        esperado = {'null': None, 'true': True, 'false': False}.get(str(valor).lower(), valor)
+        return self._filtro('is', coluna, esperado)
+
+    def match(self, criterios):
+        for coluna, valor in criterios.items():
+            self.eq(coluna, valor)
+        return self
+
+    # --- Modificadores ---
+    def order(self, coluna, desc=False, nullsfirst=None):
+        self._ordem.append((coluna, desc, nullsfirst))
+        return self
+
+    def limit(self, n):
+        self._limite = n
+        return self
+
+    def range(self, inicio, fim):
+        self._inicio, self._fim = inicio, fim
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def execute(self):
+        return self._cliente._executar(self)
+
+
+class LocalSupabase:
+    """Cliente em memória compatível com o uso que o app faz do supabase-py.
+
+    `max_rows` reproduz o limite de linhas por resposta do PostgREST (1000 no Supabase)
+    e `latencia` simula o tempo de ida e volta de cada chamada, em segundos.
+    Com `online = False` toda chamada falha com SemConexaoLocal; `respostas_perdidas = n`
+    faz as próximas n escritas serem gravadas mas falharem na volta, como uma resposta
+    que se perdeu na rede. count='exact' é contado em `contagens_exatas`; 'planned' e
+    'estimated' devolvem o total com o desvio relativo `erro_estimativa`, como uma
+    estatística do planner desatualizada.
+    """
+
+    def __init__(self, max_rows=1000, latencia=0.0):
+        self.max_rows = max_rows
+        self.latencia = latencia
+        self.chamadas = 0
+        self.online = True
+        self.respostas_perdidas = 0
+        self.contagens_exatas = 0
+        self.erro_estimativa = 0.0
+        self._tabelas = {}
+        self._proximo_id = {}
+        self._geracao = {}
+        self._selecoes = {}
+        self._rpcs = dict(RPCS_PADRAO)
+        self._lock = threading.Lock()
+
+    # --- API pública (mesmos nomes do supabase-py) ---
+    def table(self, nome):
+        return ConsultaLocal(self, nome)
+
+    def from_(self, nome):
+        return self.table(nome)
+
+    def rpc(self, nome, params=None):
+        cliente = self
+
+        class _ChamadaRpc:
+            def execute(self_rpc):
+                cliente._registrar_chamada()
+                if nome not in cliente._rpcs:
+                    raise ErroLocal(f"Função '{nome}' não encontrada", code='PGRST202')
+                return RespostaLocal(cliente._rpcs[nome](cliente, **(params or {})))
+
+        return _ChamadaRpc()
+
+    # --- Utilitários do stand-in ---
+    def registrar_rpc(self, nome, func):
+        """Registra uma função Python que responde a supabase.rpc(nome, params)."""
+        self._rpcs[nome] = func
+
+    def carregar_tabela(self, nome, linhas):
+        """Substitui o conteúdo da tabela pelas linhas (lista de dicts) informadas."""
+        linhas = [dict(linha) for linha in linhas]
+        with self._lock:
+            self._tabelas[nome] = linhas
+            ids = [linha['id'] for linha in linhas if isinstance(linha.get('id'), int)]
+            self._proximo_id[nome] = (max(ids) if ids else 0) + 1
+            self._alterada(nome)
+
+    def linhas(self, nome):
+        """Cópia rasa das linhas atuais da tabela (para inspeção em benchmarks)."""
+        with self._lock:
+            return list(self._tabelas.get(nome, []))
+
+    # --- Execução ---
+    def _registrar_chamada(self):
+        if self.latencia:
+            time.sleep(self.latencia)
+        if not self.online:
+            raise SemConexaoLocal("stand-in offline")
+        with self._lock:
+            self.chamadas += 1
+
+    def _perde_resposta(self):
+        with self._lock:
+            if self.respostas_perdidas <= 0:
+                return False
+            self.respostas_perdidas -= 1
+            return True
+
+    def _novo_registro(self, tabela, dados):
+        registro = dict(dados)
+        if registro.get('id') is None:
+            registro['id'] = self._proximo_id.get(tabela, 1)
+        self._proximo_id[tabela] = max(self._proximo_id.get(tabela, 1), registro['id'] + 1)
+        registro.setdefault('created_at', datetime.now(timezone.utc).isoformat())
+        return registro
+
+    def _alterada(self, tabela):
+        self._geracao[tabela] = self._geracao.get(tabela, 0) + 1
+        self._selecoes = {k: v for k, v in self._selecoes.items() if k[0] != tabela}
+
+    def _selecionar(self, consulta):
+        """Linhas filtradas e ordenadas, memorizadas por consulta até a próxima escrita na tabela.
+
+        Faz o papel de um índice: as páginas seguintes de um mesmo range() custam O(página).
+        """
+        chave = (consulta._tabela, self._geracao.get(consulta._tabela, 0),
+                 tuple(consulta._filtros), tuple(consulta._ordem))
+        if chave not in self._selecoes:
+            selecionadas = [r for r in self._tabelas[consulta._tabela] if _atende(r, consulta._filtros)]
+            for coluna, desc, nullsfirst in reversed(consulta._ordem):
+                selecionadas.sort(key=lambda r: _chave_ordem(r.get(coluna), desc, nullsfirst), reverse=desc)
+            self._selecoes[chave] = selecionadas
+        return self._selecoes[chave]
+
+    def _executar(self, consulta):
+        self._registrar_chamada()
+        resposta = self._aplicar(consulta)
+        if consulta._operacao != 'select' and self._perde_resposta():
+            raise SemConexaoLocal("resposta perdida depois de gravar")
+        return resposta
+
+    def _aplicar(self, consulta):
+        with self._lock:
+            linhas = self._tabelas.setdefault(consulta._tabela, [])
+            op = consulta._operacao
+
+            if op in ('insert', 'upsert'):
+                payload = consulta._payload if isinstance(consulta._payload, list) else [consulta._payload]
+                chaves = [c.strip() for c in consulta._on_conflict.split(',')]
+                resultado = []
+                for dados in payload:
+                    existente = None
+                    if op == 'upsert' and all(dados.get(c) is not None for c in chaves):
+                        existente = next((r for r in linhas if all(r.get(c) == dados[c] for c in chaves)), None)
+                    if existente is not None and consulta._ignorar_duplicatas:
+                        continue  # on conflict do nothing: a linha existente não volta na resposta
+                    if existente is not None:
+                        existente.update(dados)
+                        resultado.append(dict(existente))
+                    else:
+                        registro = self._novo_registro(consulta._tabela, dados)
+                        linhas.append(registro)
+                        resultado.append(dict(registro))
+                self._alterada(consulta._tabela)
+                return RespostaLocal(resultado)
+
+            if op == 'update':
+                selecionadas = [r for r in linhas if _atende(r, consulta._filtros)]
+                for registro in selecionadas:
+                    registro.update(consulta._payload)
+                self._alterada(consulta._tabela)
+                return RespostaLocal([dict(r) for r in selecionadas])
+
+            if op == 'delete':
+                selecionadas = [r for r in linhas if _atende(r, consulta._filtros)]
+                ids_removidos = {id(r) for r in selecionadas}
+                self._tabelas[consulta._tabela] = [r for r in linhas if id(r) not in ids_removidos]
+                self._alterada(consulta._tabela)
+                return RespostaLocal([dict(r) for r in selecionadas])
+
+            selecionadas = self._selecionar(consulta)
+            total = len(selecionadas)
+            if consulta._inicio is not None:
+                selecionadas = selecionadas[consulta._inicio:consulta._fim + 1]
+            if consulta._limite is not None:
+                selecionadas = selecionadas[:consulta._limite]
+            if self.max_rows is not None:
+                selecionadas = selecionadas[:self.max_rows]
+
+            dados = [self._projetar(r, consulta._colunas) for r in selecionadas]
+
+        if consulta._single:
+            if len(dados) != 1:
+                raise ErroLocal(f"single() esperava 1 linha, recebeu {len(dados)}")
+            dados = dados[0]
+        if consulta._count == 'exact':
+            with self._lock:
+                self.contagens_exatas += 1
+        elif consulta._count:
+            total = int(total * (1 + self.erro_estimativa))  # planned/estimated: estatística do planner
+        return RespostaLocal(dados, total if consulta._count else None)
+
+    def _projetar(self, registro, colunas):
+        """Aplica a projeção do select, incluindo recursos embutidos como 'empresas(nome_empresa)'."""
+        if colunas.strip() == '*':
+            return dict(registro)
+        resultado = {}
+        for item in _separar_colunas(colunas):
+            if '(' in item:
+                recurso, sub = item[:-1].split('(', 1)
+                recurso = recurso.strip()
+                chave_fk = recurso.rstrip('s') + '_id'
+                relacionado = next((r for r in self._tabelas.get(recurso, []) if r.get('id') == registro.get(chave_fk)), None)
+                resultado[recurso] = self._projetar(relacionado, sub) if relacionado else None
+            elif item == '*':
+                resultado.update(registro)
+            else:
+                resultado[item] = registro.get(item)
+        return resultado
+
+
+def _separar_colunas(colunas):
+    """Divide 'a, b, emb(c, d)' respeitando parênteses."""
+    itens, atual, nivel = [], '', 0
+    for ch in colunas:
+        if ch == ',' and nivel == 0:
+            itens.append(atual.strip()); atual = ''
+            continue
+        nivel += ch == '('
+        nivel -= ch == ')'
+        atual += ch
+    if atual.strip():
+        itens.append(atual.strip())
+    return itens
+
+
+# --- Funções do banco (supabase/migrations) reproduzidas em Python ---
+
+def rpc_dre_por_evento(cliente, p_empresa_id, p_inicio, p_fim, p_comissao):
+    """Equivalente de public.dre_por_evento: agregados da DRE por evento no período."""
+    vendas = sorted(
+        (v for v in cliente.linhas('vendas')
+         if v.get('empresa_id') == p_empresa_id and v.get('data_venda')
+         and str(p_inicio) <= str(v['data_venda'])[:10] <= str(p_fim)),  # data_venda >= p_inicio and < p_fim + 1
+        key=lambda v: v['id']
+    )
+    soma_custo, contagem_custo = {}, {}
+    for e in cliente.linhas('estoque'):
+        if e.get('empresa_id') == p_empresa_id and e.get('valor_custo') is not None:
+            soma_custo[e['produto_base_id']] = soma_custo.get(e['produto_base_id'], 0) + e['valor_custo']
+            contagem_custo[e['produto_base_id']] = contagem_custo.get(e['produto_base_id'], 0) + 1
+    total_vendido = {}
+    for v in vendas:
+        if v.get('evento') is not None:
+            total_vendido[v['evento']] = total_vendido.get(v['evento'], 0) + v['quantidade_vendida']
+
+    linhas = {}
+    for v in vendas:
+        linha = linhas.setdefault(v.get('evento'), {
+            'evento': v.get('evento'), 'quantidade_vendas': 0, 'receita_bruta': 0.0, 'descontos': 0.0,
+            'custo_estoque': 0.0, 'comissoes': 0.0, 'taxas': 0.0, 'custo_evento_rateado': 0.0,
+        })
+        quantidade = v['quantidade_vendida']
+        receita = v['preco_venda'] * quantidade if v.get('preco_venda') is not None else 0  # sum() do SQL ignora nulos
+        produto = v.get('produto_base_id')
+        custo_unitario = soma_custo[produto] / contagem_custo[produto] if produto in contagem_custo else 0
+        divisor = total_vendido.get(v.get('evento'), 1)
+        linha['quantidade_vendas'] += 1
+        linha['receita_bruta'] += receita
+        linha['descontos'] += v.get('desconto') or 0
+        linha['custo_estoque'] += custo_unitario * quantidade
+        linha['comissoes'] += receita * p_comissao
+        linha['taxas'] += v.get('taxa_pagamento') or 0
+        linha['custo_evento_rateado'] += (v.get('custo_evento') or 0) / divisor * quantidade if divisor > 0 else 0
+    return list(linhas.values())
+
+
+RPCS_PADRAO = {
+    'dre_por_evento': rpc_dre_por_evento,
+}